@@ -1,351 +1,355 @@
 import streamlit as st
-import json
+from streamlit import runtime
 import os
-from pathlib import Path
+import sys
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from typing import List,Optional
 import pandas as pd
-from dataclasses import dataclass,field,asdict
-from typing import List,Optional,Dict,Any
-import re
-from io import BytesIO
-import base64
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter,A4
-from reportlab.platypus import SimpleDocTemplate,Table,TableStyle,Paragraph,Spacer
-from reportlab.lib.styles import getSampleStyleSheet,ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase.pdfmetrics import registerFontFamily
+from warehouse import Record,WarehouseManager,LANGS,IMPORT_COLUMNS,import_file,record_count
+from warehouse.analytics import REPORTS,Analytics,report_frame
+from warehouse.cli import main as cli
+from warehouse.metrics import METRICS,profile,timings_table,update_gauges
+from warehouse.search import normalize_doc
+from warehouse.reports import PDF_CACHE,pdf_key,generate_ledger_pdf,records_frame
 
-# Language support
-LANGS = {
-    'ro': {
-        'app_title': 'Gestiune Depozit',
-        'products': 'Produse',
-        'sheets': 'Foi',
-        'pages': 'Pagini',
-        'records': 'Înregistrări',
-        'add_product': 'Adaugă Produs',
-        'product_name': 'Nume Produs',
-        'measure_unit': 'Unitate Măsură',
-        'search': 'Căutare',
-        'delete': 'Șterge',
-        'add_sheet': 'Adaugă Foaie',
-        'year': 'An',
-        'month': 'Lună',
-        'add_page': 'Adaugă Pagină',
-        'unit_price': 'Preț Unitar',
-        'initial_stock': 'Stoc Inițial',
-        'add_record': 'Adaugă Înregistrare',
-        'day': 'Zi',
-        'doc_id': 'ID Document',
-        'doc_type': 'Tip Document',
-        'input': 'Intrare',
-        'output': 'Ieșire',
-        'final_stock': 'Stoc Final',
-        'comment': 'Comentariu',
-        'download_pdf': 'Descarcă PDF',
-        'no_data': 'Nu există date',
-        'select_product': 'Selectează produs',
-        'select_sheet': 'Selectează foaie',
-        'select_page': 'Selectează pagină',
-        'confirm_delete': 'Confirmă ștergerea',
-        'cancel': 'Anulează',
-        'language': 'Limbă',
-        'months': ['','Ian','Feb','Mar','Apr','Mai','Iun','Iul','Aug','Sep','Oct','Nov','Dec']
-    },
-    'en': {
-        'app_title': 'Warehouse Management',
-        'products': 'Products',
-        'sheets': 'Sheets',
-        'pages': 'Pages',
-        'records': 'Records',
-        'add_product': 'Add Product',
-        'product_name': 'Product Name',
-        'measure_unit': 'Measure Unit',
-        'search': 'Search',
-        'delete': 'Delete',
-        'add_sheet': 'Add Sheet',
-        'year': 'Year',
-        'month': 'Month',
-        'add_page': 'Add Page',
-        'unit_price': 'Unit Price',
-        'initial_stock': 'Initial Stock',
-        'add_record': 'Add Record',
-        'day': 'Day',
-        'doc_id': 'Document ID',
-        'doc_type': 'Document Type',
-        'input': 'Input',
-        'output': 'Output',
-        'final_stock': 'Final Stock',
-        'comment': 'Comment',
-        'download_pdf': 'Download PDF',
-        'no_data': 'No data available',
-        'select_product': 'Select product',
-        'select_sheet': 'Select sheet',
-        'select_page': 'Select page',
-        'confirm_delete': 'Confirm delete',
-        'cancel': 'Cancel',
-        'language': 'Language',
-        'months': ['','Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
-    }
-}
+def pdf_download(build,stamp,title:str,file_name:str,slot:str,L):
+    """Generate button that turns into a download button for a PDF of the
+    table `build()` returns.
+    
+    The table is only built, and the PDF made, once asked for; the PDF is
+    then served from PDF_CACHE until `stamp`, whatever the table is built
+    from, changes."""
+    lang=st.session_state.lang
+    state_key=f'pdf_{slot}'
+    stamp=(stamp,title,lang)
+    state=st.session_state.get(state_key)
+    if state is None or state[0]!=stamp:
+        if not st.button(L['generate_pdf'],key=f'generate_pdf_{slot}'):
+            return
+        data=build()
+        st.session_state[state_key]=(stamp,pdf_key(data,title,lang))
+        pdf=PDF_CACHE.get(data,title,lang)
+    else:
+        pdf=PDF_CACHE.peek(state[1]) or PDF_CACHE.get(build(),title,lang)
+    st.download_button(
+        label=L['download_pdf'],
+        data=pdf,
+        file_name=file_name,
+        mime='application/pdf',
+        key=f'download_pdf_{slot}'
+    )
 
-@dataclass
-class Record:
-    day:int
-    doc_id:str
-    doc_type:str
-    input:float=0.0
-    output:float=0.0
-    comment:str=""
-    initial_stock:float=0.0
-    final_stock:float=0.0
+def ledger_download(manager,product_id:Optional[str],slot:str,L):
+    """Generate button for the full ledger of a product, or of the whole
+    warehouse when `product_id` is None; the result stays downloadable until
+    another product is selected"""
+    state_key=f'ledger_{slot}'
+    if st.button(L['generate_ledger'],key=f'generate_ledger_{slot}'):
+        st.session_state[state_key]=(product_id,generate_ledger_pdf(manager.db,st.session_state.lang,product_id))
+    ledger=st.session_state.get(state_key)
+    if ledger is not None and ledger[0]==product_id:
+        st.download_button(
+            label=L['download_pdf'],
+            data=ledger[1],
+            file_name=f"ledger_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+            mime='application/pdf',
+            key=f'download_ledger_{slot}'
+        )
 
-@dataclass
-class Page:
-    unit_price:float
-    initial_stock:float
-    records:List[Record]=field(default_factory=list)
+def products_frame(products,L)->pd.DataFrame:
+    """Table of [(index, product)]"""
+    return pd.DataFrame([
+        {
+            L['product_name']:p.name,
+            L['measure_unit']:p.measure_unit,
+            L['sheets']:len(p.sheets)
+        } for _,p in products
+    ])
 
-@dataclass
-class Sheet:
-    year:int
-    month:int
-    pages:List[Page]=field(default_factory=list)
+def sheets_frame(sheets,L)->pd.DataFrame:
+    return pd.DataFrame([
+        {
+            L['year']:s.year,
+            L['month']:L['months'][s.month],
+            L['pages']:len(s.pages)
+        } for s in sheets
+    ])
 
-@dataclass
-class Product:
-    name:str
-    measure_unit:str
-    sheets:List[Sheet]=field(default_factory=list)
+def pages_frame(pages,L,start:int=0)->pd.DataFrame:
+    return pd.DataFrame([
+        {
+            'ID':i+1,
+            L['unit_price']:p.unit_price,
+            L['initial_stock']:p.initial_stock,
+            L['records']:record_count(p)
+        } for i,p in enumerate(pages,start=start)
+    ])
 
-@dataclass
-class Database:
-    products:List[Product]=field(default_factory=list)
+def sheet_labels(sheets,L)->dict:
+    return {s.id:f"{'🔒 ' if s.archive else ''}{s.year}-{L['months'][s.month]}" for s in sheets}
 
-class Observer:
-    def __init__(self):
-        self._observers=[]
-    def attach(self,observer):
-        self._observers.append(observer)
-    def notify(self):
-        for observer in self._observers:
-            observer()
+TABLE_ROWS=100
 
-class WarehouseManager:
-    def __init__(self,db_path:str):
-        self.db_path=Path(db_path)
-        self.db_path.parent.mkdir(parents=True,exist_ok=True)
-        self.observer=Observer()
-        self.load_data()
-    
-    def load_data(self):
-        if self.db_path.exists():
-            with open(self.db_path,'r',encoding='utf-8') as f:
-                data=json.load(f)
-                self.db=self._dict_to_db(data)
-        else:
-            self.db=Database()
-            self.save_data()
-    
-    def save_data(self):
-        with open(self.db_path,'w',encoding='utf-8') as f:
-            json.dump(self._db_to_dict(self.db),f,ensure_ascii=False,indent=2)
-        self.observer.notify()
-    
-    def _db_to_dict(self,db:Database)->Dict:
-        return asdict(db)
-    
-    def _dict_to_db(self,data:Dict)->Database:
-        products=[]
-        for p in data.get('products',[]):
-            sheets=[]
-            for s in p.get('sheets',[]):
-                pages=[]
-                for pg in s.get('pages',[]):
-                    records=[]
-                    for r in pg.get('records',[]):
-                        records.append(Record(**r))
-                    pages.append(Page(
-                        unit_price=pg['unit_price'],
-                        initial_stock=pg['initial_stock'],
-                        records=records
-                    ))
-                sheets.append(Sheet(
-                    year=s['year'],
-                    month=s['month'],
-                    pages=pages
-                ))
-            products.append(Product(
-                name=p['name'],
-                measure_unit=p['measure_unit'],
-                sheets=sheets
-            ))
-        return Database(products=products)
-    
-    def add_product(self,name:str,measure_unit:str):
-        self.db.products.append(Product(name,measure_unit))
-        self.save_data()
-    
-    def delete_product(self,index:int):
-        if 0 <= index < len(self.db.products):
-            del self.db.products[index]
-            self.save_data()
-    
-    def add_sheet(self,product_idx:int,year:int,month:int):
-        if 0 <= product_idx < len(self.db.products):
-            self.db.products[product_idx].sheets.append(Sheet(year,month))
-            self.save_data()
-    
-    def delete_sheet(self,product_idx:int,sheet_idx:int):
-        if (0 <= product_idx < len(self.db.products) and 
-            0 <= sheet_idx < len(self.db.products[product_idx].sheets)):
-            del self.db.products[product_idx].sheets[sheet_idx]
-            self.save_data()
-    
-    def add_page(self,product_idx:int,sheet_idx:int,unit_price:float,initial_stock:float):
-        if (0 <= product_idx < len(self.db.products) and 
-            0 <= sheet_idx < len(self.db.products[product_idx].sheets)):
-            self.db.products[product_idx].sheets[sheet_idx].pages.append(
-                Page(unit_price,initial_stock)
-            )
-            self.save_data()
-    
-    def delete_page(self,product_idx:int,sheet_idx:int,page_idx:int):
-        if (0 <= product_idx < len(self.db.products) and 
-            0 <= sheet_idx < len(self.db.products[product_idx].sheets) and
-            0 <= page_idx < len(self.db.products[product_idx].sheets[sheet_idx].pages)):
-            del self.db.products[product_idx].sheets[sheet_idx].pages[page_idx]
-            self.save_data()
-    
-    def add_record(self,product_idx:int,sheet_idx:int,page_idx:int,record:Record):
-        if (0 <= product_idx < len(self.db.products) and 
-            0 <= sheet_idx < len(self.db.products[product_idx].sheets) and
-            0 <= page_idx < len(self.db.products[product_idx].sheets[sheet_idx].pages)):
-            page=self.db.products[product_idx].sheets[sheet_idx].pages[page_idx]
-            if page.records:
-                record.initial_stock=page.records[-1].final_stock
-            else:
-                record.initial_stock=page.initial_stock
-            record.final_stock=record.initial_stock+record.input-record.output
-            page.records.append(record)
-            self.save_data()
-    
-    def delete_record(self,product_idx:int,sheet_idx:int,page_idx:int,record_idx:int):
-        if (0 <= product_idx < len(self.db.products) and 
-            0 <= sheet_idx < len(self.db.products[product_idx].sheets) and
-            0 <= page_idx < len(self.db.products[product_idx].sheets[sheet_idx].pages) and
-            0 <= record_idx < len(self.db.products[product_idx].sheets[sheet_idx].pages[page_idx].records)):
-            del self.db.products[product_idx].sheets[sheet_idx].pages[page_idx].records[record_idx]
-            self.recalculate_stocks(product_idx,sheet_idx,page_idx)
-            self.save_data()
-    
-    def recalculate_stocks(self,product_idx:int,sheet_idx:int,page_idx:int):
-        if (0 <= product_idx < len(self.db.products) and 
-            0 <= sheet_idx < len(self.db.products[product_idx].sheets) and
-            0 <= page_idx < len(self.db.products[product_idx].sheets[sheet_idx].pages)):
-            page=self.db.products[product_idx].sheets[sheet_idx].pages[page_idx]
-            for i,record in enumerate(page.records):
-                if i==0:
-                    record.initial_stock=page.initial_stock
-                else:
-                    record.initial_stock=page.records[i-1].final_stock
-                record.final_stock=record.initial_stock+record.input-record.output
-    
-    def search_products(self,pattern:str)->List[tuple]:
-        results=[]
-        try:
-            regex=re.compile(pattern,re.IGNORECASE)
-            for i,product in enumerate(self.db.products):
-                if regex.search(product.name):
-                    results.append((i,product))
-        except:
-            pass
-        return results
+def table_window(total:int,slot:str,L)->range:
+    """Rows of a `total`-row table to show, TABLE_ROWS at a time, so a
+    rerun renders the same amount however long the table is"""
+    if total<=TABLE_ROWS:
+        return range(total)
+    views=-(-total//TABLE_ROWS)
+    key=f'view_{slot}'
+    if st.session_state.get(key,1)>views:
+        st.session_state[key]=views
+    view=st.number_input(L['table_page'],min_value=1,max_value=views,step=1,key=key)
+    rows=range((view-1)*TABLE_ROWS,min(view*TABLE_ROWS,total))
+    st.caption(f"{rows.start+1}–{rows.stop} / {total}")
+    return rows
 
-def get_pdf_font():
-    try:
-        pdfmetrics.registerFont(TTFont('DejaVu','DejaVuSans.ttf'))
-        return 'DejaVu'
-    except:
-        return 'Helvetica'
+def selectable_table(df:pd.DataFrame,rows:range,slot:str,stamp,L)->List[int]:
+    """`df`, holding the table rows in `rows`, with a checkbox column;
+    returns the rows ticked. The ticks belong to `stamp` and are dropped
+    when it changes. `df` itself is left as it is."""
+    df=df.copy()
+    df.index=pd.RangeIndex(rows.start+1,rows.stop+1)
+    df.insert(0,L['select'],False)
+    edited=st.data_editor(df,use_container_width=True,disabled=list(df.columns[1:]),
+                          key=f'select_{slot}_{rows.start}_{hash(stamp)}')
+    return [rows[i] for i,ticked in enumerate(edited[L['select']]) if ticked]
 
-def generate_pdf(data:pd.DataFrame,title:str,lang:str)->bytes:
-    buffer=BytesIO()
-    doc=SimpleDocTemplate(buffer,pagesize=A4,topMargin=0.5*inch,bottomMargin=0.5*inch)
-    elements=[]
-    
-    font_name=get_pdf_font()
-    styles=getSampleStyleSheet()
-    title_style=ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        alignment=1,
-        spaceAfter=0.3*inch,
-        fontName=font_name
-    )
-    
-    elements.append(Paragraph(title,title_style))
-    elements.append(Spacer(1,0.2*inch))
-    
-    if not data.empty:
-        table_data=[list(data.columns)]+data.values.tolist()
-        col_widths=[doc.width/len(data.columns)]*len(data.columns)
-        
-        table=Table(table_data,colWidths=col_widths)
-        table.setStyle(TableStyle([
-            ('BACKGROUND',(0,0),(-1,0),colors.grey),
-            ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
-            ('ALIGN',(0,0),(-1,-1),'CENTER'),
-            ('FONTNAME',(0,0),(-1,0),font_name),
-            ('FONTSIZE',(0,0),(-1,0),10),
-            ('BOTTOMPADDING',(0,0),(-1,0),12),
-            ('BACKGROUND',(0,1),(-1,-1),colors.beige),
-            ('GRID',(0,0),(-1,-1),1,colors.black),
-            ('FONTNAME',(0,1),(-1,-1),font_name),
-            ('FONTSIZE',(0,1),(-1,-1),8),
-        ]))
-        elements.append(table)
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer.read()
-
-def handle_delete_confirmation(item_type: str, item_id: str, item_name: str, delete_function, L):
-    """Handle delete confirmation with proper state management"""
+def handle_delete_confirmation(item_type: str, selected: dict, delete_function, L):
+    """One delete button for the selected items ({id: name}), with confirmation"""
     
     # Initialize session state for pending deletes
     if 'pending_deletes' not in st.session_state:
         st.session_state.pending_deletes = {}
+    if not selected:
+        st.session_state.pending_deletes.pop(item_type, None)
+        return
     
-    delete_key = f"{item_type}_{item_id}"
-    
-    # Check if this item is pending deletion
-    if delete_key in st.session_state.pending_deletes:
-        st.warning(f"🗑️ {L['confirm_delete']}: {item_name}")
+    # Check if this selection is pending deletion
+    if st.session_state.pending_deletes.get(item_type) == list(selected):
+        names = list(selected.values())
+        st.warning(f"🗑️ {L['confirm_delete']}: {', '.join(names[:10])}{' …' if len(names) > 10 else ''}")
         col1, col2 = st.columns(2)
         
         with col1:
-            if st.button(f"✅ {L['confirm_delete']}", key=f"confirm_{delete_key}"):
-                delete_function()
-                # Remove from pending deletes
-                del st.session_state.pending_deletes[delete_key]
+            if st.button(f"✅ {L['confirm_delete']}", key=f"confirm_{item_type}"):
+                # Forget it first: deleting reruns the script
+                del st.session_state.pending_deletes[item_type]
+                delete_function(list(selected))
                 st.rerun()
         
         with col2:
-            if st.button(f"❌ {L['cancel']}", key=f"cancel_{delete_key}"):
-                # Remove from pending deletes
-                del st.session_state.pending_deletes[delete_key]
+            if st.button(f"❌ {L['cancel']}", key=f"cancel_{item_type}"):
+                del st.session_state.pending_deletes[item_type]
                 st.rerun()
     else:
         # Show delete button
-        if st.button(f"🗑️ {item_name}", key=f"delete_{delete_key}"):
-            # Add to pending deletes
-            st.session_state.pending_deletes[delete_key] = True
+        if st.button(f"🗑️ {L['delete_selected']} ({len(selected)})", key=f"delete_{item_type}"):
+            st.session_state.pending_deletes[item_type] = list(selected)
+            st.rerun()
+
+def delete_all(manager,delete,refs):
+    """Apply `delete` to each ref as one commit"""
+    with manager.batch():
+        for ref in refs:
+            delete(ref)
+
+def import_panel(manager,L):
+    """Sidebar form for bulk imports"""
+    with st.expander(L['bulk_import']):
+        kind=st.selectbox(L['import_kind'],list(IMPORT_COLUMNS),format_func=lambda k:L[k],key='import_kind')
+        st.caption(', '.join(IMPORT_COLUMNS[kind]))
+        uploaded=st.file_uploader(L['import_file'],type=['csv','xlsx'],key='import_file')
+        strict=st.checkbox(L['import_strict'],key='import_strict')
+        if uploaded is not None and st.button(L['run_import'],key='run_import'):
+            try:
+                report=import_file(manager,uploaded,kind,strict=strict)
+            except ValueError as e:
+                st.error(str(e))
+                return
+            st.success(f"{report.imported}/{report.rows} {L['imported_rows']}")
+            if report.errors:
+                st.dataframe(pd.DataFrame(report.errors[:1000],columns=['#','']),use_container_width=True)
+
+def close_periods_panel(manager,L):
+    """Sidebar form to archive past months (json and journal engines)"""
+    if not hasattr(manager.storage,'archive'):
+        return
+    with st.expander(L['close_periods']):
+        closed=manager.closed_through()
+        if closed:
+            st.caption(f"{L['closed_through']}: {closed[0]}-{L['months'][closed[1]]}")
+        year,month=period_input(L['close_through'],'close',L)
+        if st.button(L['close_periods'],key='run_close_periods'):
+            archived=manager.close_periods(year,month)
+            st.success(f"{archived} {L['sheets_archived']}")
+
+@st.cache_resource
+def shared_manager(db_path:str,storage:str,columnar:bool)->WarehouseManager:
+    """One manager per process, shared by every session. Code that changes
+    the data reruns the script itself where needed; other sessions pick
+    changes up through watch_changes."""
+    return WarehouseManager(db_path,storage=storage,columnar=columnar)
+
+class ViewCache:
+    """Views derived from the data (tables, option lists) by key, each
+    with the stamp of the data it was built from; rebuilt only once the
+    stamp moves. Shared by every session, so views must not be modified."""
+    def __init__(self,max_entries:int=256):
+        self.max_entries=max_entries
+        self._entries=OrderedDict()
+        self._lock=threading.Lock()
+    
+    def get(self,key,stamp,build):
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is not None and entry[0]==stamp:
+                self._entries.move_to_end(key)
+                METRICS.count('view.hit')
+                return entry[1]
+        METRICS.count('view.miss')
+        with METRICS.timer('view.'+(key[0] if isinstance(key,tuple) else key)):
+            value=build()
+        with self._lock:
+            self._entries[key]=(stamp,value)
+            self._entries.move_to_end(key)
+            while len(self._entries)>self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+@st.cache_resource
+def shared_views(db_path:str)->ViewCache:
+    return ViewCache()
+
+@st.cache_resource
+def shared_analytics(_manager:WarehouseManager,db_path:str)->Analytics:
+    return Analytics(_manager)
+
+def period_input(label:str,slot:str,L)->tuple:
+    """Year and month pickers side by side"""
+    now=datetime.now()
+    cols=st.columns(2)
+    year=cols[0].number_input(f"{label} - {L['year']}",min_value=1900,max_value=2100,value=now.year,key=f'{slot}_year')
+    month=cols[1].selectbox(f"{label} - {L['month']}",range(1,13),index=now.month-1,
+                            format_func=lambda m:L['months'][m],key=f'{slot}_month')
+    return int(year),month
+
+def documents_section(manager,views,L):
+    """Every record of a document (delivery note, invoice) across the warehouse"""
+    cols=st.columns(2)
+    doc_id=cols[0].text_input(L['doc_id'],key='find_doc_id').strip()
+    doc_type=cols[1].text_input(L['doc_type'],key='find_doc_type').strip()
+    if not doc_id and not doc_type:
+        st.info(L['find_document'])
+        return
+    def build():
+        hits=manager.find_documents(doc_id or None,doc_type or None)
+        return pd.DataFrame([{
+            L['product_name']:product.name,
+            L['year']:sheet.year,
+            L['month']:L['months'][sheet.month],
+            L['page']:next(n for n,p in enumerate(sheet.pages,start=1) if p is page),
+            L['position']:i+1,
+            L['day']:r.day,
+            L['doc_id']:r.doc_id,
+            L['doc_type']:r.doc_type,
+            L['input']:r.input,
+            L['output']:r.output,
+            L['comment']:r.comment,
+        } for product,sheet,page,i,r in hits])
+    table=views.get(('documents',normalize_doc(doc_id),normalize_doc(doc_type),st.session_state.lang),manager.version,build)
+    if table.empty:
+        st.info(L['no_data'])
+        return
+    rows=table_window(len(table),'documents',L)
+    st.dataframe(table.iloc[rows.start:rows.stop],use_container_width=True,hide_index=True)
+
+def analytics_section(manager,analytics,views,L):
+    """Warehouse-wide reports over the months picked, with a PDF export"""
+    kind=st.radio(L['report'],REPORTS,format_func=L.get,horizontal=True,key='report_kind')
+    start=period_input(L['period_from'],'report_from',L) if kind!='valuation' else None
+    end=period_input(L['period_to'],'report_to',L)
+    if start is not None and start>end:
+        start,end=end,start
+    lang=st.session_state.lang
+    table=views.get(('report',kind,start,end,lang),manager.version,
+                    lambda:report_frame(analytics.report(kind,start or end,end),L))
+    if table.empty:
+        st.info(L['no_data'])
+        return
+    st.dataframe(table,use_container_width=True,hide_index=True)
+    period=f"{L['months'][end[1]]} {end[0]}"
+    if start is not None and start!=end:
+        period=f"{L['months'][start[1]]} {start[0]} - {period}"
+    pdf_download(lambda:table,(manager.version,start,end),f"{L[kind]} - {period}",
+                 f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",f'report_{kind}',L)
+
+REFRESH_SECONDS=2
+
+def _watch_changes(manager):
+    version=manager.refresh()
+    if st.session_state.get('seen_version')!=version:
+        st.session_state.seen_version=version
+        st.rerun()
+
+# Older Streamlit has no fragments; sessions then refresh on their next interaction
+watch_changes=st.fragment(run_every=REFRESH_SECONDS)(_watch_changes) if hasattr(st,'fragment') else lambda manager:None
+
+def query_param(name:str)->Optional[str]:
+    if hasattr(st,'query_params'):
+        return st.query_params.get(name)
+    values=st.experimental_get_query_params().get(name)
+    return values[0] if values else None
+
+def diagnostics_panel(manager,L):
+    """Sidebar panel behind ?diagnostics=1: the metrics, the last rerun's
+    breakdown and a profile of the next rerun"""
+    with st.expander(L['diagnostics']):
+        enabled=st.checkbox(L['metrics_enabled'],value=METRICS.enabled,key='metrics_enabled')
+        if enabled!=METRICS.enabled:
+            METRICS.enable() if enabled else METRICS.disable()
+        if not METRICS.enabled:
+            return
+        update_gauges(manager)
+        data=METRICS.snapshot()
+        st.dataframe(pd.DataFrame([{'':name,'value':value} for name,value in data['gauges'].items()]),
+                     use_container_width=True,hide_index=True)
+        steps=st.session_state.get('rerun_steps')
+        if steps:
+            st.caption(L['last_rerun'])
+            st.dataframe(pd.DataFrame(timings_table(steps)),use_container_width=True,hide_index=True)
+        if data['timers']:
+            st.caption(L['timers'])
+            timers=pd.DataFrame([{'':name,'calls':t['calls'],'ms':round(t['seconds']*1000,2),
+                                  'max ms':round(t['max_seconds']*1000,2)} for name,t in data['timers'].items()])
+            st.dataframe(timers.sort_values('ms',ascending=False),use_container_width=True,hide_index=True)
+        st.download_button('Prometheus',data=METRICS.prometheus_text(),file_name='metrics.txt',
+                           mime='text/plain',key='download_metrics')
+        if st.button(L['profile_rerun'],key='profile_rerun'):
+            st.session_state.profile_next=True
             st.rerun()
+        stats=st.session_state.get('rerun_profile')
+        if stats:
+            st.download_button(L['download_profile'],data=stats,file_name='profile.txt',
+                               mime='text/plain',key='download_profile')
+
+def traced_main():
+    """main() as one 'rerun' timing, its breakdown kept for the diagnostics
+    panel; under cProfile when the panel asked for it"""
+    def rerun():
+        with METRICS.trace() as steps:
+            try:
+                with METRICS.timer('rerun'):
+                    main()
+            finally:
+                if steps:
+                    st.session_state.rerun_steps=steps
+    if st.session_state.pop('profile_next',False):
+        st.session_state.rerun_profile=profile(rerun)[1]
+    else:
+        rerun()
 
 def main():
     st.set_page_config(
@@ -356,13 +360,18 @@ def main():
     
     if 'lang' not in st.session_state:
         st.session_state.lang='ro'
-    if 'manager' not in st.session_state:
-        db_path=os.path.expanduser("~/WarehouseDB/db.json")
-        st.session_state.manager=WarehouseManager(db_path)
-        st.session_state.manager.observer.attach(lambda:st.rerun())
+    db_path=os.path.expanduser("~/WarehouseDB/db.json")
+    manager=shared_manager(
+        db_path,
+        os.environ.get('WAREHOUSE_STORAGE','json'),
+        os.environ.get('WAREHOUSE_COLUMNAR','')=='1'
+    )
+    views=shared_views(db_path)
+    st.session_state.seen_version=manager.refresh()
+    watch_changes(manager)
     
-    L=LANGS[st.session_state.lang]
-    manager=st.session_state.manager
+    lang=st.session_state.lang
+    L=LANGS[lang]
     
     with st.sidebar:
         st.selectbox(
@@ -372,15 +381,28 @@ def main():
             key='lang_selector',
             on_change=lambda:setattr(st.session_state,'lang',st.session_state.lang_selector)
         )
+        if st.button(L['recalculate_all']):
+            manager.recalculate_all()
+        ledger_download(manager,None,'all',L)
+        import_panel(manager,L)
+        close_periods_panel(manager,L)
+        if query_param('diagnostics')=='1':
+            diagnostics_panel(manager,L)
     
     st.title(f"📦 {L['app_title']}")
     
-    tab1,tab2,tab3,tab4=st.tabs([L['products'],L['sheets'],L['pages'],L['records']])
+    # Only the section on screen is built, unlike tabs which all render
+    sections=[L['products'],L['sheets'],L['pages'],L['records'],L['analytics'],L['documents']]
+    section=st.radio(L['app_title'],range(len(sections)),format_func=sections.__getitem__,
+                     horizontal=True,key='section',label_visibility='collapsed')
+    product_names=views.get('product_names',manager.stamp(),lambda:{p.id:p.name for p in manager.db.products})
     
-    with tab1:
+    if section==0:
         col1,col2=st.columns([3,1])
         with col1:
             search_pattern=st.text_input(L['search'],key='product_search')
+        with col2:
+            search_regex=st.checkbox(L['regex'],key='product_search_regex')
         
         with st.form('add_product_form'):
             cols=st.columns([2,2,1])
@@ -391,140 +413,123 @@ def main():
                     manager.add_product(name,unit)
                     st.rerun()
         
-        if search_pattern:
-            products=manager.search_products(search_pattern)
-        else:
-            products=[(i,p) for i,p in enumerate(manager.db.products)]
+        def search():
+            if search_pattern:
+                products=manager.search_products(search_pattern,regex=search_regex)
+            else:
+                products=[(i,p) for i,p in enumerate(manager.db.products)]
+            return products,products_frame(products,L)
         
+        # The table counts sheets, so any change may alter it
+        products,table=views.get(('products',lang,search_pattern,search_regex),manager.version,search)
         if products:
-            df=pd.DataFrame([
-                {
-                    L['product_name']:p.name,
-                    L['measure_unit']:p.measure_unit,
-                    L['sheets']:len(p.sheets)
-                } for _,p in products
-            ])
+            stamp=(manager.version,search_pattern,search_regex)
+            rows=table_window(len(products),'products',L)
+            ticked=selectable_table(table.iloc[rows.start:rows.stop],rows,'products',stamp,L)
             
-            st.dataframe(df,use_container_width=True)
+            pdf_download(lambda:table,stamp,L['products'],f"products_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",'products',L)
             
-            pdf_data=generate_pdf(df,L['products'],st.session_state.lang)
-            st.download_button(
-                label=L['download_pdf'],
-                data=pdf_data,
-                file_name=f"products_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                mime='application/pdf'
+            handle_delete_confirmation(
+                "product",
+                {products[i][1].id:products[i][1].name for i in ticked},
+                lambda product_ids: delete_all(manager,manager.delete_product,product_ids),
+                L
             )
-            
-            st.subheader(L['delete'])
-            for idx,(i,p) in enumerate(products):
-                handle_delete_confirmation(
-                    "product", 
-                    str(i), 
-                    p.name,
-                    lambda prod_idx=i: manager.delete_product(prod_idx),
-                    L
-                )
         else:
             st.info(L['no_data'])
     
-    with tab2:
-        if manager.db.products:
-            product_names=[p.name for p in manager.db.products]
-            selected_product=st.selectbox(L['select_product'],product_names)
-            product_idx=product_names.index(selected_product)
+    elif section==1:
+        if product_names:
+            product_id=st.selectbox(L['select_product'],list(product_names),format_func=product_names.get)
+            product=manager.get_product(product_id)
             
             with st.form('add_sheet_form'):
                 cols=st.columns([2,2,1])
                 year=cols[0].number_input(L['year'],min_value=2000,max_value=2100,value=datetime.now().year)
                 month=cols[1].selectbox(L['month'],range(1,13),format_func=lambda x:L['months'][x])
                 if cols[2].form_submit_button(L['add_sheet']):
-                    manager.add_sheet(product_idx,int(year),month)
-                    st.rerun()
+                    try:
+                        manager.add_sheet(product_id,int(year),month)
+                    except ValueError:
+                        st.error(L['closed_period'])
+                    else:
+                        st.rerun()
             
-            sheets=manager.db.products[product_idx].sheets
+            with st.expander(L['balance']):
+                cols=st.columns(3)
+                balance_year=cols[0].number_input(L['year'],min_value=2000,max_value=2100,value=datetime.now().year,key='balance_year')
+                balance_month=cols[1].selectbox(L['month'],range(1,13),index=datetime.now().month-1,
+                                                format_func=lambda x:L['months'][x],key='balance_month')
+                cols[2].metric(L['closing_balance'],
+                               f"{manager.closing_balance(product_id,int(balance_year),balance_month):g} {product.measure_unit}")
+            
+            ledger_download(manager,product_id,'product',L)
+            
+            sheets=product.sheets
             if sheets:
-                df=pd.DataFrame([
-                    {
-                        L['year']:s.year,
-                        L['month']:L['months'][s.month],
-                        L['pages']:len(s.pages)
-                    } for s in sheets
-                ])
+                stamp=manager.stamp(product_id)
+                table=views.get(('sheets',product_id,lang),stamp,lambda:sheets_frame(sheets,L))
+                rows=table_window(len(sheets),'sheets',L)
+                ticked=selectable_table(table.iloc[rows.start:rows.stop],rows,'sheets',stamp,L)
                 
-                st.dataframe(df,use_container_width=True)
+                pdf_download(lambda:table,stamp,f"{L['sheets']} - {product.name}",
+                             f"sheets_{product.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",'sheets',L)
                 
-                pdf_data=generate_pdf(df,f"{L['sheets']} - {selected_product}",st.session_state.lang)
-                st.download_button(
-                    label=L['download_pdf'],
-                    data=pdf_data,
-                    file_name=f"sheets_{selected_product}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                    mime='application/pdf'
+                handle_delete_confirmation(
+                    "sheet",
+                    {sheets[i].id:f"{sheets[i].year}-{L['months'][sheets[i].month]}" for i in ticked if not sheets[i].archive},
+                    lambda sheet_ids: delete_all(manager,lambda sheet_id: manager.delete_sheet(product_id, sheet_id),sheet_ids),
+                    L
                 )
-                
-                st.subheader(L['delete'])
-                for i,s in enumerate(sheets):
-                    handle_delete_confirmation(
-                        "sheet", 
-                        f"{product_idx}_{i}", 
-                        f"{s.year}-{L['months'][s.month]}",
-                        lambda sheet_idx=i: manager.delete_sheet(product_idx, sheet_idx),
-                        L
-                    )
             else:
                 st.info(L['no_data'])
         else:
             st.info(L['select_product'])
     
-    with tab3:
-        if manager.db.products:
-            product_names=[p.name for p in manager.db.products]
-            selected_product=st.selectbox(L['select_product'],product_names,key='page_product')
-            product_idx=product_names.index(selected_product)
+    elif section==2:
+        if product_names:
+            product_id=st.selectbox(L['select_product'],list(product_names),format_func=product_names.get,key='page_product')
+            product=manager.get_product(product_id)
+            stamp=manager.stamp(product_id)
             
-            sheets=manager.db.products[product_idx].sheets
+            sheets=product.sheets
             if sheets:
-                sheet_names=[f"{s.year}-{L['months'][s.month]}" for s in sheets]
-                selected_sheet=st.selectbox(L['select_sheet'],sheet_names)
-                sheet_idx=sheet_names.index(selected_sheet)
+                sheet_names=views.get(('sheet_names',product_id,lang),stamp,lambda:sheet_labels(sheets,L))
+                sheet_id=st.selectbox(L['select_sheet'],list(sheet_names),format_func=sheet_names.get)
+                selected_sheet=sheet_names[sheet_id]
+                archived=manager.get_sheet(sheet_id).archive is not None
                 
-                with st.form('add_page_form'):
-                    cols=st.columns([2,2,1])
-                    price=cols[0].number_input(L['unit_price'],min_value=0.0,step=0.01)
-                    stock=cols[1].number_input(L['initial_stock'],min_value=0.0,step=0.01)
-                    if cols[2].form_submit_button(L['add_page']):
-                        manager.add_page(product_idx,sheet_idx,price,stock)
-                        st.rerun()
+                if archived:
+                    st.info(L['closed_period'])
+                else:
+                    with st.form('add_page_form'):
+                        cols=st.columns([2,2,1])
+                        price=cols[0].number_input(L['unit_price'],min_value=0.0,step=0.01)
+                        stock=cols[1].number_input(L['initial_stock'],min_value=0.0,step=0.01)
+                        carry=cols[1].checkbox(L['carry_opening'],value=True)
+                        if cols[2].form_submit_button(L['add_page']):
+                            manager.add_page(product_id,sheet_id,price,None if carry else stock)
+                            st.rerun()
                 
-                pages=sheets[sheet_idx].pages
+                if st.button(L['carry_forward']):
+                    manager.carry_forward(product_id,sheet_id)
+                    st.rerun()
+                
+                pages=manager.get_sheet(sheet_id).pages
                 if pages:
-                    df=pd.DataFrame([
-                        {
-                            'ID':i+1,
-                            L['unit_price']:p.unit_price,
-                            L['initial_stock']:p.initial_stock,
-                            L['records']:len(p.records)
-                        } for i,p in enumerate(pages)
-                    ])
+                    table=views.get(('pages',sheet_id,lang),stamp,lambda:pages_frame(pages,L))
+                    rows=table_window(len(pages),'pages',L)
+                    ticked=selectable_table(table.iloc[rows.start:rows.stop],rows,'pages',stamp,L)
                     
-                    st.dataframe(df,use_container_width=True)
+                    pdf_download(lambda:table,stamp,f"{L['pages']} - {product.name} - {selected_sheet}",
+                                 f"pages_{product.name}_{selected_sheet}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",'pages',L)
                     
-                    pdf_data=generate_pdf(df,f"{L['pages']} - {selected_product} - {selected_sheet}",st.session_state.lang)
-                    st.download_button(
-                        label=L['download_pdf'],
-                        data=pdf_data,
-                        file_name=f"pages_{selected_product}_{selected_sheet}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                        mime='application/pdf'
+                    handle_delete_confirmation(
+                        "page",
+                        {} if archived else {pages[i].id:f"Page {i+1}" for i in ticked},
+                        lambda page_ids: delete_all(manager,lambda page_id: manager.delete_page(product_id, sheet_id, page_id),page_ids),
+                        L
                     )
-                    
-                    st.subheader(L['delete'])
-                    for i,p in enumerate(pages):
-                        handle_delete_confirmation(
-                            "page", 
-                            f"{product_idx}_{sheet_idx}_{i}", 
-                            f"Page {i+1}",
-                            lambda page_idx=i: manager.delete_page(product_idx, sheet_idx, page_idx),
-                            L
-                        )
                 else:
                     st.info(L['no_data'])
             else:
@@ -532,80 +537,72 @@ def main():
         else:
             st.info(L['select_product'])
     
-    with tab4:
-        if manager.db.products:
-            product_names=[p.name for p in manager.db.products]
-            selected_product=st.selectbox(L['select_product'],product_names,key='rec_product')
-            product_idx=product_names.index(selected_product)
+    elif section==3:
+        if product_names:
+            product_id=st.selectbox(L['select_product'],list(product_names),format_func=product_names.get,key='rec_product')
+            product=manager.get_product(product_id)
+            stamp=manager.stamp(product_id)
             
-            sheets=manager.db.products[product_idx].sheets
+            sheets=product.sheets
             if sheets:
-                sheet_names=[f"{s.year}-{L['months'][s.month]}" for s in sheets]
-                selected_sheet=st.selectbox(L['select_sheet'],sheet_names,key='rec_sheet')
-                sheet_idx=sheet_names.index(selected_sheet)
+                sheet_names=views.get(('sheet_names',product_id,lang),stamp,lambda:sheet_labels(sheets,L))
+                sheet_id=st.selectbox(L['select_sheet'],list(sheet_names),format_func=sheet_names.get,key='rec_sheet')
+                selected_sheet=sheet_names[sheet_id]
                 
-                pages=sheets[sheet_idx].pages
+                pages=manager.get_sheet(sheet_id).pages
                 if pages:
-                    page_names=[f"Page {i+1} (Price: {p.unit_price})" for i,p in enumerate(pages)]
-                    selected_page=st.selectbox(L['select_page'],page_names)
-                    page_idx=page_names.index(selected_page)
+                    page_numbers=views.get(('page_numbers',sheet_id),stamp,lambda:{p.id:i+1 for i,p in enumerate(pages)})
+                    page_id=st.selectbox(L['select_page'],list(page_numbers),
+                                         format_func=lambda x:f"Page {page_numbers[x]} (Price: {manager.get_page(x).unit_price})")
+                    page_no=page_numbers[page_id]
+                    archived=manager.get_sheet(sheet_id).archive is not None
                     
-                    with st.form('add_record_form'):
-                        cols=st.columns([1,2,2,1,1,2,1])
-                        day=cols[0].number_input(L['day'],min_value=1,max_value=31,value=datetime.now().day)
-                        doc_id=cols[1].text_input(L['doc_id'])
-                        doc_type=cols[2].text_input(L['doc_type'])
-                        input_val=cols[3].number_input(L['input'],min_value=0.0,step=0.01)
-                        output_val=cols[4].number_input(L['output'],min_value=0.0,step=0.01)
-                        comment=cols[5].text_input(L['comment'])
-                        
-                        if cols[6].form_submit_button(L['add_record']):
-                            if doc_id and doc_type:
-                                record=Record(
-                                    day=int(day),
-                                    doc_id=doc_id,
-                                    doc_type=doc_type,
-                                    input=input_val,
-                                    output=output_val,
-                                    comment=comment
-                                )
-                                manager.add_record(product_idx,sheet_idx,page_idx,record)
-                                st.rerun()
+                    if archived:
+                        st.info(L['closed_period'])
+                    else:
+                        with st.form('add_record_form'):
+                            cols=st.columns([1,2,2,1,1,2,1])
+                            day=cols[0].number_input(L['day'],min_value=1,max_value=31,value=datetime.now().day)
+                            doc_id=cols[1].text_input(L['doc_id'])
+                            doc_type=cols[2].text_input(L['doc_type'])
+                            input_val=cols[3].number_input(L['input'],min_value=0.0,step=0.01)
+                            output_val=cols[4].number_input(L['output'],min_value=0.0,step=0.01)
+                            comment=cols[5].text_input(L['comment'])
+                            
+                            if cols[6].form_submit_button(L['add_record']):
+                                if doc_id and doc_type:
+                                    record=Record(
+                                        day=int(day),
+                                        doc_id=doc_id,
+                                        doc_type=doc_type,
+                                        input=input_val,
+                                        output=output_val,
+                                        comment=comment
+                                    )
+                                    manager.add_record(product_id,sheet_id,page_id,record)
+                                    st.rerun()
                     
-                    records=pages[page_idx].records
+                    records=manager.get_page(page_id).records
+                    duplicates=manager.duplicate_documents(page_id)
+                    if duplicates:
+                        st.warning(f"{L['duplicate_doc_ids']}: "+', '.join(
+                            f"{records[positions[0]].doc_id} ({len(positions)}×)" for positions in duplicates.values()))
                     if records:
-                        df=pd.DataFrame([
-                            {
-                                L['day']:r.day,
-                                L['doc_id']:r.doc_id,
-                                L['doc_type']:r.doc_type,
-                                L['initial_stock']:r.initial_stock,
-                                L['input']:r.input,
-                                L['output']:r.output,
-                                L['final_stock']:r.final_stock,
-                                L['comment']:r.comment
-                            } for r in records
-                        ])
+                        table=views.get(('records',page_id,lang),stamp,lambda:records_frame(records,L))
+                        rows=table_window(len(records),'records',L)
+                        ticked=selectable_table(table.iloc[rows.start:rows.stop],rows,'records',stamp,L)
                         
-                        st.dataframe(df,use_container_width=True)
+                        pdf_download(lambda:table,stamp,
+                                     f"{L['records']} - {product.name} - {selected_sheet} - Page {page_no}",
+                                     f"records_{product.name}_{selected_sheet}_p{page_no}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",'records',L)
                         
-                        pdf_data=generate_pdf(df,f"{L['records']} - {selected_product} - {selected_sheet} - Page {page_idx+1}",st.session_state.lang)
-                        st.download_button(
-                            label=L['download_pdf'],
-                            data=pdf_data,
-                            file_name=f"records_{selected_product}_{selected_sheet}_p{page_idx+1}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                            mime='application/pdf'
+                        # Highest index first, so earlier deletes do not shift later ones
+                        handle_delete_confirmation(
+                            "record",
+                            {} if archived else {i:f"{records[i].doc_id} ({records[i].day})" for i in reversed(ticked)},
+                            lambda record_idxs: delete_all(manager,lambda record_idx: manager.delete_record(product_id, sheet_id, page_id, record_idx),record_idxs),
+                            L
                         )
-                        
-                        st.subheader(L['delete'])
-                        for i,r in enumerate(records):
-                            handle_delete_confirmation(
-                                "record", 
-                                f"{product_idx}_{sheet_idx}_{page_idx}_{i}", 
-                                f"{r.doc_id} ({r.day})",
-                                lambda record_idx=i: manager.delete_record(product_idx, sheet_idx, page_idx, record_idx),
-                                L
-                            )
                     else:
                         st.info(L['no_data'])
                 else:
@@ -614,6 +611,18 @@ def main():
                 st.info(L['select_sheet'])
         else:
             st.info(L['select_product'])
+    
+    elif section==4:
+        analytics_section(manager,shared_analytics(manager,db_path),views,L)
+    
+    elif section==5:
+        documents_section(manager,views,L)
+    
+    # This run has shown every change so far, its own included
+    st.session_state.seen_version=manager.version
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    # `streamlit run app.py` executes this module as __main__ as well
+    if not runtime.exists():
+        sys.exit(cli())
+    traced_main()
\ No newline at end of file
@@ -0,0 +1,25 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT=Path(__file__).resolve().parent.parent
+sys.path.insert(0,str(ROOT))
+
+from warehouse import WarehouseManager
+
+@pytest.fixture
+def manager(tmp_path):
+    """A manager on an empty database in a temporary directory"""
+    manager=WarehouseManager(str(tmp_path/'db.json'))
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def shipped_db(tmp_path)->Path:
+    """A copy of the db.json shipped with the app"""
+    path=tmp_path/'shipped'/'db.json'
+    path.parent.mkdir()
+    shutil.copy(ROOT/'db.json',path)
+    return path
@@ -0,0 +1,39 @@
+import pytest
+
+from warehouse import Record,WarehouseManager
+from warehouse.analytics import REPORTS,Analytics
+
+@pytest.mark.parametrize('kind',REPORTS)
+def test_reports_on_an_empty_database(manager,kind):
+    report=Analytics(manager).report(kind,(2025,1),(2025,12))
+    assert report.empty
+
+@pytest.mark.parametrize('kind',REPORTS)
+def test_reports_on_products_without_records(shipped_db,kind):
+    manager=WarehouseManager(str(shipped_db))
+    try:
+        report=Analytics(manager).report(kind,(2025,1),(2025,12))
+    finally:
+        manager.close()
+    if kind=='turnover':
+        assert list(report['turnover'])==[0.0]*len(manager.db.products)
+
+def test_turnover_skips_products_without_stock(manager):
+    product=manager.add_product('Ceapă','kg')
+    manager.add_product('Cartofi','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,10.0)
+    manager.add_record(product,sheet,page,Record(3,'AE 1','AE',output=4.0))
+    report=Analytics(manager).turnover((2025,1)).set_index('product_name')
+    assert report.loc['Ceapă','output']==4.0
+    assert report.loc['Ceapă','turnover']==pytest.approx(4.0/((0.0+6.0)/2))
+    assert report.loc['Cartofi','turnover']==0.0
+
+def test_valuation_values_closing_stock(manager):
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.5,10.0)
+    manager.add_record(product,sheet,page,Record(3,'NIR 1','NIR',input=2.0))
+    report=Analytics(manager).valuation(2025,3)
+    assert report.to_dict('records')==[{'product_name':'Ceapă','measure_unit':'kg','year':2025,'month':1,
+                                        'final_stock':12.0,'value':30.0}]
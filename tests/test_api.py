@@ -0,0 +1,100 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip('starlette')
+
+from warehouse.api import create_app
+
+def call(app,method:str,path:str,body=None,headers:dict=None)->tuple:
+    """(status, headers, body) of one request sent straight to the ASGI app;
+    a bytes body is sent as is, anything else as JSON"""
+    path,_,query=path.partition('?')
+    raw=body if isinstance(body,bytes) else b'' if body is None else json.dumps(body).encode()
+    scope={'type':'http','asgi':{'version':'3.0'},'http_version':'1.1','method':method,'scheme':'http',
+           'path':path,'raw_path':path.encode(),'query_string':query.encode(),'root_path':'',
+           'headers':[(k.lower().encode(),v.encode()) for k,v in (headers or {}).items()],
+           'client':('testclient',50000),'server':('testserver',80)}
+    async def run():
+        sent=[]
+        requested=False
+        async def receive():
+            nonlocal requested
+            if requested:
+                await asyncio.Event().wait()
+            requested=True
+            return {'type':'http.request','body':raw,'more_body':False}
+        async def send(message):
+            sent.append(message)
+        await app(scope,receive,send)
+        start=next(m for m in sent if m['type']=='http.response.start')
+        content=b''.join(m.get('body',b'') for m in sent if m['type']=='http.response.body')
+        return start['status'],{k.decode():v.decode() for k,v in start['headers']},content
+    return asyncio.run(run())
+
+@pytest.fixture
+def app(manager):
+    return create_app(manager)
+
+@pytest.fixture
+def page_id(app):
+    status,_,body=call(app,'POST','/api/products',{'name':'Ceapă','measure_unit':'kg'})
+    product_id=json.loads(body)['id']
+    status,_,body=call(app,'POST',f'/api/products/{product_id}/sheets',{'year':2025,'month':1})
+    sheet_id=json.loads(body)['id']
+    status,_,body=call(app,'POST',f'/api/sheets/{sheet_id}/pages',{'unit_price':2.0,'initial_stock':0.0})
+    return json.loads(body)['id']
+
+def test_empty_record_list_is_a_bad_request(app,page_id):
+    status,_,body=call(app,'POST',f'/api/pages/{page_id}/records',[])
+    assert status==400 and 'non-empty' in json.loads(body)['error']
+
+def test_creates_answer_201_and_deletes_204(app,page_id):
+    status,_,body=call(app,'POST',f'/api/pages/{page_id}/records',{'day':1,'doc_id':'NIR 1','doc_type':'NIR','input':3})
+    assert (status,json.loads(body))==(201,{'added':1})
+    assert call(app,'PATCH',f'/api/pages/{page_id}/records/0',{'output':1})[0]==204
+    status,_,body=call(app,'GET',f'/api/pages/{page_id}/records')
+    [row]=json.loads(body)['items']
+    assert (row['input'],row['output'],row['final_stock'])==(3,1,2)
+    assert call(app,'DELETE',f'/api/pages/{page_id}/records/0')[0]==204
+    assert call(app,'DELETE',f'/api/pages/{page_id}')[0]==204
+    assert call(app,'GET',f'/api/pages/{page_id}')[0]==404
+
+@pytest.mark.parametrize('method,path',[('GET','/api/products/nope'),('GET','/api/sheets/nope/pages'),
+                                        ('DELETE','/api/pages/nope'),('PATCH','/api/pages/{page}/records/5')])
+def test_unknown_ids_are_not_found(app,page_id,method,path):
+    status,_,body=call(app,method,path.format(page=page_id),{'output':1} if method=='PATCH' else None)
+    assert status==404 and json.loads(body)['error']
+
+def test_bad_input_is_a_bad_request(app,page_id):
+    status,_,body=call(app,'POST','/api/products',b'{"name":')
+    assert status==400 and 'not valid JSON' in json.loads(body)['error']
+    product_id=json.loads(call(app,'GET','/api/products')[2])['items'][0]['id']
+    assert call(app,'POST',f'/api/products/{product_id}/sheets',{'year':2025,'month':13})[0]==400
+    assert call(app,'GET',f'/api/products/{product_id}/balance?year=2025&month=0')[0]==400
+    assert call(app,'GET','/api/products?limit=-1')[0]==400
+    assert call(app,'POST',f'/api/pages/{page_id}/records',{'day':1})[0]==400
+
+def test_conditional_get_answers_304_until_the_data_changes(app,page_id):
+    status,headers,body=call(app,'GET','/api/products')
+    etag=headers['etag']
+    assert status==200 and body
+    status,headers,body=call(app,'GET','/api/products',headers={'If-None-Match':etag})
+    assert (status,headers['etag'],body)==(304,etag,b'')
+    call(app,'POST','/api/products',{'name':'Varză','measure_unit':'buc'})
+    status,headers,body=call(app,'GET','/api/products',headers={'If-None-Match':etag})
+    assert status==200 and headers['etag']!=etag and json.loads(body)['total']==2
+
+def test_large_bodies_are_gzipped(app,page_id):
+    records=[{'day':1,'doc_id':f'NIR {i}','doc_type':'NIR','input':1} for i in range(50)]
+    assert call(app,'POST',f'/api/pages/{page_id}/records',records)[0]==201
+    status,headers,body=call(app,'GET',f'/api/pages/{page_id}/records',headers={'Accept-Encoding':'gzip'})
+    assert status==200 and headers['content-encoding']=='gzip'
+    assert json.loads(gzip.decompress(body))['total']==50
+    status,headers,body=call(app,'GET',f'/api/pages/{page_id}/records')
+    assert 'content-encoding' not in headers and json.loads(body)['total']==50
+    # Small bodies are not worth it
+    status,headers,_=call(app,'GET','/api/products',headers={'Accept-Encoding':'gzip'})
+    assert 'content-encoding' not in headers
@@ -0,0 +1,97 @@
+import pytest
+
+from warehouse import ArchivedPage,Record,WarehouseManager,import_rows
+from warehouse.storage import migrate_json_to_sqlite
+
+@pytest.fixture
+def closed(manager):
+    """A product with sheets for 2024-01 and 2025-01, closed through 2024-12"""
+    product=manager.add_product('Ceapă','kg')
+    for year in (2024,2025):
+        sheet=manager.add_sheet(product,year,1)
+        page=manager.add_page(product,sheet,2.0,10.0)
+        manager.add_record(product,sheet,page,Record(1,f'NIR {year}','NIR',input=5.0))
+    assert manager.close_periods(2024,12)==1
+    return manager
+
+def _disk(manager)->WarehouseManager:
+    return WarehouseManager(str(manager.db_path))
+
+def test_closed_sheets_are_read_only(closed):
+    product=closed.db.products[0]
+    sheet=product.sheets[0]
+    assert isinstance(sheet.pages[0],ArchivedPage)
+    assert sheet.pages[0].records[0].final_stock==15.0
+    with pytest.raises(ValueError):
+        closed.add_sheet(product.id,2024,6)
+    with pytest.raises(ValueError):
+        closed.add_record(product.id,sheet.id,sheet.pages[0].id,Record(2,'AE 1','AE',output=1.0))
+    assert closed.opening_balance(product.id,2025,1)==15.0
+
+@pytest.mark.parametrize('strict',[False,True])
+def test_import_into_closed_periods_is_a_row_error(closed,strict):
+    rows=[{'product':'Ceapă','year':2025,'month':2,'unit_price':2.0},
+          {'product':'Ceapă','year':2024,'month':2,'unit_price':2.0}]
+    report=import_rows(closed,rows,'pages',strict=strict)
+    assert [line for line,_ in report.errors]==[3]
+    assert report.imported==(0 if strict else 1)
+    reloaded=_disk(closed)
+    try:
+        assert sorted((s.year,s.month) for s in reloaded.db.products[0].sheets)==(
+            [(2024,1),(2025,1)] if strict else [(2024,1),(2025,1),(2025,2)])
+    finally:
+        reloaded.close()
+
+def test_records_import_into_archived_sheet_is_a_row_error(closed):
+    rows=[{'product':'Ceapă','year':2024,'month':1,'day':3,'doc_id':'NIR 9','doc_type':'NIR','input':1}]
+    report=import_rows(closed,rows,'records',strict=True)
+    assert report.imported==0 and len(report.errors)==1
+
+def test_a_failed_batch_writes_nothing(closed):
+    product=closed.db.products[0].id
+    version=closed.version
+    with pytest.raises(ValueError):
+        with closed.batch():
+            closed.add_sheet(product,2025,3)
+            closed.add_sheet(product,2024,2)
+    assert [(s.year,s.month) for s in closed.db.products[0].sheets]==[(2024,1),(2025,1)]
+    assert closed.version>version  # reloaded
+    reloaded=_disk(closed)
+    try:
+        assert len(reloaded.db.products[0].sheets)==2
+    finally:
+        reloaded.close()
+
+def test_archived_quantities_keep_their_type(manager):
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2024,1)
+    page=manager.add_page(product,sheet,2.0,10)
+    manager.add_records(product,sheet,page,[Record(1,'NIR 1','NIR',input=5),Record(2,'AE 1','AE',output=2.5)])
+    manager.close_periods(2024,12)
+    reloaded=_disk(manager)
+    try:
+        records=reloaded.db.products[0].sheets[0].pages[0].records
+        assert [(type(r.input),type(r.output)) for r in records]==[(int,float),(float,float)]
+    finally:
+        reloaded.close()
+
+@pytest.mark.parametrize('storage',['sqlite','sharded'])
+def test_migrated_closed_periods_stay_closed(closed,storage):
+    if storage=='sqlite':
+        migrate_json_to_sqlite(str(closed.db_path))
+    closed.close()
+    for _ in range(2):  # the import, then the engine's own files
+        manager=WarehouseManager(str(closed.db_path),storage)
+        try:
+            product=manager.db.products[0]
+            sheet,open_sheet=product.sheets
+            assert sheet.archive is not None and open_sheet.archive is None
+            assert sheet.pages[0].records[0].final_stock==15.0
+            with pytest.raises(ValueError):
+                manager.add_record(product.id,sheet.id,sheet.pages[0].id,Record(2,'AE 1','AE',output=1.0))
+            manager.update_record(product.id,open_sheet.id,open_sheet.pages[0].id,0,input=6.0)
+            manager.recalculate_all()
+            manager.carry_forward(product.id,sheet.id)
+            assert sheet.pages[0].records[0].final_stock==15.0
+        finally:
+            manager.close()
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from warehouse import Record,WarehouseManager
+
+@pytest.mark.parametrize('storage',['json','journal','sqlite','sharded'])
+def test_carried_openings_follow_earlier_periods(tmp_path,storage):
+    manager=WarehouseManager(str(tmp_path/'db.json'),storage)
+    product=manager.add_product('Ceapă','kg')
+    jan=manager.add_sheet(product,2025,1)
+    jan_page=manager.add_page(product,jan,2.0,0.0)
+    manager.add_record(product,jan,jan_page,Record(1,'NIR 1','NIR',input=10.0))
+    feb=manager.add_sheet(product,2025,2)
+    carried=manager.add_page(product,feb,2.0)
+    fixed=manager.add_page(product,feb,2.0,3.0)
+    assert manager.get_page(carried).initial_stock==10.0
+    
+    manager.update_record(product,jan,jan_page,0,input=15.0)
+    assert manager.get_page(carried).initial_stock==15.0
+    assert manager.get_page(fixed).initial_stock==3.0
+    assert manager.opening_balance(product,2025,2)==15.0
+    assert manager.closing_balance(product,2025,2)==18.0
+    
+    manager.delete_record(product,jan,jan_page,0)
+    manager.close()
+    manager=WarehouseManager(str(tmp_path/'db.json'),storage)
+    try:
+        page=manager.get_page(carried)
+        assert page.carried and page.initial_stock==0.0
+        assert not manager.get_page(fixed).carried
+    finally:
+        manager.close()
+
+def test_carried_openings_chain_through_months(manager):
+    product=manager.add_product('Ceapă','kg')
+    sheets=[manager.add_sheet(product,2025,month) for month in (1,2,3)]
+    first=manager.add_page(product,sheets[0],1.0,5.0)
+    pages=[manager.add_page(product,sheet,1.0) for sheet in sheets[1:]]
+    manager.add_record(product,sheets[1],pages[0],Record(2,'AE 1','AE',output=2.0))
+    assert manager.get_page(pages[1]).initial_stock==3.0
+    manager.add_record(product,sheets[0],first,Record(1,'NIR 1','NIR',input=4.0))
+    assert [manager.get_page(page).initial_stock for page in pages]==[9.0,7.0]
+    assert manager.get_page(pages[0]).records[0].final_stock==7.0
+
+@pytest.mark.parametrize('storage',['json','journal','sharded'])
+def test_recalculated_stocks_are_saved(tmp_path,storage):
+    # A db.json whose stock chain went stale, e.g. edited by hand
+    record={'day':1,'doc_id':'NIR 1','doc_type':'NIR','input':5.0,'output':0.0,'comment':'',
+            'initial_stock':0.0,'final_stock':99.0}
+    (tmp_path/'db.json').write_text(json.dumps({'products':[{'name':'Ceapă','measure_unit':'kg','sheets':[
+        {'year':2025,'month':1,'pages':[{'unit_price':2.0,'initial_stock':1.0,'records':[record]}]}]}]}))
+    manager=WarehouseManager(str(tmp_path/'db.json'),storage)
+    feb=manager.add_sheet(0,2025,2)
+    carried=manager.add_page(0,feb,2.0)
+    assert manager.closing_balance(0,2025,1)==99.0
+    manager.recalculate_stocks(0,0,0)
+    assert manager.closing_balance(0,2025,1)==6.0
+    assert manager.get_page(carried).initial_stock==6.0
+    manager.close()
+    manager=WarehouseManager(str(tmp_path/'db.json'),storage)
+    try:
+        assert manager.db.products[0].sheets[0].pages[0].records[0].final_stock==6.0
+        assert manager.get_page(carried).initial_stock==6.0
+    finally:
+        manager.close()
+
+def test_carried_opening_is_read_under_the_file_lock(tmp_path):
+    path=str(tmp_path/'db.json')
+    manager=WarehouseManager(path)
+    product=manager.add_product('Ceapă','kg')
+    jan=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,jan,2.0,0.0)
+    feb=manager.add_sheet(product,2025,2)
+    other=WarehouseManager(path)
+    try:
+        other.add_record(product,jan,page,Record(1,'NIR 1','NIR',input=10.0))
+        # `manager` has not seen that write yet
+        carried=manager.add_page(product,feb,2.0)
+        assert manager.get_page(carried).initial_stock==10.0
+    finally:
+        other.close()
+        manager.close()
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from warehouse import WarehouseManager
+from warehouse.bench import BenchConfig,compare,generate,run,write
+from warehouse.cli import main
+
+TINY=dict(products=2,sheets=2,pages=1,records=5,repeat=1,ops=2)
+
+def _tree(manager)->list:
+    return [(p.name,p.measure_unit,s.year,s.month,pg.unit_price,pg.initial_stock,[(r.doc_id,r.input,r.output) for r in pg.records])
+            for p in manager.db.products for s in p.sheets for pg in s.pages]
+
+def test_generate_is_seeded(tmp_path):
+    trees=[]
+    for name in ('a','b'):
+        manager=WarehouseManager(str(tmp_path/name/'db.json'))
+        try:
+            assert generate(manager,BenchConfig(**TINY))==20
+            trees.append(_tree(manager))
+        finally:
+            manager.close()
+    assert trees[0]==trees[1] and len(trees[0])==4
+
+@pytest.mark.parametrize('storage',['json','sqlite'])
+def test_run_times_every_step(storage):
+    lines=[]
+    result=run(BenchConfig(storage=storage,**TINY),'tiny',log=lines.append)
+    assert (result['label'],result['records'],result['config']['storage'])==('tiny',20,storage)
+    assert {'load_data','save_data','add_record','delete_record+recalculate','search_products'}<=set(result['results'])
+    for name,step in result['results'].items():
+        assert step['repeat']==1 and 0<=step['min']<=step['median']<=step['max'] and step['peak_bytes']>0,name
+    assert result['results']['add_record']['ops']==2
+    assert lines[0].startswith('20 records generated in ') and len(lines)>len(result['results'])
+    assert result['disk_bytes']>0
+
+def _result(**medians)->dict:
+    return {'results':{name:{'median':median} for name,median in medians.items()}}
+
+def test_compare_reports_slower_steps_only():
+    baseline=_result(load_data=0.010,save_data=0.010,search_products=0.0)
+    current=_result(load_data=0.013,save_data=0.011,search_products=0.5,add_record=1.0)
+    [line]=compare(baseline,current)
+    assert line.startswith('load_data: 10.00 ms -> 13.00 ms (1.30x)')
+    assert compare(baseline,current,tolerance=0.5)==[]
+
+def test_cli_writes_and_compares_results(tmp_path,capsys):
+    out=tmp_path/'before.json'
+    argv=['bench','--products','1','--sheets','1','--pages','1','--records','3','--repeat','1','--ops','1']
+    assert main(argv+['--out',str(out)])==0
+    baseline=json.loads(out.read_text(encoding='utf-8'))
+    assert baseline['records']==3
+    # A baseline that was far faster at every step
+    for step in baseline['results'].values():
+        step['median']/=1000
+    write(baseline,str(out))
+    capsys.readouterr()
+    assert main(argv+['--compare',str(out)])==1
+    output=capsys.readouterr().out
+    assert output.count('slower: ')==len(baseline['results'])
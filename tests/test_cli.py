@@ -0,0 +1,101 @@
+import csv
+import json
+
+import pytest
+
+from warehouse import Record,WarehouseManager
+from warehouse.cli import main
+
+@pytest.fixture
+def db(manager):
+    """Path of a closed database with Ceapă on a 2025-01 sheet of one page"""
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,0.0)
+    manager.add_record(product,sheet,page,Record(1,'NIR 1','NIR',input=3.0))
+    manager.add_record(product,sheet,page,Record(2,'AE 1','AE',output=1.5))
+    manager.add_product('Varză','buc')
+    manager.close()
+    return str(manager.db_path)
+
+def run(db,*argv)->int:
+    return main(['--db',db,*argv])
+
+def test_products(db,capsys):
+    assert run(db,'products','--json')==0
+    rows=json.loads(capsys.readouterr().out)
+    assert [(r['name'],r['measure_unit'],r['sheets']) for r in rows]==[('Ceapă','kg',1),('Varză','buc',0)]
+    assert run(db,'products','--search','varz')==0
+    out=capsys.readouterr().out
+    assert 'Varză (buc), 0 sheets' in out and 'Ceapă' not in out
+
+def test_balance(db,capsys):
+    assert run(db,'balance','Ceapă','2025','1')==0
+    assert capsys.readouterr().out.strip()=='Ceapă 2025-01: opening 0, closing 1.5 kg'
+
+def test_unknown_product_exits_2(db,capsys):
+    with pytest.raises(SystemExit) as e:
+        run(db,'balance','Morcovi','2025','1')
+    assert e.value.code==2
+    assert "unknown product 'Morcovi'" in capsys.readouterr().err
+
+def test_export_records_reads_back_with_import(db,tmp_path,capsys):
+    path=tmp_path/'records.csv'
+    assert run(db,'export','records',str(path),'--product','Ceapă')==0
+    assert '2 records written' in capsys.readouterr().out
+    with open(path,encoding='utf-8',newline='') as f:
+        rows=list(csv.reader(f))
+    assert [row[5] for row in rows[1:]]==['NIR 1','AE 1']
+    # Without the stock columns the file is an import of the same records
+    with open(path,'w',encoding='utf-8',newline='') as f:
+        csv.writer(f).writerows(row[:-2] for row in rows)
+    assert run(db,'import','records',str(path))==0
+    assert capsys.readouterr().out.strip()=='2 of 2 rows imported'
+    manager=WarehouseManager(db)
+    try:
+        page=manager.db.products[0].sheets[0].pages[0]
+        assert [r.final_stock for r in manager.get_page(page.id).records]==[3.0,1.5,4.5,3.0]
+    finally:
+        manager.close()
+
+def test_import_reports_bad_rows(db,tmp_path,capsys):
+    path=tmp_path/'products.csv'
+    path.write_text('name,measure_unit\nMorcovi,kg\n,kg\n',encoding='utf-8')
+    assert run(db,'import','products',str(path))==1
+    out=capsys.readouterr()
+    assert out.err.startswith('row 3: ') and '1 of 2 rows imported' in out.out
+
+def test_find(db,capsys):
+    assert run(db,'find','AE 1','--json')==0
+    [row]=json.loads(capsys.readouterr().out)
+    assert (row['product'],row['page'],row['index'],row['output'])==('Ceapă',1,1,1.5)
+    with pytest.raises(SystemExit):
+        run(db,'find')
+
+def test_report(db,capsys):
+    assert run(db,'report','movements','2025','1','--json')==0
+    assert json.loads(capsys.readouterr().out)
+    with pytest.raises(SystemExit) as e:
+        run(db,'report','movements','2025','2','--to','2025','1')
+    assert e.value.code==2
+
+def test_recalculate_and_snapshot(db,capsys):
+    assert run(db,'recalculate')==0
+    assert run(db,'snapshot','compact')==0
+    assert 'rewritten as compact' in capsys.readouterr().out
+    assert run(db,'balance','Ceapă','2025','1')==0
+    assert 'closing 1.5 kg' in capsys.readouterr().out
+
+def test_close_periods(db,capsys):
+    assert run(db,'close-periods','2025','1')==0
+    assert '1 sheets archived' in capsys.readouterr().out
+    manager=WarehouseManager(db)
+    try:
+        assert manager.db.products[0].sheets[0].archive
+    finally:
+        manager.close()
+
+def test_migrate_sqlite(db,capsys):
+    assert run(db,'migrate-sqlite')==0
+    assert main(['--db',db,'--storage','sqlite','balance','Ceapă','2025','1'])==0
+    assert 'closing 1.5 kg' in capsys.readouterr().out.splitlines()[-1]
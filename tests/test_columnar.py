@@ -0,0 +1,68 @@
+import random
+from dataclasses import asdict
+
+import pytest
+
+from warehouse import Record,WarehouseManager
+from warehouse.model import RecordColumns
+
+def _record(i:int)->Record:
+    return Record(i%28+1,f'NIR {i}','NIR' if i%2 else 'AE',input=float(i),output=i/2,comment=f'c{i}',
+                  initial_stock=float(i),final_stock=i*1.5)
+
+def test_list_operations_match_a_list():
+    rng=random.Random(7)
+    expected=[_record(i) for i in range(5)]
+    columns=RecordColumns(expected)
+    for i in range(5,300):
+        action=rng.choice(('append','insert','delete','set','slice'))
+        if action=='append' or not expected:
+            expected.append(_record(i))
+            columns.append(_record(i))
+        elif action=='insert':
+            index=rng.randrange(-len(expected),len(expected)+1)
+            expected.insert(index,_record(i))
+            columns.insert(index,_record(i))
+        elif action=='delete':
+            index=rng.randrange(-len(expected),len(expected))
+            del expected[index]
+            del columns[index]
+        elif action=='set':
+            index=rng.randrange(len(expected))
+            expected[index]=_record(i)
+            columns[index]=_record(i)
+        else:
+            del expected[1:3]
+            del columns[1:3]
+    assert columns.to_dicts()==[asdict(r) for r in expected]
+    assert [view.doc_id for view in columns[-3:]]==[r.doc_id for r in expected[-3:]]
+    with pytest.raises(IndexError):
+        columns[len(expected)]
+
+def test_resizing_while_a_frame_shares_the_arrays():
+    columns=RecordColumns([_record(i) for i in range(4)])
+    frame=columns.to_frame({name:name for name in RecordColumns.FIELDS})
+    columns.insert(0,_record(9))
+    del columns[2]
+    columns.append(_record(10))
+    assert [view.doc_id for view in columns]==['NIR 9','NIR 0','NIR 2','NIR 3','NIR 10']
+    assert list(frame['doc_id'])==['NIR 0','NIR 1','NIR 2','NIR 3']
+
+def test_columnar_pages_keep_the_same_stocks(tmp_path):
+    trees=[]
+    for columnar in (False,True):
+        manager=WarehouseManager(str(tmp_path/str(columnar)/'db.json'),columnar=columnar)
+        try:
+            product=manager.add_product('Ceapă','kg')
+            sheet=manager.add_sheet(product,2025,1)
+            page=manager.add_page(product,sheet,2.0,10.0)
+            manager.add_records(product,sheet,page,[Record(1,f'NIR {i}','NIR',input=i,output=1.0) for i in range(6)])
+            manager.insert_record(product,sheet,page,2,Record(2,'AE 1','AE',output=4.0))
+            manager.update_record(product,sheet,page,4,input=7.5)
+            manager.delete_record(product,sheet,page,0)
+            records=manager.get_page(page).records
+            assert isinstance(records,RecordColumns)==columnar
+            trees.append([(r.doc_id,r.input,r.initial_stock,r.final_stock) for r in records])
+        finally:
+            manager.close()
+    assert trees[0]==trees[1]
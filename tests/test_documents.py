@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from warehouse import Record,WarehouseManager
+from warehouse.search import DocumentIndex
+
+@pytest.fixture
+def ledger(manager):
+    """Two products with a page each; NIR 1 is on both"""
+    pages=[]
+    for name in ('Ceapă','Varză'):
+        product=manager.add_product(name,'kg')
+        sheet=manager.add_sheet(product,2025,1)
+        page=manager.add_page(product,sheet,2.0,0.0)
+        manager.add_records(product,sheet,page,[Record(1,'NIR 1','NIR',input=5.0),Record(2,f'AE {name}','AE',output=1.0)])
+        pages.append((product,sheet,page))
+    return manager,pages
+
+@pytest.fixture
+def indexed(monkeypatch):
+    """Ids of the pages indexed from their records"""
+    pages=[]
+    index_page=DocumentIndex._index_page
+    def spy(self,product,sheet,page):
+        pages.append(page.id)
+        index_page(self,product,sheet,page)
+    monkeypatch.setattr(DocumentIndex,'_index_page',spy)
+    return pages
+
+def _found(manager,doc_id=None,doc_type=None)->list:
+    return [(p.name,i,r.doc_id) for p,_,_,i,r in manager.find_documents(doc_id,doc_type)]
+
+def test_find_matches_loosely_and_by_type(ledger):
+    manager,pages=ledger
+    assert sorted(_found(manager,' nir  1 '))==[('Ceapă',0,'NIR 1'),('Varză',0,'NIR 1')]
+    assert _found(manager,'ae ceapa')==[('Ceapă',1,'AE Ceapă')]
+    assert sorted(_found(manager,doc_type='ae'))==[('Ceapă',1,'AE Ceapă'),('Varză',1,'AE Varză')]
+    assert _found(manager,'NIR 1','AE')==[]
+    assert len(manager.find_documents(doc_type='NIR',limit=1))==1
+
+def test_edits_are_followed(ledger):
+    manager,pages=ledger
+    product,sheet,page=pages[0]
+    assert len(_found(manager,'NIR 1'))==2
+    manager.add_record(product,sheet,page,Record(3,'NIR 1','NIR',input=1.0))
+    assert manager.duplicate_documents(page)=={'NIR 1':[0,2]}
+    manager.delete_record(product,sheet,page,0)
+    manager.update_record(product,sheet,page,0,doc_id='AE 2')
+    assert sorted(_found(manager,'NIR 1'))==[('Ceapă',1,'NIR 1'),('Varză',0,'NIR 1')]
+    assert _found(manager,'AE 2')==[('Ceapă',0,'AE 2')]
+    manager.delete_product(pages[1][0])
+    assert _found(manager,'NIR 1')==[('Ceapă',1,'NIR 1')]
+
+def test_index_is_saved_and_read_back(ledger,indexed):
+    manager,pages=ledger
+    assert len(_found(manager,'NIR 1'))==2
+    assert sorted(indexed)==sorted(page for _,_,page in pages)
+    manager.close()
+    saved=json.loads(manager.db_path.with_suffix('.docs').read_text(encoding='utf-8'))
+    assert saved['version']==int(manager._disk_version) and set(saved['pages'])==set(indexed)
+    indexed.clear()
+    reopened=WarehouseManager(str(manager.db_path))
+    try:
+        assert len(_found(reopened,'NIR 1'))==2
+        assert indexed==[]
+    finally:
+        reopened.close()
+
+def test_writes_by_another_process_are_caught_up_from_the_change_log(ledger,indexed):
+    manager,pages=ledger
+    product,sheet,page=pages[0]
+    assert len(_found(manager,'NIR 1'))==2
+    other=WarehouseManager(str(manager.db_path))
+    try:
+        other.add_record(product,sheet,page,Record(3,'NIR 9','NIR',input=1.0))
+    finally:
+        other.close()
+    indexed.clear()
+    manager.refresh()
+    assert _found(manager,'NIR 9')==[('Ceapă',2,'NIR 9')]
+    # Only the page the other process wrote is indexed again
+    assert indexed==[page]
+
+def test_a_lost_change_log_rebuilds_the_index(ledger,indexed):
+    manager,pages=ledger
+    assert len(_found(manager,'NIR 1'))==2
+    manager.close()
+    product,sheet,page=pages[1]
+    other=WarehouseManager(str(manager.db_path))
+    try:
+        other.add_record(product,sheet,page,Record(3,'NIR 9','NIR',input=1.0))
+    finally:
+        other.close()
+    manager.changes.path.unlink()
+    indexed.clear()
+    reopened=WarehouseManager(str(manager.db_path))
+    try:
+        assert _found(reopened,'NIR 9')==[('Varză',2,'NIR 9')]
+        assert sorted(indexed)==sorted(page for _,_,page in pages)
+    finally:
+        reopened.close()
@@ -0,0 +1,72 @@
+import pytest
+
+from warehouse import Record,import_rows
+from warehouse.importer import import_file
+
+@pytest.fixture
+def ledger(manager):
+    """Ceapă with a 2025-01 sheet of one page"""
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,0.0)
+    manager.add_record(product,sheet,page,Record(1,'NIR 0','NIR',input=1.0))
+    return manager,page
+
+def test_bad_rows_are_reported_by_line(ledger):
+    manager,page=ledger
+    path=manager.db_path.with_name('records.csv')
+    path.write_text('Nume Produs,An,Lună,Zi,ID Document,Tip Document,Intrare,Ieșire\n'
+                    'Ceapă,2025,1,2,NIR 1,NIR,"2,5",\n'
+                    'Varză,2025,1,2,NIR 2,NIR,1,\n'
+                    'Ceapă,2025,13,2,NIR 3,NIR,1,\n'
+                    'Ceapă,2025,1,32,NIR 4,NIR,1,\n'
+                    'Ceapă,2025,1,3,NIR 5,NIR,multe,\n'
+                    'Ceapă,2025,2,3,NIR 6,NIR,1,\n'
+                    'Ceapă,2025,1,4,,AE,,1\n'
+                    'Ceapă,2025,1,5,AE 1,AE,,0.5\n',encoding='utf-8')
+    version=manager._read_disk_version()
+    report=import_file(manager,str(path),'records')
+    assert (report.rows,report.imported)==(8,2)
+    assert [line for line,_ in report.errors]==[3,4,5,6,7,8]
+    assert 'unknown product' in report.errors[0][1] and 'no sheet' in report.errors[4][1]
+    assert [(r.doc_id,r.final_stock) for r in manager.get_page(page).records]==[('NIR 0',1.0),('NIR 1',3.5),('AE 1',3.0)]
+    # One batch, so one published version
+    assert int(manager._read_disk_version())==int(version)+1
+
+def test_strict_imports_nothing_on_errors(ledger):
+    manager,page=ledger
+    rows=[{'product':'Ceapă','year':2025,'month':1,'page':1,'day':2,'doc_id':'NIR 1','doc_type':'NIR','input':1},
+          {'product':'Ceapă','year':2025,'month':1,'page':2,'day':2,'doc_id':'NIR 2','doc_type':'NIR','input':1}]
+    report=import_rows(manager,rows,'records',strict=True)
+    assert report.imported==0 and [line for line,_ in report.errors]==[3]
+    assert len(manager.get_page(page).records)==1
+
+def test_missing_columns_and_file_types_are_refused(manager,tmp_path):
+    with pytest.raises(ValueError,match='year'):
+        import_rows(manager,[{'product':'Ceapă','month':1,'unit_price':2}],'pages')
+    with pytest.raises(ValueError,match='Unsupported'):
+        import_file(manager,str(tmp_path/'notes.txt'),'records')
+
+def test_products_and_pages(manager):
+    report=import_rows(manager,[{'name':'Ceapă','measure_unit':'kg'},{'name':'Ceapă','measure_unit':'kg'},
+                                {'name':'Cartofi','measure_unit':'kg'}],'products')
+    assert report.imported==2 and [line for line,_ in report.errors]==[3]
+    report=import_rows(manager,[{'product':'Ceapă','year':2025,'month':1,'unit_price':2,'initial_stock':4},
+                                {'product':'Ceapă','year':2025,'month':2,'unit_price':2}],'pages')
+    assert report.imported==2 and not report.errors
+    product=manager.products_named('Ceapă')[0].id
+    feb=manager.sheets_for_period(product,2025,2)[0]
+    assert feb.pages[0].carried and feb.pages[0].initial_stock==4.0
+
+def test_xlsx_files(ledger,tmp_path):
+    openpyxl=pytest.importorskip('openpyxl')
+    manager,page=ledger
+    workbook=openpyxl.Workbook()
+    sheet=workbook.active
+    sheet.append(['product','year','month','day','doc_id','doc_type','output'])
+    sheet.append(['Ceapă',2025,1,2,'AE 1','AE',0.5])
+    sheet.append([None]*7)
+    workbook.save(tmp_path/'records.xlsx')
+    report=import_file(manager,str(tmp_path/'records.xlsx'),'records')
+    assert (report.rows,report.imported,report.errors)==(1,1,[])
+    assert manager.get_page(page).records[-1].final_stock==0.5
@@ -0,0 +1,63 @@
+import json
+
+from warehouse import JournalBackend,Record,WarehouseManager
+from warehouse.storage import _db_to_dict
+
+def _fill(manager)->tuple:
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,1.0)
+    manager.add_records(product,sheet,page,[Record(1,'NIR 1','NIR',input=5.0),Record(2,'AE 1','AE',output=2.0)])
+    manager.insert_record(product,sheet,page,1,Record(1,'NIR 2','NIR',input=3.0))
+    manager.update_record(product,sheet,page,0,input=4.0)
+    manager.delete_record(product,sheet,page,2)
+    return product,sheet,page
+
+def test_mutations_append_to_the_journal(tmp_path):
+    path=tmp_path/'db.json'
+    manager=WarehouseManager(str(path),'journal',compact_every=10**6)
+    manager.add_product('Cartofi','kg')
+    snapshot=path.read_bytes()
+    _,_,page=_fill(manager)
+    expected=_db_to_dict(manager.db)
+    manager.close()
+    assert path.read_bytes()==snapshot
+    ops=[json.loads(line)['op'] for line in path.with_suffix('.journal').read_text().splitlines()]
+    assert ops[-3:]==['insert_record','update_record','delete_record']
+    reloaded=WarehouseManager(str(path),'journal')
+    try:
+        assert _db_to_dict(reloaded.db)==expected
+        assert [r.final_stock for r in reloaded.get_page(page).records]==[5.0,8.0]
+    finally:
+        reloaded.close()
+
+def test_compaction_folds_the_journal_into_the_snapshot(tmp_path):
+    path=tmp_path/'db.json'
+    manager=WarehouseManager(str(path),'journal',compact_every=3)
+    _fill(manager)
+    expected=_db_to_dict(manager.db)
+    manager.close()
+    assert not path.with_suffix('.journal.sealed').exists()
+    assert json.loads(path.read_text())['journal_seq']>=3
+    storage=JournalBackend(path)
+    assert _db_to_dict(storage.load())==expected
+
+def test_a_torn_journal_line_is_dropped(tmp_path):
+    path=tmp_path/'db.json'
+    manager=WarehouseManager(str(path),'journal',compact_every=10**6)
+    product,sheet,page=_fill(manager)
+    expected=_db_to_dict(manager.db)
+    manager.close()
+    with open(path.with_suffix('.journal'),'a',encoding='utf-8') as f:
+        f.write('{"seq":99,"op":"add_record","args":["')
+    reloaded=WarehouseManager(str(path),'journal')
+    try:
+        assert _db_to_dict(reloaded.db)==expected
+        reloaded.add_record(product,sheet,page,Record(3,'AE 2','AE',output=1.0))
+    finally:
+        reloaded.close()
+    reloaded=WarehouseManager(str(path),'journal')
+    try:
+        assert [r.doc_id for r in reloaded.get_page(page).records]==['NIR 1','NIR 2','AE 2']
+    finally:
+        reloaded.close()
@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from warehouse import Record
+from warehouse.metrics import METRICS,Metrics,timings_table,update_gauges
+
+ROOT=Path(__file__).resolve().parent.parent
+
+@pytest.fixture
+def metrics():
+    """The shared METRICS, enabled and empty for one test"""
+    METRICS.reset()
+    METRICS.enable()
+    yield METRICS
+    METRICS.disable()
+    METRICS.reset()
+
+def test_off_by_default_records_nothing():
+    metrics=Metrics()
+    with metrics.timer('load'):
+        pass
+    metrics.count('hits')
+    metrics.gauge('size',3)
+    assert metrics.snapshot()=={'timers':{},'counters':{},'gauges':{}}
+
+def test_timers_counters_and_gauges(tmp_path):
+    metrics=Metrics()
+    log=tmp_path/'metrics.log'
+    metrics.enable(str(log))
+    @metrics.timed('work')
+    def work(n):
+        return n*2
+    assert work(2)==4 and work(3)==6
+    with metrics.timer('load',storage='json'):
+        pass
+    metrics.count('hits')
+    metrics.count('hits',2)
+    metrics.gauge('size',3)
+    data=metrics.snapshot()
+    assert data['timers']['work']['calls']==2
+    assert data['timers']['work']['max_seconds']<=data['timers']['work']['seconds']
+    assert (data['counters'],data['gauges'])==({'hits':3},{'size':3})
+    lines=[json.loads(line) for line in log.read_text(encoding='utf-8').splitlines()]
+    assert [line['timer'] for line in lines]==['work','work','load'] and lines[2]['storage']=='json'
+
+def test_prometheus_text():
+    metrics=Metrics()
+    metrics.enable()
+    with metrics.timer('api.read'):
+        pass
+    metrics.count('op."x"')
+    metrics.gauge('db_bytes',10)
+    text=metrics.prometheus_text()
+    assert 'warehouse_duration_seconds_count{name="api.read"} 1\n' in text
+    assert 'warehouse_events_total{name="op.\\"x\\""} 1\n' in text
+    assert '# TYPE warehouse_db_bytes gauge\nwarehouse_db_bytes 10\n' in text
+
+def test_trace_nests_by_depth():
+    metrics=Metrics()
+    metrics.enable()
+    with metrics.trace() as steps:
+        with metrics.timer('outer'):
+            with metrics.timer('inner'):
+                pass
+    assert [(name,depth) for name,_,depth in steps]==[('outer',0),('inner',1)]
+    assert [row['step'] for row in timings_table(steps)]==['outer','  inner']
+
+def test_manager_paths_are_timed(manager,metrics):
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,0.0)
+    manager.add_record(product,sheet,page,Record(1,'NIR 1','NIR',input=1.0))
+    manager.load_data()
+    update_gauges(manager)
+    data=metrics.snapshot()
+    assert data['counters']['op.add_record']==1 and data['timers']['commit']['calls']==4
+    assert data['timers']['load_data']['calls']==1
+    assert (data['gauges']['products'],data['gauges']['records'])==(1,1) and data['gauges']['db_bytes']>0
+
+def test_enabled_by_the_environment(tmp_path):
+    log=tmp_path/'metrics.log'
+    env=dict(os.environ,WAREHOUSE_METRICS='1',WAREHOUSE_METRICS_LOG=str(log))
+    code='from warehouse.metrics import METRICS\nwith METRICS.timer("x"):\n    pass\nprint(METRICS.enabled)'
+    out=subprocess.run([sys.executable,'-c',code],cwd=ROOT,env=env,capture_output=True,text=True,check=True).stdout
+    assert out.strip()=='True' and json.loads(log.read_text(encoding='utf-8'))['timer']=='x'
@@ -0,0 +1,59 @@
+import json
+
+from warehouse import Record,WarehouseManager
+
+def test_ids_survive_deleting_earlier_siblings(manager):
+    first=manager.add_product('Ceapă','kg')
+    second=manager.add_product('Cartofi','kg')
+    sheet=manager.add_sheet(second,2025,1)
+    page=manager.add_page(second,sheet,2.0,0.0)
+    manager.delete_product(first)
+    manager.add_record(second,sheet,page,Record(1,'NIR 1','NIR',input=3.0))
+    assert manager.get_product(second).name=='Cartofi'
+    assert manager.get_page(page).records[0].final_stock==3.0
+    # Positions follow the list
+    manager.add_record(0,0,0,Record(2,'NIR 2','NIR',input=1.0))
+    assert len(manager.get_page(page).records)==2
+
+def test_refs_must_agree_on_the_parents(manager):
+    product=manager.add_product('Ceapă','kg')
+    other=manager.add_product('Cartofi','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,0.0)
+    manager.add_record(other,sheet,page,Record(1,'NIR 1','NIR',input=3.0))
+    assert manager.add_sheet('no such id',2025,1) is None
+    assert manager.add_page(other,sheet,2.0,0.0) is None
+    assert manager.get_page(page).records==[]
+    manager.add_record(None,None,page,Record(1,'NIR 1','NIR',input=3.0))
+    assert len(manager.get_page(page).records)==1
+
+def test_lookup_maps_follow_changes(manager):
+    product=manager.add_product('Ceapă','kg')
+    sheets=[manager.add_sheet(product,2025,1) for _ in range(2)]
+    assert [p.id for p in manager.products_named('Ceapă')]==[product]
+    assert [s.id for s in manager.sheets_for_period(product,2025,1)]==sheets
+    manager.delete_sheet(product,sheets[0])
+    assert [s.id for s in manager.sheets_for_period(0,2025,1)]==sheets[1:]
+    assert manager.get_sheet(sheets[0]) is None
+
+def test_positional_changes_are_logged_by_id(tmp_path):
+    path=tmp_path/'db.json'
+    manager=WarehouseManager(str(path),'journal',compact_every=10**6)
+    try:
+        product=manager.add_product('Ceapă','kg')
+        manager.add_sheet(0,2025,1)
+    finally:
+        manager.close()
+    entry=json.loads(path.with_suffix('.journal').read_text().splitlines()[-1])
+    assert entry['op']=='add_sheet' and entry['args'][0]==product
+
+def test_files_without_ids_get_them_once(shipped_db):
+    manager=WarehouseManager(str(shipped_db))
+    ids=[p.id for p in manager.db.products]
+    manager.close()
+    assert all('id' in p for p in json.loads(shipped_db.read_text())['products'])
+    manager=WarehouseManager(str(shipped_db))
+    try:
+        assert [p.id for p in manager.db.products]==ids
+    finally:
+        manager.close()
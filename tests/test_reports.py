@@ -0,0 +1,34 @@
+import time
+import tracemalloc
+
+import pytest
+
+pytest.importorskip('reportlab')
+
+from warehouse import Database,Page,Product,Record,Sheet
+from warehouse.reports import generate_ledger_pdf
+
+def ledger(pages:int,rows:int)->Database:
+    """A single-product ledger with `pages` pages of `rows` records each"""
+    return Database(products=[Product('Ceapă','kg',[Sheet(2025,1,[
+        Page(1.0,0.0,[Record(r%28+1,f'NIR {p}-{r}','NIR',input=1.0,initial_stock=float(r),final_stock=r+1.0)
+                      for r in range(rows)]) for p in range(pages)])])])
+
+def test_large_ledger_exports_within_time_bound():
+    db=ledger(10,1000)
+    start=time.perf_counter()
+    pdf=generate_ledger_pdf(db,'en')
+    elapsed=time.perf_counter()-start
+    assert pdf.startswith(b'%PDF')
+    assert elapsed<60.0,f'10000 ledger rows took {elapsed:.1f}s'
+
+def test_large_ledger_exports_under_memory_ceiling():
+    db=ledger(2,500)
+    tracemalloc.start()
+    try:
+        pdf=generate_ledger_pdf(db,'en')
+        _,peak=tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert pdf.startswith(b'%PDF')
+    assert peak<8*2**20,f'peak {peak/2**20:.1f} MiB for 1000 ledger rows'
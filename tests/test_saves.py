@@ -0,0 +1,52 @@
+import pytest
+
+from warehouse import Record,WarehouseManager
+from warehouse.storage import _rotate_backups,_write_atomic
+
+def test_a_failed_write_leaves_the_old_file(tmp_path):
+    path=tmp_path/'db.json'
+    path.write_text('old')
+    def write(f):
+        f.write('half')
+        raise OSError('disk full')
+    with pytest.raises(OSError):
+        _write_atomic(path,write)
+    assert path.read_text()=='old'
+    assert [p.name for p in tmp_path.iterdir()]==['db.json']
+
+def test_backups_rotate_at_most_once_per_interval(tmp_path):
+    path=tmp_path/'db.json'
+    path.write_text('0')
+    for version in range(1,6):
+        _rotate_backups(path,3,0)
+        _write_atomic(path,lambda f:f.write(str(version)))
+    assert [path.with_name(f'db.json.{n}.bak').read_text() for n in (1,2,3)]==['4','3','2']
+    assert not path.with_name('db.json.4.bak').exists()
+    _rotate_backups(path,3,600)
+    assert path.with_name('db.json.1.bak').read_text()=='4'
+
+@pytest.mark.parametrize('storage',['json','journal','sqlite','sharded'])
+def test_a_batch_is_written_once_or_not_at_all(tmp_path,storage):
+    path=tmp_path/'db.json'
+    manager=WarehouseManager(str(path),storage)
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,0.0)
+    version=path.with_suffix('.version').read_text()
+    with manager.batch():
+        for day in (1,2,3):
+            manager.add_record(product,sheet,page,Record(day,f'NIR {day}','NIR',input=1.0))
+    assert int(path.with_suffix('.version').read_text())==int(version)+1
+    with pytest.raises(KeyError):
+        with manager.batch():
+            manager.add_record(product,sheet,page,Record(4,'NIR 4','NIR',input=1.0))
+            with manager.batch():
+                manager.delete_record(product,sheet,page,0)
+            raise KeyError
+    assert [r.doc_id for r in manager.get_page(page).records]==['NIR 1','NIR 2','NIR 3']
+    manager.close()
+    manager=WarehouseManager(str(path),storage)
+    try:
+        assert [r.final_stock for r in manager.get_page(page).records]==[1.0,2.0,3.0]
+    finally:
+        manager.close()
@@ -0,0 +1,21 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+def test_search_shares_the_read_lock(manager):
+    manager.add_product('Ceapă roșie','kg')
+    found=[]
+    with manager.lock.read():
+        thread=threading.Thread(target=lambda:found.extend(manager.search_products('ceapa')))
+        thread.start()
+        thread.join(5)
+    assert not thread.is_alive()
+    assert [product.name for _,product in found]==['Ceapă roșie']
+
+def test_concurrent_searches(manager):
+    for i in range(50):
+        manager.add_product(f'Produs {i:02}','kg')
+    queries=[f'produs {i%60:02}' for i in range(2000)]
+    with ThreadPoolExecutor(8) as pool:
+        results=list(pool.map(manager.search_products,queries))
+    for query,hits in zip(queries,results):
+        assert [product.name.lower() for _,product in hits]==([query] if int(query[-2:])<50 else [])
@@ -0,0 +1,50 @@
+from warehouse import Record,WarehouseManager
+from warehouse.model import LazyPage,record_count
+
+def _shards(path)->dict:
+    return {shard.name:shard.read_bytes() for shard in (path.parent/'db'/'sheets').glob('*.json')}
+
+def _open(path)->WarehouseManager:
+    return WarehouseManager(str(path),'sharded')
+
+def test_a_change_rewrites_only_its_sheet(tmp_path):
+    path=tmp_path/'db.json'
+    manager=_open(path)
+    try:
+        product=manager.add_product('Ceapă','kg')
+        sheets=[manager.add_sheet(product,2025,month) for month in (1,2)]
+        pages=[manager.add_page(product,sheet,2.0,0.0) for sheet in sheets]
+        before=_shards(path)
+        manager.add_record(product,sheets[1],pages[1],Record(1,'NIR 1','NIR',input=5.0))
+        after=_shards(path)
+        assert before.keys()==after.keys() and len(after)==2
+        assert sum(after[name]!=before[name] for name in after)==1
+        manager.delete_sheet(product,sheets[0])
+        assert len(_shards(path))==1
+    finally:
+        manager.close()
+
+def test_pages_load_when_opened(tmp_path):
+    path=tmp_path/'db.json'
+    manager=_open(path)
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,1.0)
+    manager.add_records(product,sheet,page,[Record(day,f'NIR {day}','NIR',input=1.0) for day in (1,2,3)])
+    manager.close()
+    manager=_open(path)
+    try:
+        loaded=manager.get_page(page)
+        assert isinstance(loaded,LazyPage) and not loaded.loaded
+        assert record_count(loaded)==3 and not loaded.loaded
+        assert loaded.records[-1].final_stock==4.0 and loaded.loaded
+    finally:
+        manager.close()
+
+def test_existing_json_is_imported_on_first_use(shipped_db):
+    manager=_open(shipped_db)
+    try:
+        assert [p.name for p in manager.db.products]==['cartofi','ceapă']
+        assert (shipped_db.parent/'db'/'index.json').exists()
+    finally:
+        manager.close()
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from warehouse import WarehouseManager
+from warehouse.snapshot import is_compact
+
+def _round_trip(path)->bytes:
+    """db.json as saved back from JSON, then compact, then JSON again"""
+    manager=WarehouseManager(str(path))
+    try:
+        manager.save_data()
+        before=path.read_bytes()
+        manager.storage.snapshot='compact'
+        manager.save_data()
+        assert is_compact(path.read_bytes())
+    finally:
+        manager.close()
+    manager=WarehouseManager(str(path))
+    try:
+        manager.storage.snapshot='json'
+        manager.save_data()
+    finally:
+        manager.close()
+    assert path.read_bytes()==before
+    return before
+
+def test_shipped_database_round_trips(shipped_db):
+    _round_trip(shipped_db)
+
+@pytest.mark.parametrize('quantities',[(5,0,0,5),(2.5,0.0,0.0,2.5),(5,0.5,0,4.5)])
+def test_quantities_keep_their_type(shipped_db,quantities):
+    data=json.loads(shipped_db.read_text())
+    records=[dict(zip(('day','doc_id','doc_type','input','output','comment','initial_stock','final_stock'),
+                      (day,f'NIR {day}','NIR',*quantities[:2],'',*quantities[2:]))) for day in (1,2)]
+    data['products'][0]['sheets'][0]['pages'].append({'unit_price':2,'initial_stock':0,'records':records})
+    shipped_db.write_text(json.dumps(data))
+    saved=json.loads(_round_trip(shipped_db))
+    assert saved['products'][0]['sheets'][0]['pages'][0]['records'][0]['input']==quantities[0]
+    assert type(saved['products'][0]['sheets'][0]['pages'][0]['records'][0]['input']) is type(quantities[0])
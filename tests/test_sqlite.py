@@ -0,0 +1,137 @@
+import sqlite3
+
+import pytest
+
+from warehouse import Record,WarehouseManager
+
+@pytest.fixture
+def sqlite_manager(tmp_path):
+    """A manager on the sqlite engine, with one page of two records"""
+    manager=WarehouseManager(str(tmp_path/'db.json'),'sqlite')
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,1.0)
+    manager.add_records(product,sheet,page,[Record(1,'NIR 1','NIR',input=5.0),Record(2,'AE 1','AE',output=2.0)])
+    yield manager
+    manager.close()
+
+def _reopened(manager)->WarehouseManager:
+    manager.close()
+    return WarehouseManager(str(manager.db_path),'sqlite')
+
+def _docs(manager)->list:
+    return [r.doc_id for r in manager.db.products[0].sheets[0].pages[0].records]
+
+def test_failed_batch_with_a_full_rewrite_writes_nothing(sqlite_manager):
+    with pytest.raises(RuntimeError):
+        with sqlite_manager.batch():
+            sqlite_manager.add_record(0,0,0,Record(3,'NIR 2','NIR',input=1.0))
+            sqlite_manager.recalculate_all()
+            sqlite_manager.add_record(0,0,0,Record(4,'NIR 3','NIR',input=1.0))
+            raise RuntimeError
+    assert _docs(sqlite_manager)==['NIR 1','AE 1']
+    manager=_reopened(sqlite_manager)
+    try:
+        assert _docs(manager)==['NIR 1','AE 1']
+    finally:
+        manager.close()
+
+def test_full_rewrite_keeps_unloaded_pages(sqlite_manager):
+    manager=_reopened(sqlite_manager)
+    try:
+        manager.save_data()
+        assert _docs(manager)==['NIR 1','AE 1']
+    finally:
+        manager.close()
+    manager=WarehouseManager(str(manager.db_path),'sqlite')
+    try:
+        assert _docs(manager)==['NIR 1','AE 1']
+        assert manager.db.products[0].sheets[0].pages[0].records[-1].final_stock==4.0
+    finally:
+        manager.close()
+
+def _tree(db)->list:
+    """The database without ids"""
+    return [(p.name,[(s.year,s.month,[(pg.unit_price,pg.initial_stock,[(r.doc_id,r.input,r.output,r.final_stock)
+                                                                     for r in pg.records]) for pg in s.pages])
+                     for s in p.sheets]) for p in db.products]
+
+def _edit(manager):
+    cartofi=manager.add_product('Cartofi','kg')
+    feb=manager.add_sheet(cartofi,2025,2)
+    page=manager.add_page(cartofi,feb,1.5,0.0)
+    manager.add_record(cartofi,feb,page,Record(1,'NIR 9','NIR',input=7.0))
+    manager.insert_record(0,0,0,1,Record(1,'NIR 2','NIR',input=3.0))
+    manager.update_record(0,0,0,0,input=4.0)
+    manager.delete_record(0,0,0,2)
+    extra=manager.add_sheet(0,2025,3)
+    manager.delete_sheet(0,extra)
+    manager.delete_page(cartofi,feb,manager.add_page(cartofi,feb,9.0,0.0))
+    manager.delete_product(manager.add_product('Varză','buc'))
+
+def test_each_operation_is_saved(tmp_path,sqlite_manager):
+    _edit(sqlite_manager)
+    expected=_tree(sqlite_manager.db)
+    json_manager=WarehouseManager(str(tmp_path/'json'/'db.json'))
+    try:
+        product=json_manager.add_product('Ceapă','kg')
+        sheet=json_manager.add_sheet(product,2025,1)
+        json_manager.add_records(product,sheet,json_manager.add_page(product,sheet,2.0,1.0),
+                                 [Record(1,'NIR 1','NIR',input=5.0),Record(2,'AE 1','AE',output=2.0)])
+        _edit(json_manager)
+        assert _tree(json_manager.db)==expected
+    finally:
+        json_manager.close()
+    manager=_reopened(sqlite_manager)
+    try:
+        assert _tree(manager.db)==expected
+        assert [p.name for p in manager.db.products]==['Ceapă','Cartofi']
+    finally:
+        manager.close()
+
+def test_pages_load_lazily(sqlite_manager):
+    manager=_reopened(sqlite_manager)
+    try:
+        page=manager.db.products[0].sheets[0].pages[0]
+        assert not page.loaded
+        assert manager.closing_balance(0,2025,1)==4.0
+        assert [r.doc_id for r in page.records]==['NIR 1','AE 1']
+    finally:
+        manager.close()
+
+def test_existing_json_is_imported_on_first_use(shipped_db):
+    manager=WarehouseManager(str(shipped_db),'sqlite')
+    try:
+        assert [p.name for p in manager.db.products]==['cartofi','ceapă']
+        assert shipped_db.with_suffix('.sqlite').exists()
+    finally:
+        manager.close()
+
+def test_files_from_before_ids_are_upgraded(tmp_path):
+    conn=sqlite3.connect(tmp_path/'db.sqlite')
+    conn.executescript('''
+        CREATE TABLE products(id INTEGER PRIMARY KEY,position INTEGER NOT NULL,name TEXT NOT NULL,measure_unit TEXT NOT NULL);
+        CREATE TABLE sheets(id INTEGER PRIMARY KEY,product_id INTEGER NOT NULL,position INTEGER NOT NULL,
+                            year INTEGER NOT NULL,month INTEGER NOT NULL);
+        CREATE TABLE pages(id INTEGER PRIMARY KEY,sheet_id INTEGER NOT NULL,position INTEGER NOT NULL,
+                           unit_price REAL NOT NULL,initial_stock REAL NOT NULL);
+        INSERT INTO products VALUES(1,0,'Ceapă','kg');
+        INSERT INTO sheets VALUES(1,1,0,2025,1);
+        INSERT INTO pages VALUES(1,1,0,2.0,3.0);
+    ''')
+    conn.commit()
+    conn.close()
+    manager=WarehouseManager(str(tmp_path/'db.json'),'sqlite')
+    try:
+        page=manager.db.products[0].sheets[0].pages[0]
+        assert page.initial_stock==3.0 and not page.carried
+        ids=(manager.db.products[0].id,page.id)
+        manager.add_record(0,0,0,Record(1,'NIR 1','NIR',input=1.0))
+    finally:
+        manager.close()
+    manager=WarehouseManager(str(tmp_path/'db.json'),'sqlite')
+    try:
+        assert (manager.db.products[0].id,manager.db.products[0].sheets[0].pages[0].id)==ids
+        assert manager.get_page(ids[1]).records[0].final_stock==4.0
+    finally:
+        manager.close()
@@ -0,0 +1,59 @@
+import threading
+
+from warehouse import JournalBackend,Record,WarehouseManager
+from warehouse.manager import FileLock
+
+def test_compaction_swaps_files_under_the_file_lock(tmp_path):
+    path=tmp_path/'db.json'
+    manager=WarehouseManager(str(path),'journal',compact_every=10**6)
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,1.0,0.0)
+    manager.add_records(product,sheet,page,[Record(1,f'NIR {i}','NIR',input=1.0) for i in range(5)])
+    manager.close()
+    
+    storage=JournalBackend(path)
+    storage.load()
+    storage.journal_path.replace(storage.sealed_journal_path)
+    compactor=threading.Thread(target=storage.compact)
+    with FileLock(path.with_suffix('.lock')):
+        compactor.start()
+        compactor.join(0.5)
+        # Another process holding db.lock still sees the sealed journal
+        assert compactor.is_alive()
+        assert storage.sealed_journal_path.exists()
+    compactor.join()
+    assert not storage.sealed_journal_path.exists()
+    
+    reloaded=WarehouseManager(str(path),'journal')
+    try:
+        assert len(reloaded.get_page(page).records)==5
+    finally:
+        reloaded.close()
+
+def test_compaction_starts_over_when_the_snapshot_changes(tmp_path):
+    path=tmp_path/'db.json'
+    manager=WarehouseManager(str(path),'journal',compact_every=10**6)
+    product=manager.add_product('Ceapă','kg')
+    manager.close()
+    storage=JournalBackend(path)
+    storage.load()
+    storage.journal_path.replace(storage.sealed_journal_path)
+    read=storage._read
+    def read_then_write_elsewhere(columnar):
+        result=read(columnar)
+        if storage.sealed_journal_path.exists() and not rounds:
+            # Another process saves a newer snapshot while this one folds
+            other=JournalBackend(path)
+            other._start_compaction=lambda:None
+            db=other.load()
+            db.products[0].name='Cartofi'
+            other.save(db)
+        rounds.append(columnar)
+        return result
+    rounds=[]
+    storage._read=read_then_write_elsewhere
+    storage.compact()
+    assert len(rounds)>=2
+    assert not storage.sealed_journal_path.exists()
+    assert [(p.id,p.name) for p in JournalBackend(path).load().products]==[(product,'Cartofi')]
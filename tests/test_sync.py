@@ -0,0 +1,80 @@
+from warehouse import Record
+from warehouse.sync import sync
+
+def _page(manager):
+    product=manager.add_product('Ceapă','kg')
+    sheet=manager.add_sheet(product,2025,1)
+    page=manager.add_page(product,sheet,2.0,0.0)
+    return product,sheet,page
+
+def test_positional_edits_wait_for_a_resync_past_a_trimmed_log(manager):
+    product,sheet,page=_page(manager)
+    manager.add_record(product,sheet,page,Record(1,'NIR 1','NIR',input=5.0))
+    since=sync(manager,'pwa',0,[])['version']
+    manager.changes.keep=4
+    for day in range(2,10):
+        manager.insert_record(product,sheet,page,0,Record(day,f'SRV {day}','NIR',input=1.0))
+    assert manager.changes.since(since) is None
+    reply=sync(manager,'pwa',since,[{'seq':1,'op':'delete_record','args':[product,sheet,page,0]}])
+    assert reply['applied']==0 and [r['seq'] for r in reply['rejected']]==[1]
+    assert reply['reset'] and reply['acked']==1
+    assert len(manager.get_page(page).records)==9
+    assert 'NIR 1' in [r.doc_id for r in manager.get_page(page).records]
+
+def _record(day:int,doc_id:str,**quantities)->dict:
+    return dict(day=day,doc_id=doc_id,doc_type='NIR',**quantities)
+
+def test_positional_edits_on_a_page_changed_on_the_server_are_rejected(manager):
+    product,sheet,page=_page(manager)
+    manager.add_record(product,sheet,page,Record(1,'NIR 1','NIR',input=5.0))
+    since=sync(manager,'pwa',0,[])['version']
+    manager.add_record(product,sheet,page,Record(2,'SRV 1','NIR',input=1.0))
+    reply=sync(manager,'pwa',since,[
+        {'seq':1,'op':'update_record','args':[product,sheet,page,0,{'input':4}]},
+        {'seq':2,'op':'add_record','args':[product,sheet,page,_record(3,'PWA 1',output=2)]},
+    ])
+    assert reply['applied']==1 and reply['rejected']==[{'seq':1,'error':'the page changed on the server'}]
+    # The page comes back whole, with the append chained after the server's record
+    assert [(r['doc_id'],r['final_stock']) for r in reply['pages'][page]['records']]==[('NIR 1',5.0),('SRV 1',6.0),('PWA 1',4.0)]
+    # Only the server's change is echoed, not the client's own append
+    assert [c['op'] for c in reply['changes']]==['add_record']
+    assert reply['changes'][0]['args'][3]['doc_id']=='SRV 1'
+
+def test_edits_on_untouched_pages_apply(manager):
+    product,sheet,page=_page(manager)
+    manager.add_record(product,sheet,page,Record(1,'NIR 1','NIR',input=5.0))
+    other=manager.add_page(product,sheet,3.0,0.0)
+    since=sync(manager,'pwa',0,[])['version']
+    manager.add_record(product,sheet,other,Record(2,'SRV 1','NIR',input=1.0))
+    reply=sync(manager,'pwa',since,[{'seq':1,'op':'update_record','args':[product,sheet,page,0,{'input':4}]}])
+    assert (reply['applied'],reply['rejected'],reply['pages'])==(1,[],{})
+    assert manager.get_page(page).records[0].final_stock==4.0
+
+def test_retried_changes_are_skipped_and_acked(manager):
+    product,sheet,page=_page(manager)
+    since=sync(manager,'pwa',0,[])['version']
+    changes=[{'seq':1,'op':'add_record','args':[product,sheet,page,_record(1,'PWA 1',input=2)]},
+             {'seq':2,'op':'delete_record','args':[product,sheet,page,7]},
+             {'seq':3,'op':'frobnicate','args':[]}]
+    reply=sync(manager,'pwa',since,changes)
+    assert (reply['acked'],reply['applied'])==(3,1)
+    assert [(r['seq'],r['error']) for r in reply['rejected']]==[(2,'nothing to apply it to'),(3,"unknown operation 'frobnicate'")]
+    assert reply['changes']==[]
+    # The reply was lost: the retry applies nothing twice
+    reply=sync(manager,'pwa',since,changes)
+    assert (reply['acked'],reply['applied'],reply['rejected'])==(3,0,[])
+    assert [r.doc_id for r in manager.get_page(page).records]==['PWA 1']
+    assert manager.changes.last_seq('pwa')==3
+
+def test_other_clients_see_the_changes(manager):
+    product,sheet,page=_page(manager)
+    since=sync(manager,'scanner',0,[])['version']
+    version=sync(manager,'pwa',since,[{'seq':1,'op':'add_record','args':[product,sheet,page,_record(1,'PWA 1',input=2)]}])['version']
+    reply=sync(manager,'scanner',since,[])
+    assert reply['version']==version and [c['op'] for c in reply['changes']]==['add_record']
+    assert sync(manager,'scanner',version,[])['changes']==[]
+
+def test_a_client_ahead_of_the_server_is_reset(manager):
+    _page(manager)
+    reply=sync(manager,'pwa',10**6,[])
+    assert reply['reset'] and [p['name'] for p in reply['snapshot']['products']]==['Ceapă']
@@ -0,0 +1,21 @@
+"""Warehouse stock ledger: products, monthly sheets and pages of records.
+
+The core needs only the standard library; NumPy and pandas are imported by
+the few functions that use them, ReportLab by `warehouse.reports` and
+Streamlit only by the web UI (app.py)."""
+from .model import Record,RecordColumns,Page,LazyPage,ArchivedPage,Sheet,Product,Database,Ref,record_count
+from .manager import WarehouseManager,Observer
+from .archive import Archive
+from .storage import (BACKENDS,StorageBackend,JsonBackend,JournalBackend,SqliteBackend,ShardedBackend,
+                      migrate_json_to_sqlite)
+from .importer import IMPORT_COLUMNS,ImportReport,import_rows,import_file
+from .i18n import LANGS
+
+__all__=[
+    'Record','RecordColumns','Page','LazyPage','ArchivedPage','Sheet','Product','Database','Ref','record_count',
+    'WarehouseManager','Observer',
+    'BACKENDS','StorageBackend','JsonBackend','JournalBackend','SqliteBackend','ShardedBackend',
+    'migrate_json_to_sqlite','Archive',
+    'IMPORT_COLUMNS','ImportReport','import_rows','import_file',
+    'LANGS',
+]
@@ -0,0 +1,169 @@
+"""Warehouse-wide analytics: valuation, movements and turnover.
+
+The database tree is flattened into two fact tables, one row per record
+and one per page. Each product is flattened on its own and kept until its
+stamp (WarehouseManager.stamp) moves, so after a change only that product
+is walked again; the reports are vectorized group-bys over the facts.
+Report columns are named after LANGS keys, see `report_frame`."""
+import threading
+from typing import TYPE_CHECKING,Optional,Tuple
+
+import numpy as np
+import pandas as pd
+
+from .model import RecordColumns,page_records
+from .ops import _page_closing
+
+if TYPE_CHECKING:
+    from .manager import WarehouseManager
+
+RECORD_FACTS=('product_id','year','month','page_id','price','day','doc_type','input','output','stock')
+PAGE_FACTS=('product_id','year','month','page_id','price','opening','closing')
+
+# Column types, so that empty fact tables merge and sum like full ones
+_DTYPES={'product_id':object,'year':'int64','month':'int64','page_id':object,'price':'float64','day':'int64',
+         'doc_type':object,'input':'float64','output':'float64','stock':'float64','opening':'float64','closing':'float64'}
+
+Period=Tuple[int,int]
+
+_RECORD_COLUMNS=('day','doc_type','input','output','final_stock')
+
+def _record_columns(records)->Tuple:
+    if isinstance(records,RecordColumns):
+        frame=records.to_frame({name:name for name in RecordColumns.FIELDS})
+        return tuple(frame[name].to_numpy() for name in _RECORD_COLUMNS)
+    return tuple([getattr(r,name) for r in records] for name in _RECORD_COLUMNS)
+
+def _empty(columns)->pd.DataFrame:
+    return pd.DataFrame({name:pd.Series(dtype=_DTYPES[name]) for name in columns})
+
+def _concat(frames,columns)->pd.DataFrame:
+    frames=[f for f in frames if len(f)]
+    return pd.concat(frames,ignore_index=True) if frames else _empty(columns)
+
+def product_facts(product)->Tuple[pd.DataFrame,pd.DataFrame]:
+    """(records, pages) facts of one product"""
+    pages={name:[] for name in PAGE_FACTS}
+    chunks={name:[] for name in RECORD_FACTS[1:]}
+    for sheet in product.sheets:
+        for page in sheet.pages:
+            records=page_records(page)
+            n=len(records)
+            for name,value in zip(PAGE_FACTS,(product.id,sheet.year,sheet.month,page.id,page.unit_price,
+                                              page.initial_stock,_page_closing(page) if n else page.initial_stock)):
+                pages[name].append(value)
+            if n:
+                for name,value in zip(RECORD_FACTS[1:5],(sheet.year,sheet.month,page.id,float(page.unit_price))):
+                    chunks[name].append(np.full(n,value,dtype=object if name=='page_id' else None))
+                for name,column in zip(RECORD_FACTS[5:],_record_columns(records)):
+                    chunks[name].append(np.asarray(column,dtype=object if name=='doc_type' else None))
+    pages=pd.DataFrame(pages).astype({name:_DTYPES[name] for name in PAGE_FACTS})
+    if not chunks['day']:
+        return _empty(RECORD_FACTS),pages
+    columns={name:np.concatenate(parts) for name,parts in chunks.items()}  # copies out of the pages
+    records=pd.DataFrame({'product_id':product.id,**columns})
+    return records,pages
+
+class Analytics:
+    """Fact tables of one manager's database, and the reports over them"""
+    def __init__(self,manager:'WarehouseManager'):
+        self.manager=manager
+        self._products={}  # product id -> (stamp, records, pages)
+        self._facts=None   # (version, records, pages, products)
+        self._lock=threading.Lock()
+    
+    def facts(self)->Tuple[pd.DataFrame,pd.DataFrame,pd.DataFrame]:
+        """(records, pages, products) fact tables for the current data"""
+        manager=self.manager
+        with self._lock,manager.lock.read():
+            if self._facts is not None and self._facts[0]==manager.version:
+                return self._facts[1:]
+            cached={}
+            for product in manager.db.products:
+                stamp=manager.stamp(product.id)
+                entry=self._products.get(product.id)
+                if entry is None or entry[0]!=stamp:
+                    entry=(stamp,)+product_facts(product)
+                cached[product.id]=entry
+            self._products=cached
+            entries=list(cached.values())
+            records=_concat([e[1] for e in entries],RECORD_FACTS)
+            pages=_concat([e[2] for e in entries],PAGE_FACTS)
+            records['doc_type']=records['doc_type'].astype('category')
+            products=pd.DataFrame({'product_id':pd.Series([p.id for p in manager.db.products],dtype=object),
+                                   'product_name':pd.Series([p.name for p in manager.db.products],dtype=object),
+                                   'measure_unit':pd.Series([p.measure_unit for p in manager.db.products],dtype=object)})
+            self._facts=(manager.version,records,pages,products)
+            return self._facts[1:]
+    
+    def _closing(self,year:int,month:int)->pd.DataFrame:
+        """Closing stock and its value per product id at the end of a month,
+        carried from the last period before it when the month has no sheet"""
+        _,pages,_=self.facts()
+        period=pages['year'].astype(int)*100+pages['month'].astype(int)
+        pages=pages[period<=year*100+month].assign(period=period)
+        pages=pages[pages['period']==pages.groupby('product_id')['period'].transform('max')]
+        pages=pages.assign(value=pages['closing'].astype(float)*pages['price'].astype(float))
+        closing=pages.groupby('product_id',sort=False).agg(year=('year','first'),month=('month','first'),
+                                                           final_stock=('closing','sum'),value=('value','sum'))
+        closing.index=closing.index.astype(object)
+        return closing.astype({'final_stock':float,'value':float})
+    
+    def valuation(self,year:int,month:int)->pd.DataFrame:
+        """Stock and its value (closing stock times unit price, per page)
+        for each product at the end of a month; highest value first"""
+        _,_,products=self.facts()
+        report=products.merge(self._closing(year,month),left_on='product_id',right_index=True)
+        return report.drop(columns='product_id').sort_values('value',ascending=False,ignore_index=True)
+    
+    def movements(self,start:Period,end:Optional[Period]=None)->pd.DataFrame:
+        """Inputs and outputs, in quantity and value, per month and
+        document type over the months from `start` to `end`"""
+        records=self._between(start,end)
+        records=records.assign(value_in=records['input']*records['price'],value_out=records['output']*records['price'])
+        report=records.groupby(['year','month','doc_type'],observed=True,sort=True).agg(
+            count=('day','size'),input=('input','sum'),output=('output','sum'),
+            value_in=('value_in','sum'),value_out=('value_out','sum'))
+        return report.reset_index()
+    
+    def turnover(self,start:Period,end:Optional[Period]=None)->pd.DataFrame:
+        """Per product over the months from `start` to `end`: what went in
+        and out, the average of the opening and closing stock, and
+        turnover (outputs over that average); top movers first"""
+        end=end or start
+        records=self._between(start,end)
+        moved=records.groupby('product_id',sort=False).agg(input=('input','sum'),output=('output','sum'))
+        before=(start[0]-1,12) if start[1]==1 else (start[0],start[1]-1)
+        _,_,products=self.facts()
+        moved.index=moved.index.astype(object)
+        report=products.merge(moved,left_on='product_id',right_index=True,how='left')
+        report=report.fillna({'input':0.0,'output':0.0}).astype({'input':float,'output':float})
+        report['initial_stock']=report['product_id'].map(self._closing(*before)['final_stock']).fillna(0.0).astype(float)
+        report['final_stock']=report['product_id'].map(self._closing(*end)['final_stock']).fillna(0.0).astype(float)
+        report['avg_stock']=(report['initial_stock']+report['final_stock'])/2
+        report['turnover']=report['output'].div(report['avg_stock']).where(report['avg_stock']>0,0.0)
+        return report.drop(columns='product_id').sort_values(['output','turnover'],ascending=False,ignore_index=True)
+    
+    def _between(self,start:Period,end:Optional[Period])->pd.DataFrame:
+        records,_,_=self.facts()
+        end=end or start
+        period=records['year'].astype(int)*100+records['month'].astype(int)
+        return records[(period>=start[0]*100+start[1])&(period<=end[0]*100+end[1])]
+    
+    def report(self,kind:str,start:Period,end:Optional[Period]=None)->pd.DataFrame:
+        """One of REPORTS over the months from `start` to `end`; valuation
+        is taken at the end of the range"""
+        if kind not in REPORTS:
+            raise ValueError(f'unknown report {kind!r}')
+        if kind=='valuation':
+            return self.valuation(*(end or start))
+        return getattr(self,kind)(start,end)
+
+REPORTS=('valuation','movements','turnover')
+
+def report_frame(report:pd.DataFrame,L)->pd.DataFrame:
+    """A report with its columns labelled and months named in language L"""
+    report=report.copy()
+    if 'month' in report:
+        report['month']=[L['months'][m] for m in report['month']]
+    return report.rename(columns={c:L[c] for c in report.columns if isinstance(L.get(c),str)})
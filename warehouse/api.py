@@ -0,0 +1,359 @@
+"""Async HTTP/JSON API over WarehouseManager for the PWA and scanner
+devices: python -m warehouse serve
+
+Built on Starlette and served by uvicorn, both of which come with
+Streamlit. Manager calls run in the thread pool so the event loop keeps
+serving; GET bodies are cached per database version with a content ETag,
+so a matching conditional GET costs a lookup and a 304. Lists take
+offset/limit and bodies over 1 KB are gzipped."""
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import fields
+from itertools import islice
+from pathlib import Path
+from typing import Optional
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse,JSONResponse,PlainTextResponse,Response
+from starlette.routing import Mount,Route
+from starlette.staticfiles import StaticFiles
+
+from .manager import WarehouseManager
+from .metrics import METRICS,update_gauges
+from .model import Record,_db_index,page_records,record_count
+from .ops import _json_number,_json_text,_record_changes,_record_from_json
+from .sync import sync
+
+PAGE_LIMIT=100
+MAX_LIMIT=1000
+GZIP_MIN_SIZE=1000
+RESPONSE_CACHE_SIZE=512
+# The PWA is served from the same origin, next to the API
+STATIC_ROOT=Path(__file__).resolve().parent.parent
+STATIC_FILES=('index.html','sw.js','manifest.json')
+RECORD_FIELDS=tuple(f.name for f in fields(Record))
+
+class ResponseCache:
+    """Encoded GET bodies and their ETags by (database version, URL);
+    entries of older versions simply age out"""
+    def __init__(self,size:int=RESPONSE_CACHE_SIZE):
+        self.size=size
+        self._entries=OrderedDict()
+    
+    def get(self,key)->Optional[tuple]:
+        entry=self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+    
+    def put(self,key,body:bytes)->tuple:
+        entry=(body,'W/"%s"'%hashlib.blake2b(body,digest_size=12).hexdigest())
+        self._entries[key]=entry
+        if len(self._entries)>self.size:
+            self._entries.popitem(last=False)
+        return entry
+
+def product_json(product)->dict:
+    return {'id':product.id,'name':product.name,'measure_unit':product.measure_unit,'sheets':len(product.sheets)}
+
+def sheet_json(product,sheet)->dict:
+    return {'id':sheet.id,'product_id':product.id,'year':sheet.year,'month':sheet.month,'pages':len(sheet.pages)}
+
+def page_json(sheet,page)->dict:
+    return {'id':page.id,'sheet_id':sheet.id,'unit_price':page.unit_price,'initial_stock':page.initial_stock,
+            'records':record_count(page)}
+
+def record_json(index:int,record)->dict:
+    row={'index':index}
+    for name in RECORD_FIELDS:
+        row[name]=getattr(record,name)
+    return row
+
+def _int_param(request:Request,name:str,default:Optional[int]=None)->int:
+    value=request.query_params.get(name)
+    if value is None:
+        if default is None:
+            raise ValueError(f'{name} is required')
+        return default
+    try:
+        number=int(value)
+    except ValueError:
+        raise ValueError(f'{name} is not a whole number: {value!r}')
+    if number<0:
+        raise ValueError(f'{name} is negative')
+    return number
+
+def _window(request:Request)->tuple:
+    offset=_int_param(request,'offset',0)
+    limit=min(_int_param(request,'limit',PAGE_LIMIT),MAX_LIMIT)
+    return offset,limit
+
+def _paginated(items,total:int,offset:int,limit:int)->dict:
+    return {'items':items,'total':total,'offset':offset,'limit':limit,
+            'next_offset':offset+limit if offset+limit<total else None}
+
+def _located(manager:WarehouseManager,kind:str,item_id:str):
+    """The product, (product, sheet) or (product, sheet, page) with this id"""
+    found=getattr(_db_index(manager.db),kind).get(item_id)
+    if found is None:
+        raise HTTPException(404,f'unknown {kind[:-1]} {item_id!r}')
+    return found
+
+async def _json_body(request:Request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise ValueError('the request body is not valid JSON')
+
+async def _cached_get(request:Request,build)->Response:
+    """Serve build(manager, request) as JSON through the response cache,
+    answering 304 when the client already has it"""
+    app=request.app
+    manager=app.state.manager
+    key=(await run_in_threadpool(manager.refresh),request.url.path,request.url.query)
+    entry=app.state.responses.get(key)
+    if entry is None:
+        body=await run_in_threadpool(_encode_read,manager,build,request)
+        entry=app.state.responses.put(key,body)
+    body,etag=entry
+    headers={'ETag':etag,'Cache-Control':'no-cache'}
+    if etag in request.headers.get('if-none-match',''):
+        return Response(status_code=304,headers=headers)
+    return Response(body,media_type='application/json',headers=headers)
+
+def _encode_read(manager:WarehouseManager,build,request:Request)->bytes:
+    with manager.lock.read(),METRICS.timer('api.read',path=request.url.path):
+        return json.dumps(build(manager,request),ensure_ascii=False,separators=(',',':')).encode()
+
+async def _write(request:Request,call,status:int=200)->Response:
+    result=await run_in_threadpool(call,request.app.state.manager)
+    if status==204:
+        return Response(status_code=204)
+    return JSONResponse(result,status_code=status)
+
+# Reads
+def _list_products(manager,request)->dict:
+    offset,limit=_window(request)
+    products=manager.db.products
+    return _paginated([product_json(p) for p in products[offset:offset+limit]],len(products),offset,limit)
+
+def _search_products(manager,request)->dict:
+    offset,limit=_window(request)
+    found=[p for _,p in manager.search_products(request.query_params['q'])]
+    with manager.lock.read():
+        return _paginated([product_json(p) for p in found[offset:offset+limit]],len(found),offset,limit)
+
+def _get_product(manager,request)->dict:
+    return product_json(_located(manager,'products',request.path_params['product_id']))
+
+def _list_sheets(manager,request)->dict:
+    offset,limit=_window(request)
+    product=_located(manager,'products',request.path_params['product_id'])
+    sheets=product.sheets[offset:offset+limit]
+    return _paginated([sheet_json(product,s) for s in sheets],len(product.sheets),offset,limit)
+
+def _get_sheet(manager,request)->dict:
+    return sheet_json(*_located(manager,'sheets',request.path_params['sheet_id']))
+
+def _list_pages(manager,request)->dict:
+    offset,limit=_window(request)
+    _,sheet=_located(manager,'sheets',request.path_params['sheet_id'])
+    pages=sheet.pages[offset:offset+limit]
+    return _paginated([page_json(sheet,p) for p in pages],len(sheet.pages),offset,limit)
+
+def _get_page(manager,request)->dict:
+    _,sheet,page=_located(manager,'pages',request.path_params['page_id'])
+    # Through the index itself: the read lock is already held
+    return dict(page_json(sheet,page),duplicate_doc_ids=manager.documents.duplicates(manager.db,page.id))
+
+def _list_records(manager,request)->dict:
+    offset,limit=_window(request)
+    page=_located(manager,'pages',request.path_params['page_id'])[2]
+    rows=islice(page_records(page),offset,offset+limit)
+    return _paginated([record_json(i,r) for i,r in enumerate(rows,start=offset)],record_count(page),offset,limit)
+
+def _find_documents(manager,request)->dict:
+    offset,limit=_window(request)
+    doc_id,doc_type=request.query_params.get('doc_id'),request.query_params.get('doc_type')
+    if not doc_id and not doc_type:
+        raise ValueError('doc_id or doc_type is required')
+    hits=manager.documents.find(manager.db,doc_id,doc_type)
+    items=[dict(record_json(i,r),product_id=product.id,sheet_id=sheet.id,page_id=page.id,year=sheet.year,month=sheet.month)
+           for product,sheet,page,i,r in hits[offset:offset+limit]]
+    return _paginated(items,len(hits),offset,limit)
+
+def _get_balance(manager,request)->dict:
+    product=_located(manager,'products',request.path_params['product_id'])
+    year=_int_param(request,'year')
+    month=_int_param(request,'month')
+    if not 1<=month<=12:
+        raise ValueError(f'month out of range: {month}')
+    return {'product_id':product.id,'year':year,'month':month,
+            'opening':manager.balances.opening_balance(product.id,year,month),
+            'closing':manager.balances.closing_balance(product.id,year,month)}
+
+async def products(request:Request)->Response:
+    if request.method=='POST':
+        data=await _json_body(request)
+        if not isinstance(data,dict):
+            raise ValueError('expected a JSON object')
+        name,unit=_json_text(data,'name'),_json_text(data,'measure_unit')
+        return await _write(request,lambda m:{'id':m.add_product(name,unit)},201)
+    if request.query_params.get('q'):
+        # search_products takes the read lock itself; taken again inside
+        # _cached_get's it would queue behind a waiting writer, so searches
+        # are not cached here (the name index keeps its own query cache)
+        manager=request.app.state.manager
+        return JSONResponse(await run_in_threadpool(_search_products,manager,request))
+    return await _cached_get(request,_list_products)
+
+async def product(request:Request)->Response:
+    if request.method=='DELETE':
+        product_id=request.path_params['product_id']
+        def delete(manager):
+            _located(manager,'products',product_id)
+            manager.delete_product(product_id)
+        return await _write(request,delete,204)
+    return await _cached_get(request,_get_product)
+
+async def sheets(request:Request)->Response:
+    if request.method=='POST':
+        data=await _json_body(request)
+        if not isinstance(data,dict):
+            raise ValueError('expected a JSON object')
+        product_id=request.path_params['product_id']
+        year,month=_json_number(data,'year',int),_json_number(data,'month',int)
+        if not 1<=month<=12:
+            raise ValueError(f'month out of range: {month}')
+        def add(manager):
+            _located(manager,'products',product_id)
+            return {'id':manager.add_sheet(product_id,year,month)}
+        return await _write(request,add,201)
+    return await _cached_get(request,_list_sheets)
+
+async def sheet(request:Request)->Response:
+    if request.method=='DELETE':
+        sheet_id=request.path_params['sheet_id']
+        def delete(manager):
+            _located(manager,'sheets',sheet_id)
+            manager.delete_sheet(None,sheet_id)
+        return await _write(request,delete,204)
+    return await _cached_get(request,_get_sheet)
+
+async def pages(request:Request)->Response:
+    if request.method=='POST':
+        data=await _json_body(request)
+        if not isinstance(data,dict):
+            raise ValueError('expected a JSON object')
+        sheet_id=request.path_params['sheet_id']
+        price=_json_number(data,'unit_price')
+        stock=_json_number(data,'initial_stock') if data.get('initial_stock') is not None else None
+        def add(manager):
+            _located(manager,'sheets',sheet_id)
+            return {'id':manager.add_page(None,sheet_id,price,stock)}
+        return await _write(request,add,201)
+    return await _cached_get(request,_list_pages)
+
+async def page(request:Request)->Response:
+    if request.method=='DELETE':
+        page_id=request.path_params['page_id']
+        def delete(manager):
+            _located(manager,'pages',page_id)
+            manager.delete_page(None,None,page_id)
+        return await _write(request,delete,204)
+    return await _cached_get(request,_get_page)
+
+async def records(request:Request)->Response:
+    if request.method=='POST':
+        data=await _json_body(request)
+        # One record, or a list of them appended as one operation
+        new=[_record_from_json(r) for r in data] if isinstance(data,list) else [_record_from_json(data)]
+        if not new:
+            raise ValueError('records must be a non-empty list')
+        page_id=request.path_params['page_id']
+        def add(manager):
+            _located(manager,'pages',page_id)
+            manager.add_records(None,None,page_id,new)
+            return {'added':len(new)}
+        return await _write(request,add,201)
+    return await _cached_get(request,_list_records)
+
+async def record(request:Request)->Response:
+    page_id=request.path_params['page_id']
+    index=request.path_params['index']
+    changes=_record_changes(await _json_body(request)) if request.method=='PATCH' else None
+    def change(manager):
+        with manager.lock.write():
+            if not index<record_count(_located(manager,'pages',page_id)[2]):
+                raise HTTPException(404,f'page {page_id!r} has no record {index}')
+            if changes is None:
+                manager.delete_record(None,None,page_id,index)
+            elif changes:
+                manager.update_record(None,None,page_id,index,**changes)
+    await run_in_threadpool(change,request.app.state.manager)
+    return Response(status_code=204)
+
+async def balance(request:Request)->Response:
+    return await _cached_get(request,_get_balance)
+
+async def documents(request:Request)->Response:
+    return await _cached_get(request,_find_documents)
+
+async def metrics(request:Request)->Response:
+    """Timers, counters and gauges in the Prometheus text format; empty
+    unless WAREHOUSE_METRICS=1"""
+    await run_in_threadpool(update_gauges,request.app.state.manager)
+    return PlainTextResponse(METRICS.prometheus_text(),media_type='text/plain; version=0.0.4')
+
+async def sync_changes(request:Request)->Response:
+    data=await _json_body(request)
+    if not isinstance(data,dict):
+        raise ValueError('expected a JSON object')
+    client,since,changes=data.get('client'),data.get('since',0),data.get('changes',[])
+    return await _write(request,lambda m:sync(m,client,since,changes))
+
+def _static(name:str):
+    async def serve(request:Request)->Response:
+        return FileResponse(STATIC_ROOT/name,headers={'Cache-Control':'no-cache'})
+    return serve
+
+async def _bad_request(request:Request,exc:ValueError)->Response:
+    return JSONResponse({'error':str(exc)},status_code=400)
+
+async def _http_error(request:Request,exc:HTTPException)->Response:
+    return JSONResponse({'error':exc.detail},status_code=exc.status_code,headers=exc.headers)
+
+def create_app(manager:WarehouseManager)->Starlette:
+    """The API (under /api) and the PWA it backs, over `manager`"""
+    routes=[
+        Route('/api/products',products,methods=['GET','POST']),
+        Route('/api/products/{product_id}',product,methods=['GET','DELETE']),
+        Route('/api/products/{product_id}/sheets',sheets,methods=['GET','POST']),
+        Route('/api/products/{product_id}/balance',balance),
+        Route('/api/sheets/{sheet_id}',sheet,methods=['GET','DELETE']),
+        Route('/api/sheets/{sheet_id}/pages',pages,methods=['GET','POST']),
+        Route('/api/pages/{page_id}',page,methods=['GET','DELETE']),
+        Route('/api/pages/{page_id}/records',records,methods=['GET','POST']),
+        Route('/api/pages/{page_id}/records/{index:int}',record,methods=['PATCH','DELETE']),
+        Route('/api/documents',documents),
+        Route('/api/sync',sync_changes,methods=['POST']),
+        Route('/metrics',metrics),
+        Route('/',_static('index.html')),
+        *[Route(f'/{name}',_static(name)) for name in STATIC_FILES],
+        Mount('/icons',StaticFiles(directory=STATIC_ROOT/'icons',check_dir=False)),
+    ]
+    app=Starlette(routes=routes,middleware=[Middleware(GZipMiddleware,minimum_size=GZIP_MIN_SIZE)],
+                  exception_handlers={ValueError:_bad_request,HTTPException:_http_error})
+    app.state.manager=manager
+    app.state.responses=ResponseCache()
+    return app
+
+def serve(manager:WarehouseManager,host:str='127.0.0.1',port:int=8000):
+    import uvicorn
+    uvicorn.run(create_app(manager),host=host,port=port)
@@ -0,0 +1,219 @@
+"""Closed periods: sheets frozen into immutable per-month archive files.
+
+Closing the periods through a month moves every sheet of those months out
+of the live database into db.archive/<year>-<month>.arc, one file per
+month (a month closed again later, say after a crash, gets another part,
+<year>-<month>.<n>.arc). db.json keeps a stub per archived sheet naming
+its part, so saving never touches archived records again.
+
+Parts are never rewritten. They are uncompressed and memory-mapped: a
+JSON index of the sheets and pages (with each page's closing stock, for
+balances), then the record columns of the snapshot format, so reading a
+page only copies its own slice of each column."""
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+from typing import Dict,List,Optional,Tuple
+
+from .model import ArchivedPage,Database,page_records
+from .snapshot import _ARRAYS,_ColumnWriter,_build_records,_decode_columns,_packed,_restore_ints,_unpacked
+
+MAGIC=b'WHARCH'
+FORMAT_VERSION=1
+_LENGTH=struct.Struct('<Q')
+_PART=re.compile(r'(\d{4})-(\d{2})(?:\.\d+)?$')
+
+Period=Tuple[int,int]
+
+def _write_part(path:Path,sheets:List[tuple]):
+    """Write (product id, sheet) pairs as a part, atomically"""
+    from .storage import _write_atomic
+    writer=_ColumnWriter()
+    index=[]
+    for product_id,sheet in sheets:
+        pages=[]
+        for page in sheet.pages:
+            records=page_records(page)
+            start=len(writer)
+            writer.add(records)
+            pages.append({'id':page.id,'unit_price':page.unit_price,'initial_stock':page.initial_stock,
+                          'start':start,'records':len(records),
+                          'closing':records[-1].final_stock if len(records) else page.initial_stock})
+            ints=writer.int_rows(start)
+            if ints:
+                pages[-1]['ints']=ints
+        index.append({'product_id':product_id,'id':sheet.id,'year':sheet.year,'month':sheet.month,'pages':pages})
+    # Each page's doc ids and comments as one small JSON array
+    strings=[]
+    for entry in index:
+        for pg in entry['pages']:
+            rows=slice(pg['start'],pg['start']+pg['records'])
+            strings.append(json.dumps([writer.columns['doc_id'][rows],writer.columns['comment'][rows]],
+                                      ensure_ascii=False,separators=(',',':')).encode())
+    sections,offset={},0
+    for name,typecode in _ARRAYS.items():
+        sections[name]=offset
+        offset+=len(writer.columns[name])*array(typecode).itemsize
+        offset+=-offset%8
+    pages=[pg for entry in index for pg in entry['pages']]
+    for pg,blob in zip(pages,strings):
+        pg['strings']=[offset,len(blob)]
+        offset+=len(blob)
+    header=json.dumps({'sheets':index,'doc_types':writer.doc_types,'columns':sections},
+                      ensure_ascii=False,separators=(',',':')).encode()
+    header+=b' '*(-(len(MAGIC)+1+_LENGTH.size+len(header))%8)
+    def write(f):
+        f.write(MAGIC+bytes([FORMAT_VERSION])+_LENGTH.pack(len(header))+header)
+        for name,typecode in _ARRAYS.items():
+            data=_packed(typecode,writer.columns[name])
+            f.write(data+b'\0'*(-len(data)%8))
+        for blob in strings:
+            f.write(blob)
+    _write_atomic(path,write,binary=True)
+
+class ArchivePart:
+    """One part file, memory-mapped read-only"""
+    def __init__(self,path:Path):
+        with open(path,'rb') as f:
+            self._map=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)]!=MAGIC:
+            raise ValueError(f'{path} is not a warehouse archive')
+        if self._map[len(MAGIC)]>FORMAT_VERSION:
+            raise ValueError(f'{path} is in a newer archive format than this version of warehouse reads')
+        (length,)=_LENGTH.unpack_from(self._map,len(MAGIC)+1)
+        self._base=len(MAGIC)+1+_LENGTH.size+length
+        header=json.loads(self._map[self._base-length:self._base])
+        self.sheets=header['sheets']
+        self.doc_types=header['doc_types']
+        self._columns=header['columns']
+    
+    def records(self,page:Dict,columnar:bool):
+        """A page's records (an entry of `sheets`), read from the map"""
+        start,count=page['start'],page['records']
+        columns={}
+        for name,typecode in _ARRAYS.items():
+            size=array(typecode).itemsize
+            offset=self._base+self._columns[name]+start*size
+            columns[name]=_unpacked(typecode,self._map[offset:offset+count*size])
+        offset,length=page['strings']
+        columns['doc_id'],columns['comment']=json.loads(self._map[self._base+offset:self._base+offset+length])
+        if not columnar:
+            _restore_ints(columns,page.get('ints',{}))
+        return _build_records(_decode_columns(columns,self.doc_types,columnar),0,count,columnar)
+
+class Archive:
+    """The parts under `root` (db.archive/ next to db.json) and the month
+    the periods are closed through, kept in root/closed.
+    
+    Up to `cache_pages` pages read from the parts are kept, least recently
+    used first out, shared by every archived page of the database."""
+    def __init__(self,root:Path,columnar:bool=False,cache_pages:int=256):
+        self.root=root
+        self.columnar=columnar
+        self.cache_pages=cache_pages
+        self._parts={}
+        self._cache=OrderedDict()
+        self._lock=threading.Lock()
+    
+    @property
+    def closed(self)->Optional[Period]:
+        """The last closed month, or None if no period is closed"""
+        try:
+            year,month=(self.root/'closed').read_text().strip().split('-')
+        except (FileNotFoundError,ValueError):
+            return None
+        return int(year),int(month)
+    
+    def _part(self,name:str)->ArchivePart:
+        path=self.root/f'{name}.arc'
+        try:
+            stat=path.stat()
+        except FileNotFoundError:
+            raise ValueError(f'archive part {path} is missing')
+        # A part removed by prune may come back under its name with other sheets
+        key=(name,stat.st_ino,stat.st_mtime_ns)
+        with self._lock:
+            part=self._parts.get(key)
+            if part is None:
+                part=self._parts[key]=ArchivePart(path)
+            return part
+    
+    def _records(self,part:ArchivePart,page:Dict):
+        key=page['id']
+        with self._lock:
+            records=self._cache.get(key)
+            if records is not None:
+                self._cache.move_to_end(key)
+                return records
+        records=part.records(page,self.columnar)
+        with self._lock:
+            self._cache[key]=records
+            while len(self._cache)>self.cache_pages:
+                self._cache.popitem(last=False)
+        return records
+    
+    def attach(self,db:Database):
+        """Give the stub of every archived sheet in `db` its pages"""
+        parts={}
+        for product in db.products:
+            for sheet in product.sheets:
+                if sheet.archive is None:
+                    continue
+                found=parts.get(sheet.archive)
+                if found is None:
+                    part=self._part(sheet.archive)
+                    found=parts[sheet.archive]=(part,{entry['id']:entry for entry in part.sheets})
+                part,entries=found
+                entry=entries.get(sheet.id)
+                if entry is None:
+                    raise ValueError(f'sheet {sheet.id} is missing from archive part {sheet.archive}')
+                sheet.pages=[ArchivedPage(pg['unit_price'],pg['initial_stock'],partial(self._records,part,pg),
+                                          pg['records'],pg['closing'],pg['id']) for pg in entry['pages']]
+    
+    def freeze(self,db:Database,through:Period)->int:
+        """Archive every live sheet of `db` up to and including the month
+        `through`, a part per month; returns how many were archived. The
+        caller saves `db` afterwards, which makes the parts count."""
+        months={}
+        for product in db.products:
+            for sheet in product.sheets:
+                if sheet.archive is None and (sheet.year,sheet.month)<=tuple(through):
+                    months.setdefault((sheet.year,sheet.month),[]).append((product.id,sheet))
+        self.root.mkdir(parents=True,exist_ok=True)
+        for (year,month),sheets in sorted(months.items()):
+            name=f'{year:04d}-{month:02d}'
+            n=0
+            while (self.root/f'{name}.arc').exists():
+                n+=1
+                name=f'{year:04d}-{month:02d}.{n}'
+            _write_part(self.root/f'{name}.arc',sheets)
+            for _,sheet in sheets:
+                sheet.archive=name
+        closed=max(filter(None,(self.closed,tuple(through))))
+        from .storage import _write_atomic
+        _write_atomic(self.root/'closed',lambda f:f.write(f'{closed[0]:04d}-{closed[1]:02d}\n'))
+        if months:
+            self.attach(db)
+            db.index=None
+        return sum(len(sheets) for sheets in months.values())
+    
+    def prune(self,db:Database):
+        """Remove parts no sheet of `db` refers to: left by a close that did
+        not get saved, or by deleted products"""
+        live={sheet.archive for product in db.products for sheet in product.sheets}
+        for path in self.root.glob('*.arc'):
+            if path.stem not in live and _PART.match(path.stem):
+                with self._lock:
+                    for key in [key for key in self._parts if key[0]==path.stem]:
+                        del self._parts[key]
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass  # still mapped on platforms that refuse that
@@ -0,0 +1,86 @@
+"""Opening and closing stock balances per product and period"""
+from bisect import bisect_left,bisect_right
+from typing import TYPE_CHECKING
+
+from .model import Product,_find_product,_find_sheet
+from .ops import _periods,_page_closing,_lot_closings
+
+if TYPE_CHECKING:
+    from .manager import WarehouseManager
+
+class BalanceEngine:
+    """Closing stock per (product, year, month), cached.
+    
+    The balance of a period is the sum of the closing stocks of its pages;
+    a month without a sheet carries the balance of the last one before it.
+    Since openings are carried forward between periods, a change in one
+    period drops the cached values of that period and every later one."""
+    def __init__(self,manager:'WarehouseManager'):
+        self.manager=manager
+        self.clear()
+    
+    def clear(self):
+        self._closing={}
+        self._periods={}
+    
+    def invalidate(self,op:str,args:tuple):
+        """Called before `op` is applied, while the sheet it names still exists"""
+        db=self.manager.db
+        if op=='add_product':
+            return
+        if op=='delete_product':
+            self._drop(args[0],(0,0))
+            return
+        if op=='add_sheet':
+            self._drop(args[0],(args[1],args[2]))
+            return
+        if op=='carry_openings':
+            self._drop(args[0],(args[1],args[2]+1))  # the periods after year-month
+            return
+        found=_find_sheet(db,args[0],args[1]) if len(args)>=2 else None
+        if found is None:
+            self.clear()
+            return
+        product,sheet=found
+        self._drop(product.id,(sheet.year,sheet.month))
+    
+    def _drop(self,product_id:str,period:tuple):
+        self._periods.pop(product_id,None)
+        cached=self._closing.get(product_id)
+        if cached:
+            for key in [key for key in cached if key>=period]:
+                del cached[key]
+    
+    def _product_periods(self,product:Product)->tuple:
+        """(sorted period keys, matching [(period,sheets)]) for bisecting"""
+        periods=self._periods.get(product.id)
+        if periods is None:
+            grouped=_periods(product)
+            periods=self._periods[product.id]=([period for period,_ in grouped],grouped)
+        return periods
+    
+    def closing_balance(self,product_ref,year:int,month:int)->float:
+        product=_find_product(self.manager.db,product_ref)
+        if product is None:
+            return 0.0
+        keys,periods=self._product_periods(product)
+        i=bisect_right(keys,(year,month))-1
+        if i<0:
+            return 0.0
+        period,sheets=periods[i]
+        cached=self._closing.setdefault(product.id,{})
+        if period not in cached:
+            cached[period]=sum(_page_closing(page) for sheet in sheets for page in sheet.pages)
+        return cached[period]
+    
+    def opening_balance(self,product_ref,year:int,month:int)->float:
+        return self.closing_balance(product_ref,*((year-1,12) if month==1 else (year,month-1)))
+    
+    def carried_opening(self,product_ref,sheet_ref,unit_price:float)->float:
+        """Opening stock a new page at `unit_price` would inherit"""
+        product,sheet=_find_sheet(self.manager.db,product_ref,sheet_ref)
+        keys,periods=self._product_periods(product)
+        i=bisect_left(keys,(sheet.year,sheet.month))-1
+        if i<0:
+            return 0.0
+        return _lot_closings(periods[i][1]).get(unit_price,0.0)
@@ -0,0 +1,194 @@
+"""Benchmarks: a seeded synthetic database and timings of the main paths.
+
+    python -m warehouse bench --products 200 --records 100 --out before.json
+    python -m warehouse bench --products 200 --records 100 --compare before.json
+
+Every run builds a fresh database in a temporary directory from the seed,
+so two runs with the same settings measure the same data. Results are
+JSON: per step the min, median and max seconds over `repeat` runs, and the
+peak of Python allocations (tracemalloc) during one more run."""
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict,dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable,Dict,List,Optional
+
+from .manager import WarehouseManager
+from .model import Record,_find_page
+
+NAMES=('cartofi','ceapă','morcovi','varză','mere','pere','roșii','ardei','castraveți','usturoi','fasole','mazăre')
+UNITS=('kg','buc','l','bax')
+# Document types by direction of the movement
+INPUT_DOCS=('NIR','Aviz')
+OUTPUT_DOCS=('BC','Bon','Factura')
+
+@dataclass
+class BenchConfig:
+    products:int=10
+    sheets:int=12       # per product, one per month
+    pages:int=2         # per sheet
+    records:int=25      # per page
+    seed:int=1
+    storage:str='json'
+    snapshot:Optional[str]=None     # db.json format for the json and journal engines
+    repeat:int=3
+    ops:int=20          # calls per timed run of the per-operation steps
+
+def _records(rng:random.Random,count:int,doc_no:int)->List[Record]:
+    records=[]
+    for i,day in enumerate(sorted(rng.randint(1,28) for _ in range(count))):
+        if rng.random()<0.4:
+            records.append(Record(day,f'{rng.choice(INPUT_DOCS)}-{doc_no+i}',rng.choice(INPUT_DOCS),
+                                  input=float(rng.randint(1,500))))
+        else:
+            records.append(Record(day,f'{rng.choice(OUTPUT_DOCS)}-{doc_no+i}',rng.choice(OUTPUT_DOCS),
+                                  output=float(rng.randint(1,200))))
+    return records
+
+def generate(manager:WarehouseManager,config:BenchConfig)->int:
+    """Fill `manager` with products x sheets x pages x records from the
+    seed, in one commit; returns the number of records"""
+    rng=random.Random(config.seed)
+    doc_no=0
+    with manager.batch():
+        for p in range(config.products):
+            product=manager.add_product(f'{rng.choice(NAMES)} {p+1}',rng.choice(UNITS))
+            for s in range(config.sheets):
+                sheet=manager.add_sheet(product,2000+s//12,s%12+1)
+                for _ in range(config.pages):
+                    page=manager.add_page(product,sheet,round(rng.uniform(0.5,50.0),2),float(rng.randint(0,1000)))
+                    if config.records:
+                        manager.add_records(product,sheet,page,_records(rng,config.records,doc_no))
+                        doc_no+=config.records
+    return config.products*config.sheets*config.pages*config.records
+
+def _measure(run:Callable[[],None],repeat:int,ops:int=1)->Dict:
+    times=[]
+    for _ in range(repeat):
+        start=time.perf_counter()
+        run()
+        times.append(time.perf_counter()-start)
+    tracemalloc.start()
+    try:
+        run()
+        peak=tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    median=statistics.median(times)
+    return {'min':min(times),'median':median,'max':max(times),'repeat':repeat,'ops':ops,
+            'per_op':median/ops,'peak_bytes':peak}
+
+def _max_rss()->Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform=='darwin' else rss*1024
+
+def _disk_bytes(root:Path)->int:
+    return sum(f.stat().st_size for f in root.rglob('*') if f.is_file())
+
+def run(config:BenchConfig,label:Optional[str]=None,log:Callable[[str],None]=lambda line:None)->Dict:
+    """Generate the database and time each step; `label` names the version
+    under test in the results, `log` gets a line per step"""
+    rng=random.Random(config.seed+1)
+    root=Path(tempfile.mkdtemp(prefix='warehouse-bench-'))
+    results={}
+    def step(name:str,measured:Dict):
+        results[name]=measured
+        log(f"{name:<28}{measured['median']*1000:>12.2f} ms{measured['per_op']*1000:>12.3f} ms/op"
+            f"{measured['peak_bytes']/2**20:>10.1f} MiB")
+    try:
+        options={'snapshot':config.snapshot} if config.snapshot else {}
+        manager=WarehouseManager(str(root/'db.json'),storage=config.storage,**options)
+        try:
+            start=time.perf_counter()
+            total=generate(manager,config)
+            generated=time.perf_counter()-start
+            log(f'{total} records generated in {generated:.2f} s')
+            
+            step('load_data',_measure(manager.load_data,config.repeat))
+            step('save_data',_measure(manager.save_data,config.repeat))
+            pages=[(product.id,sheet.id,page.id) for product in manager.db.products
+                   for sheet in product.sheets for page in sheet.pages]
+            
+            def add_records():
+                for ref in rng.choices(pages,k=config.ops):
+                    manager.add_record(*ref,_records(rng,1,0)[0])
+            step('add_record',_measure(add_records,config.repeat,config.ops))
+            
+            def delete_records():
+                for ref in rng.choices(pages,k=config.ops):
+                    count=len(_find_page(manager.db,*ref)[2].records)
+                    if count:
+                        index=rng.randrange(count)
+                        manager.delete_record(*ref,index)
+                        manager.recalculate_stocks(*ref,index)
+            step('delete_record+recalculate',_measure(delete_records,config.repeat,config.ops))
+            
+            queries=[name[:n] for name in NAMES for n in (3,5)]+[f' {n}' for n in range(1,10)]
+            def search():
+                for query in rng.choices(queries,k=config.ops):
+                    manager.search_products(query)
+            step('search_products',_measure(search,config.repeat,config.ops))
+            
+            try:
+                from .i18n import LANGS
+                from .reports import generate_pdf,records_frame
+            except ImportError as e:
+                log(f'report steps skipped: {e}')
+            else:
+                L=LANGS['en']
+                def frames():
+                    for ref in rng.choices(pages,k=config.ops):
+                        records_frame(_find_page(manager.db,*ref)[2].records,L)
+                step('records_frame',_measure(frames,config.repeat,config.ops))
+                # The product with the most records, all its pages in one table
+                product=max(manager.db.products,key=lambda p:sum(len(pg.records) for s in p.sheets for pg in s.pages))
+                import pandas as pd
+                table=pd.concat([records_frame(pg.records,L) for s in product.sheets for pg in s.pages],ignore_index=True)
+                step('generate_pdf',_measure(lambda:generate_pdf(table,product.name,'en'),config.repeat,len(table)))
+        finally:
+            manager.close()
+        return {
+            'benchmark':'warehouse',
+            'label':label,
+            'created':datetime.now().isoformat(timespec='seconds'),
+            'python':platform.python_version(),
+            'platform':platform.platform(),
+            'config':asdict(config),
+            'records':total,
+            'generate_seconds':generated,
+            'disk_bytes':_disk_bytes(root),
+            'max_rss_bytes':_max_rss(),
+            'results':results,
+        }
+    finally:
+        shutil.rmtree(root,ignore_errors=True)
+
+def compare(baseline:Dict,current:Dict,tolerance:float=0.2)->List[str]:
+    """Steps whose median time grew by more than `tolerance` (a fraction)
+    over `baseline`, as lines for a report; empty if none did"""
+    regressions=[]
+    for name,now in current['results'].items():
+        before=baseline.get('results',{}).get(name)
+        if before is None or not before['median']:
+            continue
+        ratio=now['median']/before['median']
+        if ratio>1+tolerance:
+            regressions.append(f"{name}: {before['median']*1000:.2f} ms -> {now['median']*1000:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+def write(result:Dict,path:str):
+    with open(path,'w',encoding='utf-8') as f:
+        json.dump(result,f,ensure_ascii=False,indent=2)
+        f.write('\n')
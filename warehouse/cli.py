@@ -0,0 +1,290 @@
+"""The warehouse command line: python -m warehouse --help
+
+Each command imports only what it needs (exports load ReportLab), so
+queries and maintenance jobs start in a fraction of a second."""
+import argparse
+import csv
+import json
+import os
+import sys
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+
+from .importer import IMPORT_COLUMNS,import_file
+from .manager import WarehouseManager
+from .model import Product,page_records
+from .snapshot import SNAPSHOT_FORMATS
+from .storage import BACKENDS,JsonBackend,migrate_json_to_sqlite
+
+DEFAULT_DB=os.path.expanduser('~/WarehouseDB/db.json')
+
+@contextmanager
+def _open(args):
+    manager=WarehouseManager(args.db,storage=args.storage)
+    try:
+        yield manager
+    finally:
+        manager.close()
+
+def _product(manager,ref:str)->Product:
+    """A product by id or by its (unique) name"""
+    product=manager.get_product(ref)
+    if product is not None:
+        return product
+    products=manager.products_named(ref)
+    if not products:
+        raise ValueError(f'unknown product {ref!r}')
+    if len(products)>1:
+        raise ValueError(f'more than one product is named {ref!r}; give its id')
+    return products[0]
+
+def cmd_products(args)->int:
+    with _open(args) as manager:
+        if args.search:
+            products=[p for _,p in manager.search_products(args.search)]
+        else:
+            products=list(manager.db.products)
+        rows=[{'id':p.id,'name':p.name,'measure_unit':p.measure_unit,'sheets':len(p.sheets)} for p in products]
+    if args.json:
+        json.dump(rows,sys.stdout,ensure_ascii=False,indent=2)
+        print()
+    else:
+        for row in rows:
+            print(f"{row['id']}  {row['name']} ({row['measure_unit']}), {row['sheets']} sheets")
+    return 0
+
+def cmd_balance(args)->int:
+    with _open(args) as manager:
+        product=_product(manager,args.product)
+        opening=manager.opening_balance(product.id,args.year,args.month)
+        closing=manager.closing_balance(product.id,args.year,args.month)
+    print(f'{product.name} {args.year}-{args.month:02d}: opening {opening:g}, closing {closing:g} {product.measure_unit}')
+    return 0
+
+def cmd_import(args)->int:
+    with _open(args) as manager:
+        report=import_file(manager,args.file,args.kind,strict=args.strict)
+    for line,message in report.errors:
+        print(f'row {line}: {message}',file=sys.stderr)
+    print(f'{report.imported} of {report.rows} rows imported')
+    return 1 if report.errors else 0
+
+def _export_records(manager,products,out)->int:
+    """Records as CSV in the layout `import records` reads back"""
+    writer=csv.writer(out)
+    writer.writerow(IMPORT_COLUMNS['records']+('initial_stock','final_stock'))
+    count=0
+    for product in products:
+        for sheet in product.sheets:
+            for number,page in enumerate(sheet.pages,start=1):
+                for r in page_records(page):
+                    writer.writerow((product.name,sheet.year,sheet.month,number,r.day,r.doc_id,r.doc_type,
+                                     r.input,r.output,r.comment,r.initial_stock,r.final_stock))
+                    count+=1
+    return count
+
+def cmd_export(args)->int:
+    with _open(args) as manager:
+        products=[_product(manager,args.product)] if args.product else list(manager.db.products)
+        if args.what=='records':
+            with open(args.file,'w',encoding='utf-8',newline='') as f:
+                count=_export_records(manager,products,f)
+            print(f'{count} records written to {args.file}')
+            return 0
+        from .reports import generate_ledger_pdf
+        pdf=generate_ledger_pdf(manager.db,args.lang,products[0].id if args.product else None)
+    Path(args.file).write_bytes(pdf)
+    print(f'ledger written to {args.file}')
+    return 0
+
+def cmd_find(args)->int:
+    if not args.doc_id and not args.type:
+        raise ValueError('give a doc id, --type or both')
+    with _open(args) as manager:
+        rows=[{'product':product.name,'product_id':product.id,'year':sheet.year,'month':sheet.month,
+               'page':next(n for n,p in enumerate(sheet.pages,start=1) if p is page),'index':i,'day':r.day,'doc_id':r.doc_id,'doc_type':r.doc_type,
+               'input':r.input,'output':r.output}
+              for product,sheet,page,i,r in manager.find_documents(args.doc_id,args.type,args.limit)]
+    if args.json:
+        json.dump(rows,sys.stdout,ensure_ascii=False,indent=2)
+        print()
+    else:
+        for row in rows:
+            print(f"{row['product']} {row['year']}-{row['month']:02d} page {row['page']} #{row['index']}: "
+                  f"day {row['day']} {row['doc_type']} {row['doc_id']}, in {row['input']:g} out {row['output']:g}")
+    return 0
+
+def cmd_report(args)->int:
+    from .analytics import Analytics,report_frame
+    from .i18n import LANGS
+    start=(args.year,args.month)
+    end=tuple(args.to) if args.to else start
+    if end<start:
+        raise ValueError('--to is before the start month')
+    with _open(args) as manager:
+        report=report_frame(Analytics(manager).report(args.kind,start,end),LANGS[args.lang])
+    if args.pdf:
+        from .reports import generate_pdf
+        period=f'{end[0]}-{end[1]:02d}' if args.kind=='valuation' or end==start else f'{start[0]}-{start[1]:02d} - {end[0]}-{end[1]:02d}'
+        Path(args.pdf).write_bytes(generate_pdf(report,f"{LANGS[args.lang][args.kind]} {period}",args.lang))
+        print(f'report written to {args.pdf}')
+    elif args.json:
+        print(report.to_json(orient='records',force_ascii=False,indent=2))
+    else:
+        print(report.to_string(index=False) if len(report) else '(no data)')
+    return 0
+
+def cmd_bench(args)->int:
+    from .bench import BenchConfig,compare,run,write
+    config=BenchConfig(products=args.products,sheets=args.sheets,pages=args.pages,records=args.records,
+                       seed=args.seed,storage=args.storage,snapshot=args.snapshot,repeat=args.repeat,ops=args.ops)
+    result=run(config,args.label,log=print)
+    if args.out:
+        write(result,args.out)
+        print(f'results written to {args.out}')
+    if not args.compare:
+        return 0
+    with open(args.compare,encoding='utf-8') as f:
+        baseline=json.load(f)
+    if baseline.get('config')!=result['config']:
+        print('note: the baseline was run with other settings',file=sys.stderr)
+    regressions=compare(baseline,result,args.tolerance)
+    for line in regressions:
+        print(f'slower: {line}')
+    print(f'{len(regressions)} of {len(result["results"])} steps slower than {args.compare} by over {args.tolerance:.0%}')
+    return 1 if regressions else 0
+
+def cmd_recalculate(args)->int:
+    with _open(args) as manager:
+        manager.recalculate_all()
+    return 0
+
+def cmd_serve(args)->int:
+    try:
+        from .api import serve
+    except ImportError as e:
+        raise ValueError(f'the API server needs starlette and uvicorn ({e})')
+    with _open(args) as manager:
+        serve(manager,args.host,args.port)
+    return 0
+
+def cmd_migrate_sqlite(args)->int:
+    migrate_json_to_sqlite(args.db)
+    print(f'{args.db} copied to {Path(args.db).with_suffix(".sqlite")}')
+    return 0
+
+def cmd_snapshot(args)->int:
+    with _open(args) as manager:
+        if not isinstance(manager.storage,JsonBackend):
+            raise ValueError(f'the {args.storage} engine keeps no db.json')
+        before=manager.db_path.stat().st_size
+        manager.storage.snapshot=args.format
+        manager.save_data()
+        after=manager.db_path.stat().st_size
+    print(f'{args.db} rewritten as {args.format}: {before:,} -> {after:,} bytes')
+    return 0
+
+def cmd_close_periods(args)->int:
+    if args.year is None:
+        today=date.today()
+        months=today.year*12+today.month-1-args.keep_months
+        args.year,args.month=months//12,months%12+1
+    elif args.month is None:
+        raise ValueError('give both the year and the month')
+    with _open(args) as manager:
+        archived=manager.close_periods(args.year,args.month)
+    print(f'periods closed through {args.year}-{args.month:02d}: {archived} sheets archived')
+    return 0
+
+def build_parser()->argparse.ArgumentParser:
+    parser=argparse.ArgumentParser(prog='warehouse',description='Warehouse management without the web UI')
+    parser.add_argument('--db',default=DEFAULT_DB,help='database path (default: %(default)s)')
+    parser.add_argument('--storage',default=os.environ.get('WAREHOUSE_STORAGE','json'),choices=sorted(BACKENDS))
+    commands=parser.add_subparsers(dest='command',required=True)
+    
+    products=commands.add_parser('products',help='list products')
+    products.add_argument('--search',help='only products whose name contains this')
+    products.add_argument('--json',action='store_true',help='print JSON')
+    products.set_defaults(run=cmd_products)
+    
+    balance=commands.add_parser('balance',help='opening and closing stock of a product for a month')
+    balance.add_argument('product',help='product id or name')
+    balance.add_argument('year',type=int)
+    balance.add_argument('month',type=int,choices=range(1,13),metavar='month')
+    balance.set_defaults(run=cmd_balance)
+    
+    importer=commands.add_parser('import',help='bulk import products, pages or records from a CSV or XLSX file')
+    importer.add_argument('kind',choices=list(IMPORT_COLUMNS))
+    importer.add_argument('file')
+    importer.add_argument('--strict',action='store_true',help='import nothing if any row is invalid')
+    importer.set_defaults(run=cmd_import)
+    
+    export=commands.add_parser('export',help='export records as CSV or the full ledger as PDF')
+    export.add_argument('what',choices=('records','ledger'))
+    export.add_argument('file')
+    export.add_argument('--product',help='only this product (id or name)')
+    export.add_argument('--lang',default='ro',choices=('ro','en'),help='ledger language')
+    export.set_defaults(run=cmd_export)
+    
+    find=commands.add_parser('find',help='records of a document (delivery note, invoice) across the warehouse')
+    find.add_argument('doc_id',nargs='?',help='document id')
+    find.add_argument('--type',help='only (or all) documents of this type')
+    find.add_argument('--limit',type=int,help='at most this many records')
+    find.add_argument('--json',action='store_true',help='print JSON')
+    find.set_defaults(run=cmd_find)
+    
+    report=commands.add_parser('report',help='stock valuation, movements or turnover over a range of months')
+    report.add_argument('kind',choices=('valuation','movements','turnover'))
+    report.add_argument('year',type=int)
+    report.add_argument('month',type=int,choices=range(1,13),metavar='month')
+    report.add_argument('--to',type=int,nargs=2,metavar=('YEAR','MONTH'),help='last month of the range (valuation is taken there)')
+    report.add_argument('--lang',default='en',choices=('ro','en'),help='column labels')
+    report.add_argument('--pdf',metavar='FILE',help='write the report as PDF')
+    report.add_argument('--json',action='store_true',help='print JSON')
+    report.set_defaults(run=cmd_report)
+    
+    recalculate=commands.add_parser('recalculate',help='rebuild the stock chain of every page')
+    recalculate.set_defaults(run=cmd_recalculate)
+    
+    bench=commands.add_parser('bench',help='time the main paths on a generated database (--db is not used)')
+    bench.add_argument('--products',type=int,default=10)
+    bench.add_argument('--sheets',type=int,default=12,help='per product (default: %(default)s)')
+    bench.add_argument('--pages',type=int,default=2,help='per sheet (default: %(default)s)')
+    bench.add_argument('--records',type=int,default=25,help='per page (default: %(default)s)')
+    bench.add_argument('--seed',type=int,default=1)
+    bench.add_argument('--snapshot',choices=SNAPSHOT_FORMATS,help='db.json format (json and journal engines)')
+    bench.add_argument('--repeat',type=int,default=3,help='timed runs per step (default: %(default)s)')
+    bench.add_argument('--ops',type=int,default=20,help='calls per run of the per-operation steps (default: %(default)s)')
+    bench.add_argument('--label',help='name of the version under test, kept in the results')
+    bench.add_argument('--out',metavar='FILE',help='write the results as JSON')
+    bench.add_argument('--compare',metavar='FILE',help='results of an earlier run; exit 1 if a step got slower')
+    bench.add_argument('--tolerance',type=float,default=0.2,help='slowdown allowed by --compare (default: %(default)s)')
+    bench.set_defaults(run=cmd_bench)
+    
+    server=commands.add_parser('serve',help='serve the HTTP/JSON API and the PWA')
+    server.add_argument('--host',default='127.0.0.1')
+    server.add_argument('--port',type=int,default=8000)
+    server.set_defaults(run=cmd_serve)
+    
+    snapshot=commands.add_parser('snapshot',help='rewrite db.json as JSON or as a compact snapshot; later saves keep that format')
+    snapshot.add_argument('format',choices=SNAPSHOT_FORMATS)
+    snapshot.set_defaults(run=cmd_snapshot)
+    
+    close=commands.add_parser('close-periods',help='archive the sheets of past months read-only (json and journal engines)')
+    close.add_argument('year',type=int,nargs='?',help='close through this month (default: all but the last --keep-months)')
+    close.add_argument('month',type=int,nargs='?',choices=range(1,13),metavar='month')
+    close.add_argument('--keep-months',type=int,default=12,help='months left open, this one included (default: %(default)s)')
+    close.set_defaults(run=cmd_close_periods)
+    
+    migrate=commands.add_parser('migrate-sqlite',help='copy db.json into db.sqlite next to it')
+    migrate.set_defaults(run=cmd_migrate_sqlite)
+    return parser
+
+def main(argv=None)->int:
+    parser=build_parser()
+    args=parser.parse_args(argv)
+    try:
+        return args.run(args)
+    except ValueError as e:
+        parser.exit(2,f'{parser.prog}: error: {e}\n')
@@ -0,0 +1,167 @@
+"""UI labels in every supported language"""
+
+# Language support
+LANGS = {
+    'ro': {
+        'app_title': 'Gestiune Depozit',
+        'products': 'Produse',
+        'sheets': 'Foi',
+        'pages': 'Pagini',
+        'records': 'Înregistrări',
+        'add_product': 'Adaugă Produs',
+        'product_name': 'Nume Produs',
+        'measure_unit': 'Unitate Măsură',
+        'search': 'Căutare',
+        'regex': 'Expresie regulată',
+        'delete': 'Șterge',
+        'add_sheet': 'Adaugă Foaie',
+        'year': 'An',
+        'month': 'Lună',
+        'add_page': 'Adaugă Pagină',
+        'unit_price': 'Preț Unitar',
+        'initial_stock': 'Stoc Inițial',
+        'add_record': 'Adaugă Înregistrare',
+        'day': 'Zi',
+        'doc_id': 'ID Document',
+        'doc_type': 'Tip Document',
+        'input': 'Intrare',
+        'output': 'Ieșire',
+        'final_stock': 'Stoc Final',
+        'comment': 'Comentariu',
+        'download_pdf': 'Descarcă PDF',
+        'generate_pdf': 'Generează PDF',
+        'ledger': 'Registru de stocuri',
+        'generate_ledger': 'Generează registrul complet',
+        'bulk_import': 'Import în bloc',
+        'import_kind': 'Ce se importă',
+        'import_file': 'Fișier CSV sau XLSX',
+        'run_import': 'Importă',
+        'imported_rows': 'rânduri importate',
+        'import_strict': 'Nu importa nimic dacă există erori',
+        'no_data': 'Nu există date',
+        'select_product': 'Selectează produs',
+        'select_sheet': 'Selectează foaie',
+        'select_page': 'Selectează pagină',
+        'confirm_delete': 'Confirmă ștergerea',
+        'cancel': 'Anulează',
+        'select': 'Selectează',
+        'delete_selected': 'Șterge selecția',
+        'table_page': 'Pagina tabelului',
+        'language': 'Limbă',
+        'recalculate_all': 'Recalculează stocurile',
+        'carry_forward': 'Reportează stocurile',
+        'carry_opening': 'Stoc inițial reportat din luna anterioară',
+        'balance': 'Sold',
+        'closing_balance': 'Stoc la sfârșitul lunii',
+        'analytics': 'Analize',
+        'report': 'Raport',
+        'valuation': 'Valoarea stocului',
+        'movements': 'Mișcări pe tip de document',
+        'turnover': 'Rotația stocului',
+        'value': 'Valoare',
+        'value_in': 'Valoare Intrări',
+        'value_out': 'Valoare Ieșiri',
+        'count': 'Număr',
+        'avg_stock': 'Stoc Mediu',
+        'period_from': 'De la',
+        'period_to': 'Până la',
+        'documents': 'Documente',
+        'find_document': 'Caută document',
+        'page': 'Pagină',
+        'position': 'Poziție',
+        'duplicate_doc_ids': 'ID-uri de document introduse de mai multe ori pe această pagină',
+        'diagnostics': 'Diagnostic',
+        'metrics_enabled': 'Colectează metrici',
+        'last_rerun': 'Ultima rulare',
+        'timers': 'Cronometre',
+        'profile_rerun': 'Profilează următoarea rulare',
+        'download_profile': 'Descarcă profilul',
+        'closed_period': 'Perioadă închisă: fișa este arhivată și nu mai poate fi modificată',
+        'close_periods': 'Închide perioade',
+        'closed_through': 'Închis până la',
+        'close_through': 'Închide până la',
+        'sheets_archived': 'fișe arhivate',
+        'months': ['','Ian','Feb','Mar','Apr','Mai','Iun','Iul','Aug','Sep','Oct','Nov','Dec']
+    },
+    'en': {
+        'app_title': 'Warehouse Management',
+        'products': 'Products',
+        'sheets': 'Sheets',
+        'pages': 'Pages',
+        'records': 'Records',
+        'add_product': 'Add Product',
+        'product_name': 'Product Name',
+        'measure_unit': 'Measure Unit',
+        'search': 'Search',
+        'regex': 'Regular expression',
+        'delete': 'Delete',
+        'add_sheet': 'Add Sheet',
+        'year': 'Year',
+        'month': 'Month',
+        'add_page': 'Add Page',
+        'unit_price': 'Unit Price',
+        'initial_stock': 'Initial Stock',
+        'add_record': 'Add Record',
+        'day': 'Day',
+        'doc_id': 'Document ID',
+        'doc_type': 'Document Type',
+        'input': 'Input',
+        'output': 'Output',
+        'final_stock': 'Final Stock',
+        'comment': 'Comment',
+        'download_pdf': 'Download PDF',
+        'generate_pdf': 'Generate PDF',
+        'ledger': 'Stock ledger',
+        'generate_ledger': 'Generate full ledger',
+        'bulk_import': 'Bulk import',
+        'import_kind': 'What to import',
+        'import_file': 'CSV or XLSX file',
+        'run_import': 'Import',
+        'imported_rows': 'rows imported',
+        'import_strict': 'Import nothing if there are errors',
+        'no_data': 'No data available',
+        'select_product': 'Select product',
+        'select_sheet': 'Select sheet',
+        'select_page': 'Select page',
+        'confirm_delete': 'Confirm delete',
+        'cancel': 'Cancel',
+        'select': 'Select',
+        'delete_selected': 'Delete selected',
+        'table_page': 'Table page',
+        'language': 'Language',
+        'recalculate_all': 'Recalculate stocks',
+        'carry_forward': 'Carry stocks forward',
+        'carry_opening': 'Carry initial stock from previous month',
+        'balance': 'Balance',
+        'closing_balance': 'Month-end stock',
+        'analytics': 'Analytics',
+        'report': 'Report',
+        'valuation': 'Stock valuation',
+        'movements': 'Movements by document type',
+        'turnover': 'Stock turnover',
+        'value': 'Value',
+        'value_in': 'Input Value',
+        'value_out': 'Output Value',
+        'count': 'Count',
+        'avg_stock': 'Average Stock',
+        'period_from': 'From',
+        'period_to': 'To',
+        'documents': 'Documents',
+        'find_document': 'Find document',
+        'page': 'Page',
+        'position': 'Position',
+        'duplicate_doc_ids': 'Document IDs entered more than once on this page',
+        'diagnostics': 'Diagnostics',
+        'metrics_enabled': 'Collect metrics',
+        'last_rerun': 'Last rerun',
+        'timers': 'Timers',
+        'profile_rerun': 'Profile next rerun',
+        'download_profile': 'Download profile',
+        'closed_period': 'Closed period: the sheet is archived and can no longer be changed',
+        'close_periods': 'Close periods',
+        'closed_through': 'Closed through',
+        'close_through': 'Close through',
+        'sheets_archived': 'sheets archived',
+        'months': ['','Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
+    }
+}
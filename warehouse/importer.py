@@ -0,0 +1,201 @@
+"""Bulk import of products, pages and records from CSV or XLSX files"""
+import csv
+from collections import OrderedDict
+from dataclasses import dataclass,field
+from io import TextIOWrapper
+from itertools import islice,chain
+from pathlib import Path
+from typing import List,Optional,Dict
+
+from .i18n import LANGS
+from .model import Record,Product
+
+# Columns of each kind of import file, in the order of a template. Headers
+# may also be the UI labels in any language.
+IMPORT_COLUMNS={
+    'products':('name','measure_unit'),
+    'pages':('product','year','month','unit_price','initial_stock'),
+    'records':('product','year','month','page','day','doc_id','doc_type','input','output','comment'),
+}
+IMPORT_OPTIONAL={'initial_stock','page','input','output','comment'}
+IMPORT_LABELS={'name':'product_name','product':'product_name'}
+IMPORT_CHUNK=1000
+
+@dataclass
+class ImportReport:
+    kind:str
+    rows:int=0
+    imported:int=0
+    errors:List[tuple]=field(default_factory=list)  # (row number in the file, message)
+
+def read_table_rows(source,file_name:str):
+    """Rows of a CSV or XLSX file as dicts keyed by header, read lazily.
+    `source` is a path or a binary file object."""
+    suffix=Path(file_name).suffix.lower()
+    if suffix=='.csv':
+        if isinstance(source,(str,Path)):
+            with open(source,'r',encoding='utf-8-sig',newline='') as f:
+                yield from csv.DictReader(f)
+        else:
+            yield from csv.DictReader(TextIOWrapper(source,encoding='utf-8-sig',newline=''))
+    elif suffix in ('.xlsx','.xlsm'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError('Reading .xlsx files needs openpyxl (pip install openpyxl)')
+        workbook=load_workbook(source,read_only=True,data_only=True)
+        try:
+            rows=workbook.active.iter_rows(values_only=True)
+            header=['' if h is None else str(h) for h in next(rows,())]
+            for row in rows:
+                if any(v is not None and v!='' for v in row):
+                    yield dict(zip(header,row))
+        finally:
+            workbook.close()
+    else:
+        raise ValueError(f'Unsupported file type: {suffix or file_name}')
+
+def _import_header(kind:str,header)->Dict[str,str]:
+    """Map each column of `kind` to the header naming it"""
+    aliases={}
+    for column in IMPORT_COLUMNS[kind]:
+        aliases[column.casefold()]=column
+        for L in LANGS.values():
+            label=L.get(IMPORT_LABELS.get(column,column))
+            if isinstance(label,str):
+                aliases.setdefault(label.casefold(),column)
+    mapping={}
+    for name in header:
+        column=aliases.get(str(name).strip().casefold())
+        if column is not None:
+            mapping.setdefault(column,name)
+    missing=[c for c in IMPORT_COLUMNS[kind] if c not in mapping and c not in IMPORT_OPTIONAL]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return mapping
+
+def _import_value(row:Dict,mapping:Dict,column:str,kind=str,default=None):
+    value=row.get(mapping.get(column))
+    if value is None or (isinstance(value,str) and not value.strip()):
+        if default is None and column not in IMPORT_OPTIONAL:
+            raise ValueError(f'{column} is empty')
+        return default
+    if kind is str:
+        return str(value).strip()
+    try:
+        number=float(str(value).strip().replace(',','.')) if isinstance(value,str) else float(value)
+    except ValueError:
+        raise ValueError(f'{column} is not a number: {value!r}')
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError(f'{column} is not a whole number: {value!r}')
+        return int(number)
+    return number
+
+def _import_product(manager,name:str)->Product:
+    products=manager.products_named(name)
+    if not products:
+        raise ValueError(f'unknown product {name!r}')
+    if len(products)>1:
+        raise ValueError(f'more than one product is named {name!r}')
+    return products[0]
+
+def _import_period(row:Dict,mapping:Dict)->tuple:
+    year=_import_value(row,mapping,'year',int)
+    month=_import_value(row,mapping,'month',int)
+    if not 1<=month<=12:
+        raise ValueError(f'month out of range: {month}')
+    return year,month
+
+def _import_open(manager,product:Product,year:int,month:int)->list:
+    """The product's sheets for a period that is not closed"""
+    closed=manager.closed_through()
+    if closed is not None and (year,month)<=closed:
+        raise ValueError(f'{year}-{month:02d} is in a closed period')
+    sheets=manager.sheets_for_period(product.id,year,month)
+    if any(sheet.archive is not None for sheet in sheets):
+        raise ValueError(f'{product.name} {year}-{month:02d} is archived')
+    return sheets
+
+def _validate_import_row(manager,kind:str,row:Dict,mapping:Dict,names:set):
+    """What one row adds, as (target, value); raises ValueError"""
+    if kind=='products':
+        name=_import_value(row,mapping,'name')
+        if manager.products_named(name) or name in names:
+            raise ValueError(f'product {name!r} already exists')
+        names.add(name)
+        return None,(name,_import_value(row,mapping,'measure_unit'))
+    product=_import_product(manager,_import_value(row,mapping,'product'))
+    year,month=_import_period(row,mapping)
+    sheets=_import_open(manager,product,year,month)
+    if kind=='pages':
+        price=_import_value(row,mapping,'unit_price',float)
+        return product.id,(year,month,price,_import_value(row,mapping,'initial_stock',float))
+    if not sheets:
+        raise ValueError(f'{product.name} has no sheet for {year}-{month:02d}')
+    number=_import_value(row,mapping,'page',int,1)
+    if not 1<=number<=len(sheets[0].pages):
+        raise ValueError(f'{product.name} {year}-{month:02d} has no page {number}')
+    day=_import_value(row,mapping,'day',int)
+    if not 1<=day<=31:
+        raise ValueError(f'day out of range: {day}')
+    record=Record(
+        day=day,
+        doc_id=_import_value(row,mapping,'doc_id'),
+        doc_type=_import_value(row,mapping,'doc_type'),
+        input=_import_value(row,mapping,'input',float,0.0),
+        output=_import_value(row,mapping,'output',float,0.0),
+        comment=_import_value(row,mapping,'comment',str,'')
+    )
+    return (product.id,sheets[0].id,sheets[0].pages[number-1].id),record
+
+def import_rows(manager,rows,kind:str,strict:bool=False,chunk_size:int=IMPORT_CHUNK)->ImportReport:
+    """Validate `rows` (dicts keyed by header) in chunks and add what they
+    describe in one batch: one commit, and one add_records per page.
+    
+    Products are matched by name and sheets by period; pages are given by
+    their number on the sheet (1 if omitted). Importing pages creates
+    missing sheets, and without an initial stock carries it over. Invalid
+    rows are reported and skipped, or with `strict` nothing is imported."""
+    if kind not in IMPORT_COLUMNS:
+        raise ValueError(f'Unknown import kind: {kind}')
+    report=ImportReport(kind)
+    rows=iter(rows)
+    first=next(rows,None)
+    if first is None:
+        return report
+    mapping=_import_header(kind,first.keys())
+    pending=OrderedDict()
+    names=set()
+    with manager.batch():
+        numbered=enumerate(chain((first,),rows),start=2)  # row 1 is the header
+        for chunk in iter(lambda:list(islice(numbered,chunk_size)),[]):
+            for line,row in chunk:
+                report.rows+=1
+                try:
+                    target,value=_validate_import_row(manager,kind,row,mapping,names)
+                except ValueError as e:
+                    report.errors.append((line,str(e)))
+                    continue
+                pending.setdefault(target,[]).append(value)
+        if strict and report.errors:
+            return report
+        for target,values in pending.items():
+            if kind=='products':
+                for name,unit in values:
+                    manager.add_product(name,unit)
+            elif kind=='pages':
+                for year,month,price,stock in values:
+                    sheets=manager.sheets_for_period(target,year,month)
+                    sheet_id=sheets[0].id if sheets else manager.add_sheet(target,year,month)
+                    manager.add_page(target,sheet_id,price,stock)
+            else:
+                manager.add_records(*target,values)
+            report.imported+=len(values)
+    return report
+
+def import_file(manager,source,kind:str,file_name:Optional[str]=None,strict:bool=False)->ImportReport:
+    """import_rows over a CSV/XLSX file given as a path or an uploaded file"""
+    if file_name is None:
+        file_name=str(getattr(source,'name',source))
+    return import_rows(manager,read_table_rows(source,file_name),kind,strict=strict)
@@ -0,0 +1,462 @@
+"""WarehouseManager: the database, its storage and caches, shared safely
+between threads and processes"""
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict,List,Optional
+try:
+    import fcntl
+except ImportError:
+    fcntl=None
+
+from .model import Record,Page,Sheet,Product,Database,Ref,_new_id,_db_index,_find_product
+from .ops import OPS,REF_ARGS,_refs_to_ids
+from .storage import BACKENDS
+from .metrics import METRICS
+from .search import DocumentIndex,ProductSearchIndex
+from .balances import BalanceEngine
+from .sync import ChangeLog
+
+class Observer:
+    def __init__(self):
+        self._observers=[]
+    def attach(self,observer):
+        self._observers.append(observer)
+    def notify(self):
+        for observer in self._observers:
+            observer()
+
+class RWLock:
+    """Any number of readers or one writer; a waiting writer holds off new
+    readers. The writing thread may take either side again, but a reader
+    must not ask to write."""
+    def __init__(self):
+        self._cond=threading.Condition()
+        self._readers=0
+        self._writer=None
+        self._writer_depth=0
+        self._writers_waiting=0
+    
+    @contextmanager
+    def read(self):
+        me=threading.get_ident()
+        with self._cond:
+            if self._writer!=me:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._readers+=1
+        try:
+            yield
+        finally:
+            if self._writer!=me:
+                with self._cond:
+                    self._readers-=1
+                    if not self._readers:
+                        self._cond.notify_all()
+    
+    @contextmanager
+    def write(self):
+        me=threading.get_ident()
+        with self._cond:
+            if self._writer!=me:
+                self._writers_waiting+=1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writers_waiting-=1
+                self._writer=me
+            self._writer_depth+=1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth-=1
+                if not self._writer_depth:
+                    self._writer=None
+                    self._cond.notify_all()
+
+class FileLock:
+    """Exclusive OS lock on a file shared by every process using the
+    database; reentrant within one holder, a no-op where fcntl is missing.
+    Callers serialize threads themselves (WarehouseManager holds its write
+    lock around it)."""
+    def __init__(self,path:Path):
+        self.path=path
+        self._file=None
+        self._depth=0
+    
+    def __enter__(self):
+        if not self._depth:
+            self._file=open(self.path,'a+')
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(),fcntl.LOCK_EX)
+        self._depth+=1
+        return self
+    
+    def __exit__(self,*exc):
+        self._depth-=1
+        if not self._depth:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(),fcntl.LOCK_UN)
+            self._file.close()
+            self._file=None
+
+class WarehouseManager:
+    """The database plus everything derived from it, safe to share between
+    threads (Streamlit sessions) and between processes on the same files.
+    
+    Mutations run under the write lock and the file lock, first reloading
+    if another process has written since; each write bumps db.version on
+    disk and `version` here, which sessions poll through `refresh()`, and
+    is logged in db.changes for offline clients (see `warehouse.sync`)."""
+    def __init__(self,db_path:str,storage:str='json',**options):
+        self.db_path=Path(db_path)
+        self.db_path.parent.mkdir(parents=True,exist_ok=True)
+        self.observer=Observer()
+        self.storage=BACKENDS[storage](self.db_path,**options)
+        self.balances=BalanceEngine(self)
+        self.search_index=ProductSearchIndex()
+        self.lock=RWLock()
+        self.file_lock=FileLock(self.db_path.with_suffix('.lock'))
+        self.version_path=self.db_path.with_suffix('.version')
+        self.version=0
+        self._disk_version=None
+        self.changes=ChangeLog(self.db_path.with_suffix('.changes'))
+        self.documents=DocumentIndex(self.db_path.with_suffix('.docs'))
+        self._changed=[]
+        # Tags the changes logged while set: (client, seq) during a sync
+        self.origin=None
+        self._batch_depth=0
+        self._batch_changed=False
+        self._batch_failed=False
+        self._last_stamp=0
+        self._stamps_floor=0
+        self._stamps={}
+        self.load_data()
+    
+    def load_data(self):
+        with self.lock.write(),self.file_lock,METRICS.timer('load_data',storage=type(self.storage).__name__):
+            self.balances.clear()
+            self.search_index.clear()
+            self._touch_all()
+            self._disk_version=self._read_disk_version()
+            self.changes.start(int(self._disk_version or 0))
+            db=self.storage.load()
+            self.version+=1
+            if db is not None:
+                self.db=db
+                self.documents.load(int(self._disk_version or 0),self.changes)
+            else:
+                self.db=Database(columnar=self.storage.columnar)
+                self.documents.clear()
+                self.save_data()
+    
+    def save_data(self):
+        with self.lock.write(),self.file_lock,METRICS.timer('save_data',storage=type(self.storage).__name__):
+            self.storage.save(self.db)
+            self._publish()
+        self.observer.notify()
+    
+    def close(self):
+        with self.lock.read():
+            self.documents.save(self.db)
+        self.storage.close()
+    
+    def refresh(self)->int:
+        """Reload if another process has written since; returns `version`"""
+        if self._read_disk_version()!=self._disk_version:
+            with self.lock.write(),self.file_lock:
+                if self._read_disk_version()!=self._disk_version:
+                    self.load_data()
+        return self.version
+    
+    def _read_disk_version(self)->Optional[str]:
+        try:
+            return self.version_path.read_text()
+        except FileNotFoundError:
+            return None
+    
+    def _publish(self):
+        # Called with the file lock held; the changes are logged first, so a
+        # published version is never missing from the log
+        version=str(int(self._read_disk_version() or 0)+1)
+        if self._changed:
+            self.changes.append(int(version),self._changed)
+            self._changed=[]
+        tmp=self.version_path.with_suffix('.version.tmp')
+        tmp.write_text(version)
+        os.replace(tmp,self.version_path)
+        self._disk_version=version
+        self.documents.published(int(version))
+        self.version+=1
+    
+    @contextmanager
+    def batch(self):
+        """Group commit: mutations inside the block are applied as usual but
+        written together when it ends, e.g. for a bulk import. If the block
+        raises, nothing it did is written and the data is reloaded as it
+        was before the (outermost) batch."""
+        with self.lock.write(),self.file_lock:
+            if self._read_disk_version()!=self._disk_version:
+                self.load_data()
+            self._batch_depth+=1
+            try:
+                yield self
+            except BaseException:
+                self._batch_failed=True
+                raise
+            finally:
+                self._batch_depth-=1
+                changed=self._batch_changed and not self._batch_depth
+                if changed:
+                    self._batch_changed=False
+                    if self._batch_failed:
+                        self._batch_failed=changed=False
+                        self._changed=[]
+                        self.storage.discard()
+                        self.load_data()
+                    else:
+                        with METRICS.timer('flush'):
+                            self.storage.flush(self.db)
+                            self._publish()
+                elif not self._batch_depth:
+                    self._batch_failed=False
+        if changed:
+            self.observer.notify()
+    
+    def _mutate(self,op:str,*args)->bool:
+        """Apply an operation of `OPS`; False if it did not apply"""
+        with self.lock.write(),self.file_lock:
+            if self._read_disk_version()!=self._disk_version and not self._batch_depth:
+                self.load_data()
+            # Positional refs become ids here, so backends, journals and caches
+            # never see an index that a concurrent delete could have shifted
+            args=_refs_to_ids(self.db,op,args)
+            if args is None:
+                return False
+            self._check_open(op,args)
+            if op=='add_page' and len(args)>5 and args[5]:
+                # Read from the data as it is on disk, now that it is locked
+                args=args[:3]+(self.balances.carried_opening(args[0],args[1],args[2]),)+args[4:]
+            period=self._carried_from(op,args)
+            self.balances.invalidate(op,args)
+            self.search_index.invalidate(op,args,self.db)
+            self.documents.invalidate(op,args,self.db)
+            if not OPS[op](self.db,*args):
+                return False
+            ops=[(op,args)]
+            self._applied(op,args,self.origin)
+            # Later openings carried from the period just changed follow it,
+            # as an operation of their own so every engine and client sees it
+            if period is not None and OPS['carry_openings'](self.db,args[0],*period):
+                ops.append(('carry_openings',(args[0],)+period))
+                self.balances.invalidate(*ops[-1])
+                self._applied(*ops[-1],None)
+            if self._batch_depth:
+                self._batch_changed=True
+                return True
+            with METRICS.timer('commit',op=op):
+                if len(ops)==1:
+                    self.storage.commit(self.db,op,args)
+                else:
+                    self.storage.commit_many(self.db,ops)
+                self._publish()
+        self.observer.notify()
+        return True
+    
+    def _applied(self,op:str,args:tuple,origin):
+        self._touch(op,args)
+        self._changed.append((op,args,origin))
+        METRICS.count('op.'+op)
+        if self._batch_depth:
+            self.storage.stage(self.db,op,args)
+    
+    def _carried_from(self,op:str,args:tuple)->Optional[tuple]:
+        """The period `op` changes, whose closing stocks later carried
+        openings depend on; None for operations on no single period"""
+        if op=='add_sheet':
+            return (args[1],args[2])
+        if REF_ARGS.get(op,0)>=2:
+            sheet=self.get_sheet(args[1])
+            if sheet is not None:
+                return (sheet.year,sheet.month)
+        return None
+    
+    def _check_open(self,op:str,args:tuple):
+        """Refuse changes to closed periods (see `close_periods`)"""
+        if op=='add_sheet':
+            closed=self.closed_through()
+            if closed is not None and (args[1],args[2])<=closed:
+                raise ValueError(f'{args[1]}-{args[2]:02d} is in a closed period')
+        elif REF_ARGS.get(op,0)>=2 and op!='carry_forward':
+            sheet=self.get_sheet(args[1])
+            if sheet is not None and sheet.archive is not None:
+                raise ValueError(f'sheet {sheet.year}-{sheet.month:02d} is in a closed period')
+    
+    def closed_through(self)->Optional[tuple]:
+        """(year, month) the periods are closed through, or None"""
+        archive=getattr(self.storage,'archive',None)
+        return archive.closed if archive is not None else None
+    
+    def close_periods(self,year:int,month:int)->int:
+        """Close every period up to and including `year`-`month`: their
+        sheets move to the archive (see `warehouse.archive`) and can no
+        longer be changed, nor sheets added to them. Returns how many
+        sheets were archived."""
+        archive=getattr(self.storage,'archive',None)
+        if archive is None:
+            raise ValueError(f'the {type(self.storage).__name__} storage cannot archive closed periods')
+        with self.lock.write(),self.file_lock:
+            if self._read_disk_version()!=self._disk_version:
+                self.load_data()
+            with METRICS.timer('close_periods'):
+                archived=archive.freeze(self.db,(year,month))
+                if archived:
+                    self._touch_all()
+                    self.balances.clear()
+                    self.storage.save(self.db)
+                    self._publish()
+                    archive.prune(self.db)
+        if archived:
+            self.observer.notify()
+        return archived
+    
+    def stamp(self,product_id:Optional[str]=None)->int:
+        """A number that changes whenever the product (its sheets, pages
+        and records) changes, or without an id the list of products; a
+        cheap key for views derived from them"""
+        return self._stamps.get(product_id,self._stamps_floor)
+    
+    def _touch_all(self):
+        self._last_stamp+=1
+        self._stamps.clear()
+        self._stamps_floor=self._last_stamp
+    
+    def _touch(self,op:str,args:tuple):
+        if op=='recalculate_all':
+            self._touch_all()
+            return
+        self._last_stamp+=1
+        if op=='add_product':
+            self._stamps[args[-1]]=self._last_stamp
+        else:
+            self._stamps[args[0]]=self._last_stamp
+        if op in ('add_product','delete_product'):
+            self._stamps[None]=self._last_stamp
+    
+    # Products, sheets and pages are given by id or by position (Ref)
+    def add_product(self,name:str,measure_unit:str)->str:
+        """Returns the new product's id (likewise add_sheet and add_page)"""
+        product_id=_new_id()
+        self._mutate('add_product',name,measure_unit,product_id)
+        return product_id
+    
+    def delete_product(self,product_ref:Ref):
+        self._mutate('delete_product',product_ref)
+    
+    def add_sheet(self,product_ref:Ref,year:int,month:int)->Optional[str]:
+        sheet_id=_new_id()
+        self._mutate('add_sheet',product_ref,year,month,sheet_id)
+        return sheet_id if self.get_sheet(sheet_id) else None
+    
+    def delete_sheet(self,product_ref:Ref,sheet_ref:Ref):
+        self._mutate('delete_sheet',product_ref,sheet_ref)
+    
+    def add_page(self,product_ref:Ref,sheet_ref:Ref,unit_price:float,initial_stock:Optional[float]=None)->Optional[str]:
+        """Without an initial stock the page carries over the previous
+        period's closing stock for the same unit price, and follows it
+        when that period changes later"""
+        page_id=_new_id()
+        if self._mutate('add_page',product_ref,sheet_ref,unit_price,initial_stock,page_id,initial_stock is None):
+            return page_id
+        return None
+    
+    def delete_page(self,product_ref:Ref,sheet_ref:Ref,page_ref:Ref):
+        self._mutate('delete_page',product_ref,sheet_ref,page_ref)
+    
+    def add_record(self,product_ref:Ref,sheet_ref:Ref,page_ref:Ref,record:Record):
+        self._mutate('add_record',product_ref,sheet_ref,page_ref,record)
+    
+    def add_records(self,product_ref:Ref,sheet_ref:Ref,page_ref:Ref,records:List[Record]):
+        """Append many records to a page as one operation"""
+        self._mutate('add_records',product_ref,sheet_ref,page_ref,list(records))
+    
+    def insert_record(self,product_ref:Ref,sheet_ref:Ref,page_ref:Ref,record_idx:int,record:Record):
+        self._mutate('insert_record',product_ref,sheet_ref,page_ref,record_idx,record)
+    
+    def update_record(self,product_ref:Ref,sheet_ref:Ref,page_ref:Ref,record_idx:int,**changes):
+        self._mutate('update_record',product_ref,sheet_ref,page_ref,record_idx,changes)
+    
+    def delete_record(self,product_ref:Ref,sheet_ref:Ref,page_ref:Ref,record_idx:int):
+        self._mutate('delete_record',product_ref,sheet_ref,page_ref,record_idx)
+    
+    def recalculate_stocks(self,product_ref:Ref,sheet_ref:Ref,page_ref:Ref,start:int=0):
+        """Rebuild a page's stock chain from record `start` onward"""
+        self._mutate('recalculate_stocks',product_ref,sheet_ref,page_ref,start)
+    
+    def carry_forward(self,product_ref:Ref,sheet_ref:Ref):
+        """Re-derive opening stocks from the sheet's period onward"""
+        self._mutate('carry_forward',product_ref,sheet_ref)
+    
+    def closing_balance(self,product_ref:Ref,year:int,month:int)->float:
+        with self.lock.read():
+            return self.balances.closing_balance(product_ref,year,month)
+    
+    def opening_balance(self,product_ref:Ref,year:int,month:int)->float:
+        with self.lock.read():
+            return self.balances.opening_balance(product_ref,year,month)
+    
+    def recalculate_all(self):
+        """Maintenance: rebuild the stock chain of every page"""
+        self._mutate('recalculate_all')
+    
+    def get_product(self,product_id:str)->Optional[Product]:
+        return _db_index(self.db).products.get(product_id)
+    
+    def get_sheet(self,sheet_id:str)->Optional[Sheet]:
+        found=_db_index(self.db).sheets.get(sheet_id)
+        return found[1] if found else None
+    
+    def get_page(self,page_id:str)->Optional[Page]:
+        found=_db_index(self.db).pages.get(page_id)
+        return found[2] if found else None
+    
+    def products_named(self,name:str)->List[Product]:
+        return list(_db_index(self.db).by_name.get(name,[]))
+    
+    def sheets_for_period(self,product_ref:Ref,year:int,month:int)->List[Sheet]:
+        product=_find_product(self.db,product_ref)
+        if product is None:
+            return []
+        return list(_db_index(self.db).by_period.get((product.id,year,month),[]))
+    
+    def find_documents(self,doc_id:Optional[str]=None,doc_type:Optional[str]=None,
+                       limit:Optional[int]=None)->List[tuple]:
+        """Records by document: [(product, sheet, page, index, record)] with
+        this doc_id and/or doc_type, through the document index"""
+        with self.lock.read():
+            return self.documents.find(self.db,doc_id,doc_type,limit)
+    
+    def duplicate_documents(self,page_id:str)->Dict[str,List[int]]:
+        """Doc ids entered more than once on a page, with the record indexes"""
+        with self.lock.read():
+            return self.documents.duplicates(self.db,page_id)
+    
+    def search_products(self,pattern:str,regex:bool=False)->List[tuple]:
+        """Products matching `pattern` as [(index, product)].
+        
+        By default a ranked, diacritic-insensitive substring search through
+        the name index; with `regex` the pattern is a regular expression
+        (an invalid one matches nothing)."""
+        if not regex:
+            # The index locks its own state; readers only keep writers out
+            with self.lock.read():
+                self.search_index.sync(self.db.products)
+                return self.search_index.search(pattern)
+        try:
+            compiled=re.compile(pattern,re.IGNORECASE)
+        except re.error:
+            return []
+        with self.lock.read():
+            return [(i,product) for i,product in enumerate(self.db.products) if compiled.search(product.name)]
@@ -0,0 +1,179 @@
+"""Opt-in timers, counters and gauges around the hot paths.
+
+Off unless WAREHOUSE_METRICS=1 or `METRICS.enable()`; while off, a timed
+call costs one attribute check. With WAREHOUSE_METRICS_LOG naming a file,
+every timing is also appended to it as a JSON line. `prometheus_text()`
+renders the totals in the Prometheus text format."""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import TYPE_CHECKING,Dict,List,Optional
+
+from .model import record_count
+
+if TYPE_CHECKING:
+    from .manager import WarehouseManager
+
+class Metrics:
+    """Timers (calls, total and max seconds), counters and gauges by name,
+    shared by every thread"""
+    def __init__(self):
+        self.enabled=False
+        self.log_path=None
+        self._lock=threading.Lock()
+        self._local=threading.local()
+        self._log=None
+        self.reset()
+    
+    def enable(self,log_path:Optional[str]=None):
+        with self._lock:
+            if log_path and log_path!=self.log_path:
+                if self._log is not None:
+                    self._log.close()
+                self._log=open(log_path,'a',encoding='utf-8',buffering=1)
+                self.log_path=log_path
+            self.enabled=True
+    
+    def disable(self):
+        self.enabled=False
+    
+    def reset(self):
+        with self._lock:
+            self._timers={}     # name -> [calls, total seconds, max seconds]
+            self._counters={}
+            self._gauges={}
+    
+    @contextmanager
+    def timer(self,name:str,**fields):
+        """Time the block under `name`; `fields` only go to the log"""
+        if not self.enabled:
+            yield
+            return
+        trace=getattr(self._local,'trace',None)
+        if trace is not None:
+            entry=[name,0.0,self._local.depth]
+            trace.append(entry)
+            self._local.depth+=1
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed=time.perf_counter()-start
+            if trace is not None:
+                entry[1]=elapsed
+                self._local.depth-=1
+            self._record(name,elapsed,fields)
+    
+    def timed(self,name:str):
+        """Decorator form of `timer`"""
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args,**kwargs):
+                if not self.enabled:
+                    return function(*args,**kwargs)
+                with self.timer(name):
+                    return function(*args,**kwargs)
+            return wrapper
+        return decorate
+    
+    def _record(self,name:str,elapsed:float,fields:Dict):
+        with self._lock:
+            timer=self._timers.get(name)
+            if timer is None:
+                timer=self._timers[name]=[0,0.0,0.0]
+            timer[0]+=1
+            timer[1]+=elapsed
+            timer[2]=max(timer[2],elapsed)
+            if self._log is not None:
+                self._log.write(json.dumps({'ts':round(time.time(),6),'timer':name,'seconds':round(elapsed,6),**fields},
+                                           ensure_ascii=False,default=str)+'\n')
+    
+    def count(self,name:str,n:int=1):
+        if self.enabled:
+            with self._lock:
+                self._counters[name]=self._counters.get(name,0)+n
+    
+    def gauge(self,name:str,value:float):
+        if self.enabled:
+            with self._lock:
+                self._gauges[name]=value
+    
+    @contextmanager
+    def trace(self):
+        """Collect the timings made by this thread inside the block, as
+        [name, seconds, depth] in the order they started (a rerun's
+        breakdown); nested traces are not supported"""
+        steps=[]
+        self._local.trace,self._local.depth=steps,0
+        try:
+            yield steps
+        finally:
+            self._local.trace=None
+    
+    def snapshot(self)->Dict:
+        with self._lock:
+            return {'timers':{name:{'calls':t[0],'seconds':t[1],'max_seconds':t[2]} for name,t in self._timers.items()},
+                    'counters':dict(self._counters),'gauges':dict(self._gauges)}
+    
+    def prometheus_text(self)->str:
+        data=self.snapshot()
+        lines=['# TYPE warehouse_duration_seconds summary']
+        for name,t in sorted(data['timers'].items()):
+            label=_label(name)
+            lines.append(f'warehouse_duration_seconds_sum{{name="{label}"}} {t["seconds"]:.6f}')
+            lines.append(f'warehouse_duration_seconds_count{{name="{label}"}} {t["calls"]}')
+        lines.append('# TYPE warehouse_duration_seconds_max gauge')
+        for name,t in sorted(data['timers'].items()):
+            lines.append(f'warehouse_duration_seconds_max{{name="{_label(name)}"}} {t["max_seconds"]:.6f}')
+        lines.append('# TYPE warehouse_events_total counter')
+        for name,value in sorted(data['counters'].items()):
+            lines.append(f'warehouse_events_total{{name="{_label(name)}"}} {value}')
+        for name,value in sorted(data['gauges'].items()):
+            metric='warehouse_'+re.sub(r'\W','_',name)
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines)+'\n'
+
+def _label(name:str)->str:
+    return name.replace('\\','\\\\').replace('"','\\"')
+
+METRICS=Metrics()
+if os.environ.get('WAREHOUSE_METRICS')=='1':
+    METRICS.enable(os.environ.get('WAREHOUSE_METRICS_LOG'))
+
+def update_gauges(manager:'WarehouseManager'):
+    """Size of the database on disk and how much it holds"""
+    if not METRICS.enabled:
+        return
+    path=manager.db_path
+    files=[f for f in path.parent.glob(path.stem+'*') if f.is_file()]
+    shards=path.with_suffix('')
+    if shards.is_dir():
+        files+=[f for f in shards.rglob('*') if f.is_file()]
+    with manager.lock.read():
+        products=manager.db.products
+        sheets=[sheet for product in products for sheet in product.sheets]
+        pages=[page for sheet in sheets for page in sheet.pages]
+        records=sum(record_count(page) for page in pages)
+    for name,value in (('db_bytes',sum(f.stat().st_size for f in files)),('products',len(products)),
+                       ('sheets',len(sheets)),('pages',len(pages)),('records',records),('db_version',manager.version)):
+        METRICS.gauge(name,value)
+
+def profile(run)->tuple:
+    """Run `run()` under cProfile: (its result, the 40 costliest calls as text)"""
+    import cProfile
+    import io
+    import pstats
+    profiler=cProfile.Profile()
+    result=profiler.runcall(run)
+    out=io.StringIO()
+    pstats.Stats(profiler,stream=out).sort_stats('cumulative').print_stats(40)
+    return result,out.getvalue()
+
+def timings_table(steps:List[list])->List[Dict]:
+    """A trace as rows, names indented by depth"""
+    return [{'step':'  '*depth+name,'ms':round(seconds*1000,2)} for name,seconds,depth in steps]
@@ -0,0 +1,471 @@
+"""Records, pages, sheets, products and the lookups over them.
+
+NumPy and pandas are only imported by the few methods that need them."""
+import threading
+import uuid
+from array import array
+from dataclasses import dataclass,field,asdict
+from typing import TYPE_CHECKING,List,Optional,Dict,Union
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+@dataclass
+class Record:
+    day:int
+    doc_id:str
+    doc_type:str
+    input:float=0.0
+    output:float=0.0
+    comment:str=""
+    initial_stock:float=0.0
+    final_stock:float=0.0
+
+# doc_type values are few and repeat on every record; columnar pages store
+# an index into this process-wide table instead of the string
+_DOC_TYPES:List[str]=[]
+_DOC_TYPE_CODES:Dict[str,int]={}
+_DOC_TYPES_LOCK=threading.Lock()
+
+def _intern_doc_type(doc_type:str)->int:
+    code=_DOC_TYPE_CODES.get(doc_type)
+    if code is None:
+        with _DOC_TYPES_LOCK:
+            code=_DOC_TYPE_CODES.get(doc_type)
+            if code is None:
+                code=len(_DOC_TYPES)
+                _DOC_TYPES.append(doc_type)
+                _DOC_TYPE_CODES[doc_type]=code
+    return code
+
+def _column(name:str):
+    def get(self):
+        return getattr(self._columns,name)[self._index]
+    def set(self,value):
+        getattr(self._columns,name)[self._index]=value
+    return property(get,set)
+
+class RecordView:
+    """A Record-like handle on one row of a RecordColumns.
+    
+    Reads and writes go straight to the columns. The index is positional, so
+    a view should not be kept across inserts or deletes on its page."""
+    __slots__=('_columns','_index')
+    
+    def __init__(self,columns:'RecordColumns',index:int):
+        self._columns=columns
+        self._index=index
+    
+    day=_column('day')
+    doc_id=_column('doc_id')
+    input=_column('input')
+    output=_column('output')
+    comment=_column('comment')
+    initial_stock=_column('initial_stock')
+    final_stock=_column('final_stock')
+    
+    @property
+    def doc_type(self)->str:
+        return _DOC_TYPES[self._columns.doc_type_codes[self._index]]
+    
+    @doc_type.setter
+    def doc_type(self,value:str):
+        self._columns.doc_type_codes[self._index]=_intern_doc_type(value)
+    
+    def to_record(self)->Record:
+        return Record(self.day,self.doc_id,self.doc_type,self.input,self.output,
+                      self.comment,self.initial_stock,self.final_stock)
+    
+    def __repr__(self):
+        return repr(self.to_record())
+
+class RecordColumns:
+    """Page records kept as one typed array per field instead of one Record
+    object per row. Supports the list operations the manager uses on
+    `Page.records` (len, indexing, slicing, iteration, append, insert, del);
+    rows come back as RecordView."""
+    FIELDS=('day','doc_id','doc_type','input','output','comment','initial_stock','final_stock')
+    
+    def __init__(self,records=()):
+        self.day=array('i')
+        self.doc_id=[]
+        self.doc_type_codes=array('I')
+        self.input=array('d')
+        self.output=array('d')
+        self.comment=[]
+        self.initial_stock=array('d')
+        self.final_stock=array('d')
+        self.extend(records)
+    
+    @classmethod
+    def from_rows(cls,rows)->'RecordColumns':
+        """Build from tuples in FIELDS order"""
+        columns=cls()
+        for row in rows:
+            columns._append_row(*row)
+        return columns
+    
+    @classmethod
+    def from_dicts(cls,dicts)->'RecordColumns':
+        defaults={'input':0.0,'output':0.0,'comment':'','initial_stock':0.0,'final_stock':0.0}
+        return cls.from_rows(
+            tuple(r[name] if name not in defaults else r.get(name,defaults[name]) for name in cls.FIELDS)
+            for r in dicts
+        )
+    
+    @classmethod
+    def from_arrays(cls,day:array,doc_id:List[str],doc_type_codes:array,input:array,output:array,
+                    comment:List[str],initial_stock:array,final_stock:array)->'RecordColumns':
+        """Take over ready-made columns, doc types as codes from _intern_doc_type"""
+        columns=cls()
+        columns.day,columns.doc_id,columns.doc_type_codes=day,doc_id,doc_type_codes
+        columns.input,columns.output,columns.comment=input,output,comment
+        columns.initial_stock,columns.final_stock=initial_stock,final_stock
+        return columns
+    
+    def _arrays(self)->tuple:
+        return (self.day,self.doc_type_codes,self.input,self.output,self.initial_stock,self.final_stock)
+    
+    def _detach(self):
+        # A DataFrame from to_frame() still shares the old buffers, which
+        # cannot be resized while exported; give this page its own copies
+        for name in ('day','doc_type_codes','input','output','initial_stock','final_stock'):
+            setattr(self,name,array(getattr(self,name).typecode,getattr(self,name)))
+    
+    def _resize(self,action):
+        try:
+            action()
+        except BufferError:
+            self._detach()
+            action()
+    
+    def _append_row(self,day,doc_id,doc_type,input,output,comment,initial_stock,final_stock):
+        def action():
+            # Arrays first, so a BufferError leaves the lists untouched
+            self.day.append(day)
+            self.doc_type_codes.append(_intern_doc_type(doc_type))
+            self.input.append(input)
+            self.output.append(output)
+            self.initial_stock.append(initial_stock)
+            self.final_stock.append(final_stock)
+        try:
+            action()
+        except BufferError:
+            for column in self._arrays():
+                if len(column)>len(self.doc_id):
+                    del column[-1]
+            self._detach()
+            action()
+        self.doc_id.append(doc_id)
+        self.comment.append(comment)
+    
+    def _normalize(self,index:int)->int:
+        if index<0:
+            index+=len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('record index out of range')
+        return index
+    
+    def __len__(self)->int:
+        return len(self.doc_id)
+    
+    def __bool__(self)->bool:
+        return bool(self.doc_id)
+    
+    def __getitem__(self,index):
+        if isinstance(index,slice):
+            return [RecordView(self,i) for i in range(*index.indices(len(self)))]
+        return RecordView(self,self._normalize(index))
+    
+    def __setitem__(self,index:int,record):
+        view=RecordView(self,self._normalize(index))
+        for name in self.FIELDS:
+            setattr(view,name,getattr(record,name))
+    
+    def __delitem__(self,index):
+        if isinstance(index,slice):
+            targets=slice(*index.indices(len(self)))
+        else:
+            targets=self._normalize(index)
+        def action():
+            for column in self._arrays():
+                del column[targets]
+        self._resize(action)
+        del self.doc_id[targets]
+        del self.comment[targets]
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield RecordView(self,i)
+    
+    def append(self,record):
+        self._append_row(*(getattr(record,name) for name in self.FIELDS))
+    
+    def extend(self,records):
+        for record in records:
+            self.append(record)
+    
+    def insert(self,index:int,record):
+        index=max(0,min(index if index>=0 else index+len(self),len(self)))
+        def action():
+            self.day.insert(index,record.day)
+            self.doc_type_codes.insert(index,_intern_doc_type(record.doc_type))
+            self.input.insert(index,record.input)
+            self.output.insert(index,record.output)
+            self.initial_stock.insert(index,record.initial_stock)
+            self.final_stock.insert(index,record.final_stock)
+        try:
+            action()
+        except BufferError:
+            for column in self._arrays():
+                if len(column)>len(self.doc_id):
+                    del column[index]
+            self._detach()
+            action()
+        self.doc_id.insert(index,record.doc_id)
+        self.comment.insert(index,record.comment)
+    
+    def recalculate(self,start:int,opening:float):
+        """Stock chain from row `start` onward as one cumulative sum, in place"""
+        import numpy as np
+        chain=np.empty(len(self)-start+1)
+        chain[0]=opening
+        np.subtract(np.frombuffer(self.input)[start:],np.frombuffer(self.output)[start:],out=chain[1:])
+        np.cumsum(chain,out=chain)
+        np.frombuffer(self.initial_stock)[start:]=chain[:-1]
+        np.frombuffer(self.final_stock)[start:]=chain[1:]
+    
+    def to_dicts(self)->List[Dict]:
+        return [
+            {'day':day,'doc_id':doc_id,'doc_type':_DOC_TYPES[code],'input':input,'output':output,
+             'comment':comment,'initial_stock':initial,'final_stock':final}
+            for day,doc_id,code,input,output,comment,initial,final in zip(
+                self.day,self.doc_id,self.doc_type_codes,self.input,self.output,
+                self.comment,self.initial_stock,self.final_stock)
+        ]
+    
+    def to_frame(self,labels:Dict[str,str])->'pd.DataFrame':
+        """DataFrame over the columns, labelled via `labels` (field -> header).
+        
+        Numeric columns share memory with this page until it is next resized;
+        doc_type becomes a Categorical over the interned codes."""
+        import numpy as np
+        import pandas as pd
+        columns={
+            'day':np.frombuffer(self.day,dtype=np.int32) if self.day.itemsize==4 else np.array(self.day),
+            'doc_id':self.doc_id,
+            'doc_type':pd.Categorical.from_codes(np.frombuffer(self.doc_type_codes,dtype=np.uint32).astype(np.int64,copy=False),
+                                                 categories=list(_DOC_TYPES)),
+            'initial_stock':np.frombuffer(self.initial_stock,dtype=np.float64),
+            'input':np.frombuffer(self.input,dtype=np.float64),
+            'output':np.frombuffer(self.output,dtype=np.float64),
+            'final_stock':np.frombuffer(self.final_stock,dtype=np.float64),
+            'comment':self.comment,
+        }
+        return pd.DataFrame({labels[name]:column for name,column in columns.items()},copy=False)
+
+def _record_dicts(records)->List[Dict]:
+    if isinstance(records,RecordColumns):
+        return records.to_dicts()
+    return [asdict(r) for r in records]
+
+def _new_id()->str:
+    return uuid.uuid4().hex
+
+# A product, sheet or page given by its id or by its position in the parent
+Ref=Union[int,str]
+
+@dataclass
+class Page:
+    unit_price:float
+    initial_stock:float
+    records:List[Record]=field(default_factory=list)
+    id:str=field(default_factory=_new_id)
+    # The opening stock is the previous period's closing for this price,
+    # kept up to date as that period changes (see ops._op_carry_openings)
+    carried:bool=False
+
+class LazyPage(Page):
+    """A Page whose records are fetched by `loader` on first access"""
+    def __init__(self,unit_price:float,initial_stock:float,loader,record_count:Optional[int]=None,id:Optional[str]=None,
+                 carried:bool=False):
+        self.unit_price=unit_price
+        self.initial_stock=initial_stock
+        self.id=id or _new_id()
+        self.carried=carried
+        self._loader=loader
+        self._records=None
+        self._record_count=record_count
+    
+    @property
+    def records(self)->List[Record]:
+        if self._records is None:
+            self._records=self._loader()
+            self._loader=None
+        return self._records
+    
+    @records.setter
+    def records(self,value:List[Record]):
+        self._records=value
+        self._loader=None
+    
+    @property
+    def loaded(self)->bool:
+        return self._records is not None
+
+def record_count(page:Page)->int:
+    """Number of records on a page, without loading a lazy page if it can be avoided"""
+    if isinstance(page,LazyPage) and not page.loaded and page._record_count is not None:
+        return page._record_count
+    return len(page.records)
+
+def page_records(page:Page):
+    """Records of a page, without keeping a lazy page's records loaded"""
+    if isinstance(page,LazyPage) and not page.loaded:
+        return page._loader()
+    return page.records
+
+class ArchivedPage(LazyPage):
+    """A page of an archived sheet, read-only. Its records are fetched again
+    on every access (the archive caches a bounded number of pages), so they
+    never stay loaded; its closing stock is kept in the archive index."""
+    def __init__(self,unit_price:float,initial_stock:float,loader,record_count:int,closing:float,id:str):
+        super().__init__(unit_price,initial_stock,loader,record_count,id)
+        self.closing=closing
+    
+    @property
+    def records(self)->List[Record]:
+        return self._loader()
+    
+    @records.setter
+    def records(self,value:List[Record]):
+        raise AttributeError('archived pages are read-only')
+    
+    @property
+    def loaded(self)->bool:
+        return False
+
+@dataclass
+class Sheet:
+    year:int
+    month:int
+    pages:List[Page]=field(default_factory=list)
+    id:str=field(default_factory=_new_id)
+    # The archive part holding the sheet once its period is closed; the
+    # sheet is read-only from then on (see warehouse.archive)
+    archive:Optional[str]=None
+
+@dataclass
+class Product:
+    name:str
+    measure_unit:str
+    sheets:List[Sheet]=field(default_factory=list)
+    id:str=field(default_factory=_new_id)
+
+@dataclass
+class Database:
+    products:List[Product]=field(default_factory=list)
+    # Runtime setting, not stored: new pages get RecordColumns instead of a list
+    columnar:bool=field(default=False,compare=False,repr=False)
+    # Built on first use by _db_index and kept current by the operations
+    index:Optional['DatabaseIndex']=field(default=None,init=False,compare=False,repr=False)
+
+def _new_records(db:Database):
+    return RecordColumns() if db.columnar else []
+
+class DatabaseIndex:
+    """Hash maps over a Database: products, sheets and pages by id (with
+    their parents), products by name and sheets by (product id, year, month)"""
+    def __init__(self,db:Database):
+        self.products={}
+        self.sheets={}
+        self.pages={}
+        self.by_name={}
+        self.by_period={}
+        for product in db.products:
+            self.add_product(product)
+    
+    def add_product(self,product:Product):
+        self.products[product.id]=product
+        self.by_name.setdefault(product.name,[]).append(product)
+        for sheet in product.sheets:
+            self.add_sheet(product,sheet)
+    
+    def remove_product(self,product:Product):
+        del self.products[product.id]
+        _discard(self.by_name,product.name,product)
+        for sheet in product.sheets:
+            self.remove_sheet(product,sheet)
+    
+    def add_sheet(self,product:Product,sheet:Sheet):
+        self.sheets[sheet.id]=(product,sheet)
+        self.by_period.setdefault((product.id,sheet.year,sheet.month),[]).append(sheet)
+        for page in sheet.pages:
+            self.add_page(product,sheet,page)
+    
+    def remove_sheet(self,product:Product,sheet:Sheet):
+        del self.sheets[sheet.id]
+        _discard(self.by_period,(product.id,sheet.year,sheet.month),sheet)
+        for page in sheet.pages:
+            self.remove_page(page)
+    
+    def add_page(self,product:Product,sheet:Sheet,page:Page):
+        self.pages[page.id]=(product,sheet,page)
+    
+    def remove_page(self,page:Page):
+        del self.pages[page.id]
+
+def _discard(groups:Dict,key,item):
+    items=groups.get(key,[])
+    _remove_item(items,item)
+    if not items:
+        groups.pop(key,None)
+
+def _remove_item(items:list,item):
+    # By identity: dataclass equality would match look-alike entries
+    for i,candidate in enumerate(items):
+        if candidate is item:
+            del items[i]
+            return
+
+def _db_index(db:Database)->DatabaseIndex:
+    if db.index is None:
+        db.index=DatabaseIndex(db)
+    return db.index
+
+# Products, sheets and pages are addressed by a ref: their id, or their
+# position within the parent (older callers and journals)
+def _find_product(db:Database,product_ref)->Optional[Product]:
+    if isinstance(product_ref,str):
+        return _db_index(db).products.get(product_ref)
+    if isinstance(product_ref,int) and 0 <= product_ref < len(db.products):
+        return db.products[product_ref]
+    return None
+
+def _find_sheet(db:Database,product_ref,sheet_ref)->Optional[tuple]:
+    """(product, sheet) or None; with a sheet id the product ref may be None"""
+    if isinstance(sheet_ref,str):
+        found=_db_index(db).sheets.get(sheet_ref)
+        if found is None or (product_ref is not None and _find_product(db,product_ref) is not found[0]):
+            return None
+        return found
+    product=_find_product(db,product_ref)
+    if product is None or not isinstance(sheet_ref,int) or not 0 <= sheet_ref < len(product.sheets):
+        return None
+    return product,product.sheets[sheet_ref]
+
+def _find_page(db:Database,product_ref,sheet_ref,page_ref)->Optional[tuple]:
+    """(product, sheet, page) or None; with a page id the other refs may be None"""
+    if isinstance(page_ref,str):
+        found=_db_index(db).pages.get(page_ref)
+        if found is None:
+            return None
+        if sheet_ref is not None:
+            parents=_find_sheet(db,product_ref,sheet_ref)
+            if parents is None or parents[1] is not found[1]:
+                return None
+        return found
+    found=_find_sheet(db,product_ref,sheet_ref)
+    if found is None or not isinstance(page_ref,int) or not 0 <= page_ref < len(found[1].pages):
+        return None
+    return found+(found[1].pages[page_ref],)
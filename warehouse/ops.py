@@ -0,0 +1,327 @@
+"""Mutations by name, shared by the live manager and by journal replay"""
+from itertools import accumulate
+from typing import List,Optional,Dict
+
+from .model import (Record,RecordColumns,Page,ArchivedPage,Sheet,Product,Database,_new_id,_new_records,
+                    _db_index,_remove_item,_find_product,_find_sheet,_find_page)
+
+# How many leading arguments of each operation are product/sheet/page refs
+REF_ARGS={
+    'delete_product':1,
+    'add_sheet':1,
+    'delete_sheet':2,
+    'add_page':2,
+    'delete_page':3,
+    'add_record':3,
+    'add_records':3,
+    'insert_record':3,
+    'update_record':3,
+    'delete_record':3,
+    'recalculate_stocks':3,
+    'carry_forward':2,
+    'carry_openings':1,
+}
+
+def _refs_to_ids(db:Database,op:str,args:tuple)->Optional[tuple]:
+    """`args` with positional refs replaced by ids, or None if a ref is invalid"""
+    n=REF_ARGS.get(op,0)
+    if n==0:
+        return args
+    finder=(_find_product,_find_sheet,_find_page)[n-1]
+    found=finder(db,*args[:n])
+    if found is None:
+        return None
+    entities=found if n>1 else (found,)
+    return tuple(entity.id for entity in entities)+tuple(args[n:])
+
+# New entities get their id from the caller, so replaying an operation
+# recreates the same ids that later operations refer to
+def _op_add_product(db:Database,name:str,measure_unit:str,product_id:Optional[str]=None)->bool:
+    product=Product(name,measure_unit,id=product_id or _new_id())
+    index=_db_index(db)  # built before the append, or it would list the product twice
+    db.products.append(product)
+    index.add_product(product)
+    return True
+
+def _op_delete_product(db:Database,product_ref)->bool:
+    product=_find_product(db,product_ref)
+    if product is None:
+        return False
+    _remove_item(db.products,product)
+    _db_index(db).remove_product(product)
+    return True
+
+def _op_add_sheet(db:Database,product_ref,year:int,month:int,sheet_id:Optional[str]=None)->bool:
+    product=_find_product(db,product_ref)
+    if product is None:
+        return False
+    sheet=Sheet(year,month,id=sheet_id or _new_id())
+    product.sheets.append(sheet)
+    _db_index(db).add_sheet(product,sheet)
+    return True
+
+def _op_delete_sheet(db:Database,product_ref,sheet_ref)->bool:
+    found=_find_sheet(db,product_ref,sheet_ref)
+    if found is None:
+        return False
+    product,sheet=found
+    _remove_item(product.sheets,sheet)
+    _db_index(db).remove_sheet(product,sheet)
+    return True
+
+def _op_add_page(db:Database,product_ref,sheet_ref,unit_price:float,initial_stock:float,page_id:Optional[str]=None,
+                 carried:bool=False)->bool:
+    found=_find_sheet(db,product_ref,sheet_ref)
+    if found is None:
+        return False
+    product,sheet=found
+    page=Page(unit_price,initial_stock,_new_records(db),page_id or _new_id(),carried)
+    sheet.pages.append(page)
+    _db_index(db).add_page(product,sheet,page)
+    return True
+
+def _op_delete_page(db:Database,product_ref,sheet_ref,page_ref)->bool:
+    found=_find_page(db,product_ref,sheet_ref,page_ref)
+    if found is None:
+        return False
+    _,sheet,page=found
+    _remove_item(sheet.pages,page)
+    _db_index(db).remove_page(page)
+    return True
+
+def _op_add_record(db:Database,product_ref,sheet_ref,page_ref,record)->bool:
+    found=_find_page(db,product_ref,sheet_ref,page_ref)
+    if found is None:
+        return False
+    page=found[2]
+    if isinstance(record,dict):
+        record=Record(**record)
+    if page.records:
+        record.initial_stock=page.records[-1].final_stock
+    else:
+        record.initial_stock=page.initial_stock
+    record.final_stock=record.initial_stock+(record.input-record.output)
+    page.records.append(record)
+    return True
+
+def _op_add_records(db:Database,product_ref,sheet_ref,page_ref,records:list)->bool:
+    found=_find_page(db,product_ref,sheet_ref,page_ref)
+    if found is None or not records:
+        return False
+    page=found[2]
+    records=[Record(**r) if isinstance(r,dict) else r for r in records]
+    opening=page.records[-1].final_stock if page.records else page.initial_stock
+    # One cumulative sum for the whole batch, adding in the same order as
+    # add_record so the stocks come out identical
+    import numpy as np
+    deltas=np.fromiter((r.input-r.output for r in records),dtype=float,count=len(records))
+    stocks=np.cumsum(np.concatenate(([opening],deltas))).tolist()
+    for r,initial,final in zip(records,stocks,stocks[1:]):
+        r.initial_stock=initial
+        r.final_stock=final
+    page.records.extend(records)
+    return True
+
+def _op_insert_record(db:Database,product_ref,sheet_ref,page_ref,record_idx:int,record)->bool:
+    found=_find_page(db,product_ref,sheet_ref,page_ref)
+    if found is None or not 0 <= record_idx <= len(found[2].records):
+        return False
+    page=found[2]
+    if isinstance(record,dict):
+        record=Record(**record)
+    page.records.insert(record_idx,record)
+    _recalculate_page(page,record_idx)
+    return True
+
+# Fields of a record that can be edited; the stocks are always derived
+EDITABLE_RECORD_FIELDS=('day','doc_id','doc_type','input','output','comment')
+
+# Checks for values arriving as JSON (the HTTP API and sync)
+def _json_number(data:dict,name:str,kind=float,default=None):
+    value=data.get(name,default)
+    if value is None:
+        raise ValueError(f'{name} is required')
+    if isinstance(value,bool) or not isinstance(value,(int,float)):
+        raise ValueError(f'{name} is not a number: {value!r}')
+    if kind is int:
+        if value!=int(value):
+            raise ValueError(f'{name} is not a whole number: {value!r}')
+        return int(value)
+    return float(value)
+
+def _json_text(data:dict,name:str,default=None)->str:
+    value=data.get(name,default)
+    if not isinstance(value,str) or (default is None and not value.strip()):
+        raise ValueError(f'{name} is required')
+    return value.strip()
+
+def _record_changes(data)->dict:
+    """Validated record fields from a JSON object (only those present)"""
+    if not isinstance(data,dict):
+        raise ValueError('a record must be a JSON object')
+    unknown=set(data)-set(EDITABLE_RECORD_FIELDS)
+    if unknown:
+        raise ValueError(f"not editable: {', '.join(sorted(unknown))}")
+    changes={}
+    for name in data:
+        if name in ('input','output'):
+            changes[name]=_json_number(data,name)
+        elif name=='day':
+            changes[name]=_json_number(data,name,int)
+            if not 1<=changes[name]<=31:
+                raise ValueError(f'day out of range: {changes[name]}')
+        else:
+            changes[name]=_json_text(data,name,'' if name=='comment' else None)
+    return changes
+
+def _record_from_json(data)->Record:
+    """A new record; stocks the client computed are dropped and derived again"""
+    if isinstance(data,dict):
+        data={k:v for k,v in data.items() if k not in ('initial_stock','final_stock')}
+    changes=_record_changes(data)
+    missing=[name for name in ('day','doc_id','doc_type') if name not in changes]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    return Record(**changes)
+
+def _op_update_record(db:Database,product_ref,sheet_ref,page_ref,record_idx:int,changes:Dict)->bool:
+    found=_find_page(db,product_ref,sheet_ref,page_ref)
+    if (found is None or not 0 <= record_idx < len(found[2].records) or
+        not set(changes)<=set(EDITABLE_RECORD_FIELDS)):
+        return False
+    page=found[2]
+    record=page.records[record_idx]
+    for name,value in changes.items():
+        setattr(record,name,value)
+    if 'input' in changes or 'output' in changes:
+        _recalculate_page(page,record_idx)
+    return True
+
+def _op_delete_record(db:Database,product_ref,sheet_ref,page_ref,record_idx:int)->bool:
+    found=_find_page(db,product_ref,sheet_ref,page_ref)
+    if found is None or not 0 <= record_idx < len(found[2].records):
+        return False
+    page=found[2]
+    del page.records[record_idx]
+    _recalculate_page(page,record_idx)
+    return True
+
+def _op_recalculate_stocks(db:Database,product_ref,sheet_ref,page_ref,start:int=0)->bool:
+    found=_find_page(db,product_ref,sheet_ref,page_ref)
+    if found is None:
+        return False
+    _recalculate_page(found[2],start)
+    return True
+
+def _op_recalculate_all(db:Database)->bool:
+    for product in db.products:
+        for sheet in product.sheets:
+            if sheet.archive is not None:
+                continue  # archived sheets are frozen as they were closed
+            for page in sheet.pages:
+                _recalculate_page(page)
+    return True
+
+def _page_closing(page:Page)->float:
+    if isinstance(page,ArchivedPage):
+        return page.closing
+    return page.records[-1].final_stock if page.records else page.initial_stock
+
+def _periods(product:Product)->List[tuple]:
+    """[((year,month),[sheets...]), ...] in chronological order"""
+    periods={}
+    for sheet in product.sheets:
+        periods.setdefault((sheet.year,sheet.month),[]).append(sheet)
+    return sorted(periods.items())
+
+def _lot_closings(sheets:List[Sheet])->Dict[float,float]:
+    """Closing stock per unit price (pages are price lots) over `sheets`"""
+    closings={}
+    for sheet in sheets:
+        for page in sheet.pages:
+            closings[page.unit_price]=closings.get(page.unit_price,0.0)+_page_closing(page)
+    return closings
+
+def _op_carry_forward(db:Database,product_ref,sheet_ref)->bool:
+    """Set the opening stock of every page from the closing stock of the
+    same price lot in the previous period, for the sheet's period and all
+    later ones. Pages whose price has no lot in the previous period keep
+    the opening stock they were given."""
+    found=_find_sheet(db,product_ref,sheet_ref)
+    if found is None:
+        return False
+    product,start=found
+    previous=None
+    for period,sheets in _periods(product):
+        if period>=(start.year,start.month) and previous is not None:
+            lots=_lot_closings(previous)
+            for sheet in sheets:
+                if sheet.archive is not None:
+                    continue
+                for page in sheet.pages:
+                    opening=lots.get(page.unit_price)
+                    if opening is not None and opening!=page.initial_stock:
+                        page.initial_stock=opening
+                        _recalculate_page(page)
+        previous=sheets
+    return True
+
+def _op_carry_openings(db:Database,product_ref,year:int,month:int)->bool:
+    """Set the opening stock of every carried page (see Page.carried) in
+    the periods after `year`-`month` from the closing stock of its price
+    lot in the period before; False if none changed. Pages whose price has
+    no lot there open at 0, as when they were added."""
+    product=_find_product(db,product_ref)
+    if product is None:
+        return False
+    changed=False
+    previous=None
+    for period,sheets in _periods(product):
+        if period>(year,month):
+            carried=[page for sheet in sheets if sheet.archive is None for page in sheet.pages if page.carried]
+            lots=_lot_closings(previous) if carried and previous is not None else {}
+            for page in carried:
+                opening=lots.get(page.unit_price,0.0)
+                if opening!=page.initial_stock:
+                    page.initial_stock=opening
+                    _recalculate_page(page)
+                    changed=True
+        previous=sheets
+    return changed
+
+def _recalculate_page(page:Page,start:int=0):
+    """Rebuild the initial/final stock chain from record `start` onward.
+    
+    Records before `start` are left alone, so an edit near the end of a
+    page only costs the records after it."""
+    records=page.records
+    if start>=len(records):
+        return
+    opening=page.initial_stock if start==0 else records[start-1].final_stock
+    if isinstance(records,RecordColumns):
+        records.recalculate(start,opening)
+        return
+    stocks=accumulate((r.input-r.output for r in records[start:]),initial=opening)
+    previous=next(stocks)
+    for record,stock in zip(records[start:],stocks):
+        record.initial_stock=previous
+        record.final_stock=previous=stock
+
+# Mutations by name; shared by the live manager and by journal replay
+OPS={
+    'add_product':_op_add_product,
+    'delete_product':_op_delete_product,
+    'add_sheet':_op_add_sheet,
+    'delete_sheet':_op_delete_sheet,
+    'add_page':_op_add_page,
+    'delete_page':_op_delete_page,
+    'add_record':_op_add_record,
+    'add_records':_op_add_records,
+    'insert_record':_op_insert_record,
+    'update_record':_op_update_record,
+    'delete_record':_op_delete_record,
+    'recalculate_stocks':_op_recalculate_stocks,
+    'recalculate_all':_op_recalculate_all,
+    'carry_forward':_op_carry_forward,
+    'carry_openings':_op_carry_openings,
+}
@@ -0,0 +1,262 @@
+"""PDF reports. Imports pandas and ReportLab, so only load it to export."""
+import hashlib
+import json
+import threading
+from collections import OrderedDict,deque
+from functools import lru_cache
+from io import BytesIO
+from itertools import accumulate,islice
+from typing import List,Optional
+from xml.sax.saxutils import escape as xml_escape
+
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate,Table,TableStyle,Paragraph,Spacer,Flowable
+from reportlab.lib.styles import getSampleStyleSheet,ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from .i18n import LANGS
+from .metrics import METRICS
+from .model import RecordColumns,Database,Ref,page_records,_find_product
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    # Registering parses the whole TTF, so do it once per process
+    try:
+        pdfmetrics.registerFont(TTFont('DejaVu','DejaVuSans.ttf'))
+        return 'DejaVu'
+    except:
+        return 'Helvetica'
+
+def _pdf_table_style(font_name:str)->TableStyle:
+    return TableStyle([
+        ('BACKGROUND',(0,0),(-1,0),colors.grey),
+        ('TEXTCOLOR',(0,0),(-1,0),colors.whitesmoke),
+        ('ALIGN',(0,0),(-1,-1),'CENTER'),
+        ('FONTNAME',(0,0),(-1,0),font_name),
+        ('FONTSIZE',(0,0),(-1,0),10),
+        ('BOTTOMPADDING',(0,0),(-1,0),12),
+        ('BACKGROUND',(0,1),(-1,-1),colors.beige),
+        ('GRID',(0,0),(-1,-1),1,colors.black),
+        ('FONTNAME',(0,1),(-1,-1),font_name),
+        ('FONTSIZE',(0,1),(-1,-1),8),
+    ])
+
+def _pdf_title_style(font_name:str,size:int=16)->ParagraphStyle:
+    return ParagraphStyle(
+        f'CustomTitle{size}',
+        parent=getSampleStyleSheet()['Heading1'],
+        fontSize=size,
+        leading=size*1.2,
+        alignment=1,
+        spaceAfter=0.3*inch if size>=16 else 0.1*inch,
+        fontName=font_name
+    )
+
+class TableStream(Flowable):
+    """A table whose rows are pulled from an iterator one page at a time.
+    
+    Every time the frame asks it to split, it takes as many rows as fit
+    the space left and returns them as a Table with the header repeated,
+    followed by itself for the rest. Only one page of rows is ever held,
+    so memory does not grow with the row count."""
+    SAMPLE_ROWS=50
+    
+    def __init__(self,header:list,rows,font_name:str,col_widths:Optional[List[float]]=None):
+        super().__init__()
+        self.header=[str(h) for h in header]
+        self.rows=iter(rows)
+        self.style=_pdf_table_style(font_name)
+        self.col_widths=col_widths
+        self._pending=deque()
+        self._header_height=self._row_height=None
+    
+    def _fill(self,n:int)->int:
+        while len(self._pending)<n:
+            row=next(self.rows,None)
+            if row is None:
+                break
+            self._pending.append(['' if v is None else v for v in row])
+        return len(self._pending)
+    
+    def _widths(self,avail_width:float)->List[float]:
+        if self.col_widths is None:
+            # Proportional to the longest text in the header and the first rows
+            self._fill(self.SAMPLE_ROWS)
+            lengths=[len(h) for h in self.header]
+            for row in islice(self._pending,self.SAMPLE_ROWS):
+                lengths=[max(n,len(str(v))) for n,v in zip(lengths,row)]
+            lengths=[min(max(n,4),40) for n in lengths]
+            self.col_widths=[avail_width*n/sum(lengths) for n in lengths]
+        return self.col_widths
+    
+    def _table(self,rows:list)->Table:
+        return Table([self.header]+rows,colWidths=self.col_widths,repeatRows=1,style=self.style)
+    
+    def wrap(self,avail_width,avail_height):
+        if not self._fill(1):
+            return avail_width,0
+        # Always ask to be split, so rows are laid out page by page
+        return avail_width,avail_height+1
+    
+    def split(self,avail_width,avail_height):
+        if not self._fill(1):
+            return []
+        self._widths(avail_width)
+        if self._row_height is None:
+            probe=self._table([['']*len(self.header)])
+            probe.wrap(avail_width,avail_height)
+            self._header_height,self._row_height=probe._rowHeights[0],probe._rowHeights[1]
+        fit=int((avail_height-self._header_height)//self._row_height)
+        n=min(self._fill(fit),fit)
+        if n<=0:
+            return []
+        # The document refuses a flowable it already had to postpone once,
+        # but this one legitimately moves on to a new page every time
+        self.__dict__.pop('_postponed',None)
+        rows=[self._pending.popleft() for _ in range(n)]
+        table=self._table(rows)
+        if table.wrap(avail_width,avail_height)[1]>avail_height:
+            # Rows with line breaks are taller; give back what does not fit
+            keep=max(sum(1 for h in accumulate(table._rowHeights) if h<=avail_height)-1,1)
+            self._pending.extendleft(reversed(rows[keep:]))
+            rows=rows[:keep]
+            table=self._table(rows)
+        return [table,self] if self._fill(1) else [table]
+    
+    def draw(self):
+        pass
+
+class FlowableStream(list):
+    """The flowable list handed to doc.build, filled from a generator as
+    the build consumes it, so a long document is never materialized"""
+    def __init__(self,flowables):
+        super().__init__()
+        self._source=iter(flowables)
+    
+    def _refill(self):
+        while list.__len__(self)<2:
+            f=next(self._source,None)
+            if f is None:
+                break
+            self.append(f)
+    
+    def __len__(self)->int:
+        self._refill()
+        return list.__len__(self)
+    
+    def __getitem__(self,index):
+        self._refill()
+        return list.__getitem__(self,index)
+
+def _build_pdf(flowables)->bytes:
+    buffer=BytesIO()
+    doc=SimpleDocTemplate(buffer,pagesize=A4,topMargin=0.5*inch,bottomMargin=0.5*inch)
+    doc.build(FlowableStream(flowables))
+    return buffer.getvalue()
+
+@METRICS.timed('generate_pdf')
+def generate_pdf(data:pd.DataFrame,title:str,lang:str)->bytes:
+    font_name=get_pdf_font()
+    def flowables():
+        yield Paragraph(xml_escape(title),_pdf_title_style(font_name))
+        yield Spacer(1,0.2*inch)
+        if not data.empty:
+            yield TableStream(list(data.columns),data.itertuples(index=False,name=None),font_name)
+    return _build_pdf(flowables())
+
+LEDGER_FIELDS=('day','doc_id','doc_type','initial_stock','input','output','final_stock','comment')
+
+@METRICS.timed('generate_ledger_pdf')
+def generate_ledger_pdf(db:Database,lang:str,product_ref:Optional[Ref]=None)->bytes:
+    """Every sheet and page of one product, or of the whole warehouse, in one document"""
+    L=LANGS[lang]
+    font_name=get_pdf_font()
+    if product_ref is None:
+        products=db.products
+    else:
+        product=_find_product(db,product_ref)
+        products=[product] if product is not None else []
+    header=[L[name] for name in LEDGER_FIELDS]
+    def flowables():
+        yield Paragraph(xml_escape(L['ledger']),_pdf_title_style(font_name))
+        for product in products:
+            yield Paragraph(xml_escape(f"{product.name} ({product.measure_unit})"),_pdf_title_style(font_name,14))
+            for sheet in product.sheets:
+                yield Paragraph(xml_escape(f"{sheet.year}-{L['months'][sheet.month]}"),_pdf_title_style(font_name,12))
+                for i,page in enumerate(sheet.pages):
+                    yield Paragraph(xml_escape(f"Page {i+1} - {L['unit_price']}: {page.unit_price}, "
+                                               f"{L['initial_stock']}: {page.initial_stock}"),_pdf_title_style(font_name,10))
+                    rows=((getattr(r,name) for name in LEDGER_FIELDS) for r in page_records(page))
+                    yield TableStream(header,(tuple(row) for row in rows),font_name)
+                    yield Spacer(1,0.1*inch)
+    return _build_pdf(flowables())
+
+def pdf_key(data:pd.DataFrame,title:str,lang:str)->str:
+    """Hash of everything a generated PDF depends on"""
+    h=hashlib.sha256()
+    h.update(json.dumps([title,lang,[str(c) for c in data.columns]],ensure_ascii=False).encode('utf-8'))
+    if not data.empty:
+        h.update(pd.util.hash_pandas_object(data,index=False).values.tobytes())
+    return h.hexdigest()
+
+class PdfCache:
+    """Generated PDFs by content hash, least recently used evicted first
+    once either limit is exceeded"""
+    def __init__(self,max_entries:int=32,max_bytes:int=64*1024*1024):
+        self.max_entries=max_entries
+        self.max_bytes=max_bytes
+        self._entries=OrderedDict()
+        self._size=0
+        self._lock=threading.Lock()
+    
+    def peek(self,key:str)->Optional[bytes]:
+        """The PDF for a `pdf_key`, if it is still cached"""
+        with self._lock:
+            pdf=self._entries.get(key)
+            if pdf is not None:
+                self._entries.move_to_end(key)
+            return pdf
+    
+    def get(self,data:pd.DataFrame,title:str,lang:str)->bytes:
+        key=pdf_key(data,title,lang)
+        pdf=self.peek(key)
+        if pdf is not None:
+            METRICS.count('pdf_cache.hit')
+            return pdf
+        METRICS.count('pdf_cache.miss')
+        pdf=generate_pdf(data,title,lang)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key]=pdf
+                self._size+=len(pdf)
+            while len(self._entries)>self.max_entries or (self._size>self.max_bytes and len(self._entries)>1):
+                _,old=self._entries.popitem(last=False)
+                self._size-=len(old)
+        return pdf
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size=0
+
+PDF_CACHE=PdfCache()
+
+def records_frame(records,L)->pd.DataFrame:
+    if isinstance(records,RecordColumns):
+        return records.to_frame({name:L[name] for name in RecordColumns.FIELDS})
+    return pd.DataFrame([
+        {
+            L['day']:r.day,
+            L['doc_id']:r.doc_id,
+            L['doc_type']:r.doc_type,
+            L['initial_stock']:r.initial_stock,
+            L['input']:r.input,
+            L['output']:r.output,
+            L['final_stock']:r.final_stock,
+            L['comment']:r.comment
+        } for r in records
+    ])
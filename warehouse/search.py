@@ -0,0 +1,343 @@
+"""Product name search and the document index"""
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING,Dict,List,Optional
+
+from .model import _DOC_TYPES,Product,Database,RecordColumns,_db_index,_find_product,page_records
+from .storage import _write_atomic
+
+if TYPE_CHECKING:
+    from .sync import ChangeLog
+
+def normalize_name(text:str)->str:
+    """Case- and diacritic-insensitive form of a name (ceapă -> ceapa)"""
+    decomposed=unicodedata.normalize('NFKD',text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+class ProductSearchIndex:
+    """n-gram index over normalized product names.
+    
+    Entries are keyed by product id rather than position so deleting a
+    product does not renumber the index; positions are resolved when results
+    are returned. Recent queries are kept in a small LRU cache. The index
+    has its own lock, so searches only need the database's read lock."""
+    GRAM=3
+    
+    def __init__(self,cache_size:int=128):
+        self.cache_size=cache_size
+        self._lock=threading.RLock()
+        self.clear()
+    
+    def clear(self):
+        with self._lock:
+            self._entries={}
+            self._grams={}
+            self._indexed=[]
+            self._positions=None
+            self._cache=OrderedDict()
+    
+    def _grams_of(self,name:str)->set:
+        grams=set()
+        for n in range(1,self.GRAM+1):
+            grams.update(name[i:i+n] for i in range(len(name)-n+1))
+        return grams
+    
+    def add(self,product:Product):
+        name=normalize_name(product.name)
+        with self._lock:
+            self._entries[product.id]=(product,name)
+            for gram in self._grams_of(name):
+                self._grams.setdefault(gram,set()).add(product.id)
+            if self._positions is not None:
+                self._positions[product.id]=len(self._indexed)
+            self._indexed.append(product)
+            self._cache.clear()
+    
+    def remove(self,product:Product):
+        with self._lock:
+            entry=self._entries.pop(product.id,None)
+            if entry is None:
+                return
+            for gram in self._grams_of(entry[1]):
+                postings=self._grams.get(gram)
+                postings.discard(product.id)
+                if not postings:
+                    del self._grams[gram]
+            self._indexed=[p for p in self._indexed if p is not product]
+            self._positions=None
+            self._cache.clear()
+    
+    def sync(self,products:List[Product]):
+        """Index products appended since the last call"""
+        with self._lock:
+            for product in products[len(self._indexed):]:
+                self.add(product)
+    
+    def invalidate(self,op:str,args:tuple,db:Database):
+        """Called before `op` is applied"""
+        if op=='delete_product':
+            product=_find_product(db,args[0])
+            if product is not None:
+                with self._lock:
+                    self.sync(db.products)
+                    self.remove(product)
+    
+    def search(self,query:str,limit:Optional[int]=None)->List[tuple]:
+        """Ranked [(index, product)]: exact name, then prefix, then word
+        prefix, then any substring; shorter names first within a rank"""
+        query=normalize_name(query.strip())
+        if not query:
+            return []
+        with self._lock:
+            ids=self._cache.get(query)
+            if ids is None:
+                ids=self._lookup(query)
+                self._cache[query]=ids
+                if len(self._cache)>self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(query)
+            if self._positions is None:
+                self._positions={p.id:i for i,p in enumerate(self._indexed)}
+            hits=[(self._positions[key],self._entries[key][0]) for key in ids]
+        return hits[:limit] if limit is not None else hits
+    
+    def _lookup(self,query:str)->List[str]:
+        if len(query)<=self.GRAM:
+            candidates=self._grams.get(query,set())
+        else:
+            postings=[self._grams.get(query[i:i+self.GRAM],set()) for i in range(len(query)-self.GRAM+1)]
+            candidates=set.intersection(*sorted(postings,key=len))
+        ranked=[]
+        for key in candidates:
+            name=self._entries[key][1]
+            if query not in name:
+                continue
+            if name==query:
+                rank=0
+            elif name.startswith(query):
+                rank=1
+            elif any(word.startswith(query) for word in re.split(r'\W+',name)):
+                rank=2
+            else:
+                rank=3
+            ranked.append((rank,len(name),name,key))
+        ranked.sort()
+        return [key for *_,key in ranked]
+
+def normalize_doc(text:str)->str:
+    """The form doc ids and types are matched in (' nir 12 ' -> 'NIR 12')"""
+    return ' '.join(normalize_name(text).split()).upper()
+
+def _doc_columns(records)->tuple:
+    if isinstance(records,RecordColumns):
+        return records.doc_id,[_DOC_TYPES[code] for code in records.doc_type_codes]
+    return [r.doc_id for r in records],[r.doc_type for r in records]
+
+def _postings(values)->Dict[str,List[int]]:
+    postings={}
+    for i,value in enumerate(values):
+        postings.setdefault(normalize_doc(value),[]).append(i)
+    return postings
+
+class DocumentIndex:
+    """Record positions by doc_id and by doc_type, kept per page.
+    
+    Appends are indexed as they happen; other record edits only mark their
+    page, which is indexed again at the next lookup. The index is saved in
+    db.docs with the db.version it matches; at the first lookup it is read
+    back and brought up to date from db.changes, so neither a restart nor a
+    write by another process indexes every page again."""
+    def __init__(self,path:Path):
+        self.path=path
+        self.version=0
+        self._changes=None
+        self._lock=threading.Lock()
+        self.clear()
+    
+    def clear(self):
+        """Forget the index; it is loaded again at the next lookup"""
+        self._pages={}   # page id -> [product id, sheet id, doc postings, type postings]
+        self._docs={}    # doc -> set of page ids
+        self._types={}   # type -> set of page ids
+        self._dirty=set()
+        self._loaded=False
+        self._pending=[]
+    
+    def load(self,version:int,changes:'ChangeLog'):
+        """Called once the database at `version` is loaded"""
+        with self._lock:
+            self._changes=changes
+            if self._loaded:
+                entries=changes.since(self.version) if self.version<=version else None
+                if entries is None:
+                    self.clear()
+                for entry in entries or ():
+                    self._replay(entry['op'],entry['args'])
+            self.published(version)
+    
+    def published(self,version:int):
+        """The changes so far are in db.changes, under `version`"""
+        self.version=version
+        if not self._loaded:
+            self._pending=[]
+    
+    def invalidate(self,op:str,args:tuple,db:Database):
+        """Called before `op` is applied, with ids for refs"""
+        with self._lock:
+            if not self._loaded:
+                self._pending.append((op,args))
+            elif op in ('add_record','add_records'):
+                entry=self._pages.get(args[2])
+                found=_db_index(db).pages.get(args[2])
+                if entry is None or args[2] in self._dirty or found is None:
+                    self._dirty.add(args[2])
+                    return
+                records=[args[3]] if op=='add_record' else args[3]
+                start=len(found[2].records)
+                for record in records:
+                    doc_id,doc_type=(record['doc_id'],record['doc_type']) if isinstance(record,dict) else (record.doc_id,record.doc_type)
+                    for postings,index,key in ((entry[2],self._docs,normalize_doc(doc_id)),(entry[3],self._types,normalize_doc(doc_type))):
+                        postings.setdefault(key,[]).append(start)
+                        index.setdefault(key,set()).add(args[2])
+                    start+=1
+            else:
+                self._replay(op,args)
+    
+    def _replay(self,op:str,args):
+        if op in ('insert_record','delete_record'):
+            self._dirty.add(args[2])
+        elif op=='update_record':
+            if {'doc_id','doc_type'}&set(args[4]):
+                self._dirty.add(args[2])
+        elif op in ('add_record','add_records'):
+            self._dirty.add(args[2])
+        elif op=='delete_page':
+            self._drop(args[2])
+        elif op=='delete_sheet':
+            for page_id in [k for k,e in self._pages.items() if e[1]==args[1]]:
+                self._drop(page_id)
+        elif op=='delete_product':
+            for page_id in [k for k,e in self._pages.items() if e[0]==args[0]]:
+                self._drop(page_id)
+    
+    def _drop(self,page_id:str):
+        self._dirty.discard(page_id)
+        entry=self._pages.pop(page_id,None)
+        if entry is None:
+            return
+        for postings,index in ((entry[2],self._docs),(entry[3],self._types)):
+            for key in postings:
+                pages=index[key]
+                pages.discard(page_id)
+                if not pages:
+                    del index[key]
+    
+    def _index_page(self,product,sheet,page):
+        self._drop(page.id)
+        doc_ids,doc_types=_doc_columns(page_records(page))
+        entry=[product.id,sheet.id,_postings(doc_ids),_postings(doc_types)]
+        self._pages[page.id]=entry
+        for postings,index in ((entry[2],self._docs),(entry[3],self._types)):
+            for key in postings:
+                index.setdefault(key,set()).add(page.id)
+    
+    def _update(self,db:Database):
+        # Called with _lock held
+        if not self._loaded:
+            saved=self._read()
+            entries=None
+            if saved==self.version:
+                entries=[]
+            elif saved is not None and saved<self.version and self._changes is not None:
+                entries=self._changes.since(saved)
+            if entries is None:
+                self._pages,self._docs,self._types,self._dirty={},{},{},set()
+                for product in db.products:
+                    for sheet in product.sheets:
+                        for page in sheet.pages:
+                            self._index_page(product,sheet,page)
+            else:
+                # Changes this process has not published yet come last
+                for op,args in [(e['op'],e['args']) for e in entries]+self._pending:
+                    self._replay(op,args)
+            self._loaded=True
+            self._pending=[]
+            if entries is None:
+                self._write()
+        pages=_db_index(db).pages
+        dirty,self._dirty=self._dirty,set()
+        for page_id in dirty:
+            found=pages.get(page_id)
+            if found is None:
+                self._drop(page_id)
+            else:
+                self._index_page(*found)
+    
+    def find(self,db:Database,doc_id:Optional[str]=None,doc_type:Optional[str]=None,
+             limit:Optional[int]=None)->List[tuple]:
+        """[(product, sheet, page, index, record)] of the records with this
+        doc_id and/or doc_type, matched case- and diacritic-insensitively"""
+        doc=normalize_doc(doc_id) if doc_id else None
+        kind=normalize_doc(doc_type) if doc_type else None
+        if doc is None and kind is None:
+            return []
+        with self._lock:
+            self._update(db)
+            if doc is not None:
+                page_ids=self._docs.get(doc,set())
+                if kind is not None:
+                    page_ids=page_ids&self._types.get(kind,set())
+            else:
+                page_ids=self._types.get(kind,set())
+            hits=[]
+            pages=_db_index(db).pages
+            for page_id in sorted(page_ids):
+                product,sheet,page=pages[page_id]
+                entry=self._pages[page_id]
+                positions=entry[2][doc] if doc is not None else entry[3][kind]
+                if doc is not None and kind is not None:
+                    positions=sorted(set(positions)&set(entry[3][kind]))
+                records=page_records(page)
+                hits.extend((product,sheet,page,i,records[i]) for i in positions)
+                if limit is not None and len(hits)>=limit:
+                    return hits[:limit]
+            return hits
+    
+    def duplicates(self,db:Database,page_id:str)->Dict[str,List[int]]:
+        """Doc ids entered more than once on a page, with their positions"""
+        with self._lock:
+            self._update(db)
+            entry=self._pages.get(page_id)
+            if entry is None:
+                return {}
+            return {doc:positions for doc,positions in entry[2].items() if len(positions)>1}
+    
+    def save(self,db:Database):
+        """Write db.docs, if the index has been used"""
+        with self._lock:
+            if self._loaded:
+                self._update(db)
+                self._write()
+    
+    def _write(self):
+        data={'version':self.version,'pages':self._pages}
+        _write_atomic(self.path,lambda f:json.dump(data,f,ensure_ascii=False,separators=(',',':')))
+    
+    def _read(self)->Optional[int]:
+        """Load db.docs into the (clear) index; the version it was saved at"""
+        try:
+            with open(self.path,encoding='utf-8') as f:
+                data=json.load(f)
+        except (FileNotFoundError,ValueError):
+            return None
+        self._pages=data['pages']
+        for page_id,entry in self._pages.items():
+            for postings,index in ((entry[2],self._docs),(entry[3],self._types)):
+                for key in postings:
+                    index.setdefault(key,set()).add(page_id)
+        return data['version']
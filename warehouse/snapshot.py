@@ -0,0 +1,205 @@
+"""Compact snapshots: db.json as typed columns, compressed.
+
+A compact file starts with MAGIC, the format version and the codec (gzip,
+or zstd when the zstandard package is installed), followed by the
+compressed body. The body is a JSON header holding the tree without its
+records, where each page gives its record count, followed by the records
+of every page one column at a time. day is stored as int32, doc_type as
+uint32 codes into the header's doc_types, the quantities as float64, and
+doc_id and comment as JSON lists. The header lists the quantities that
+were ints, which come back as ints. Pages are built straight from the
+columns, with no dict per record."""
+import gzip
+import json
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from operator import attrgetter
+from typing import Dict,List,Optional,Tuple
+
+from .model import Record,RecordColumns,Page,Sheet,Product,Database,_intern_doc_type,_DOC_TYPES
+try:
+    import zstandard
+except ImportError:
+    zstandard=None
+
+MAGIC=b'WHSNAP'
+FORMAT_VERSION=1
+SNAPSHOT_FORMATS=('json','compact')
+
+# Typed record columns and their array codes; the rest are JSON lists
+_ARRAYS={'day':'i','doc_type':'I','input':'d','output':'d','initial_stock':'d','final_stock':'d'}
+_QUANTITIES=('input','output','initial_stock','final_stock')
+_LENGTH=struct.Struct('<Q')
+
+def is_compact(head:bytes)->bool:
+    """Whether a file starting with `head` is a compact snapshot"""
+    return head[:len(MAGIC)]==MAGIC
+
+def _compress(body:bytes)->Tuple[bytes,bytes]:
+    if zstandard is not None:
+        return b'z',zstandard.ZstdCompressor(level=3).compress(body)
+    return b'g',gzip.compress(body,compresslevel=1,mtime=0)
+
+def _decompress(codec:bytes,data:bytes)->bytes:
+    if codec==b'g':
+        return gzip.decompress(data)
+    if codec==b'z':
+        if zstandard is None:
+            raise ValueError('this snapshot is zstd-compressed; install the zstandard package to read it')
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f'unknown snapshot codec {codec!r}')
+
+def _packed(typecode:str,column:array)->bytes:
+    if sys.byteorder=='big':
+        column=array(typecode,column)
+        column.byteswap()
+    return column.tobytes()
+
+def _unpacked(typecode:str,data:bytes)->array:
+    column=array(typecode)
+    column.frombytes(data)
+    if sys.byteorder=='big':
+        column.byteswap()
+    return column
+
+class _ColumnWriter:
+    """Records of many pages gathered into one column per field, doc types
+    coded in order of first appearance"""
+    def __init__(self):
+        self.columns={name:array(typecode) for name,typecode in _ARRAYS.items()}
+        self.columns.update(doc_id=[],comment=[])
+        self.doc_types=[]
+        self.ints={name:[] for name in _QUANTITIES}
+        self._codes={}
+        self._fields=attrgetter(*RecordColumns.FIELDS)
+    
+    def __len__(self)->int:
+        return len(self.columns['doc_id'])
+    
+    def _coded(self,values)->List[int]:
+        for doc_type in set(values).difference(self._codes):
+            self._codes[doc_type]=len(self.doc_types)
+            self.doc_types.append(doc_type)
+        return list(map(self._codes.__getitem__,values))
+    
+    def add(self,records):
+        columns=self.columns
+        if isinstance(records,RecordColumns):
+            for name,column in columns.items():
+                if name!='doc_type':
+                    column.extend(getattr(records,name))
+            codes=records.doc_type_codes
+            remap=dict(zip(set(codes),self._coded([_DOC_TYPES[code] for code in set(codes)])))
+            columns['doc_type'].extend(map(remap.__getitem__,codes))
+        elif records:
+            for name,values in zip(RecordColumns.FIELDS,zip(*map(self._fields,records))):
+                if name in self.ints and int in set(map(type,values)):
+                    self.ints[name].extend(i for i,value in enumerate(values,len(columns[name])) if type(value) is int)
+                columns[name].extend(self._coded(values) if name=='doc_type' else values)
+    
+    def int_rows(self,start:int=0,end:Optional[int]=None)->Dict:
+        """The rows start:end of each quantity column that were ints, counted
+        from start, or True for a column of nothing but ints"""
+        end=len(self) if end is None else end
+        found={}
+        for name,rows in self.ints.items():
+            rows=rows[bisect_left(rows,start):bisect_left(rows,end)]
+            if rows:
+                found[name]=True if len(rows)==end-start else [row-start for row in rows]
+        return found
+
+def _restore_ints(columns:Dict,ints:Dict):
+    """Turn the rows `int_rows` listed back into ints, in place"""
+    for name,rows in ints.items():
+        column=columns[name].tolist()
+        if rows is True:
+            column=list(map(int,column))
+        else:
+            for row in rows:
+                column[row]=int(column[row])
+        columns[name]=column
+
+def _decode_columns(columns:Dict,doc_types:List[str],columnar:bool)->Dict:
+    """Columns as read, doc_type codes turned into this process's codes
+    (columnar) or into the strings"""
+    if columnar:
+        remap=[_intern_doc_type(doc_type) for doc_type in doc_types]
+        codes=array('I',[remap[code] for code in columns['doc_type']])
+    else:
+        codes=[doc_types[code] for code in columns['doc_type']]
+    return {**columns,'doc_type':codes}
+
+def _build_records(columns:Dict,start:int,end:int,columnar:bool):
+    """Records start:end of decoded columns, as RecordColumns or Records"""
+    parts=[columns[name][start:end] for name in RecordColumns.FIELDS]
+    return RecordColumns.from_arrays(*parts) if columnar else list(map(Record,*parts))
+
+def dump_compact(db:Database,extra:Dict)->bytes:
+    """`db`, plus top-level fields such as journal_seq, as a compact snapshot.
+    Archived sheets are written as stubs naming their archive."""
+    writer=_ColumnWriter()
+    products=[]
+    for product in db.products:
+        sheets=[]
+        for sheet in product.sheets:
+            if sheet.archive is not None:
+                sheets.append({'id':sheet.id,'year':sheet.year,'month':sheet.month,'archive':sheet.archive,'pages':[]})
+                continue
+            pages=[]
+            for page in sheet.pages:
+                records=page.records
+                writer.add(records)
+                pages.append({'id':page.id,'unit_price':page.unit_price,'initial_stock':page.initial_stock,
+                              'records':len(records),**({'carried':True} if page.carried else {})})
+            sheets.append({'id':sheet.id,'year':sheet.year,'month':sheet.month,'pages':pages})
+        products.append({'id':product.id,'name':product.name,'measure_unit':product.measure_unit,'sheets':sheets})
+    header={'products':products,'doc_types':writer.doc_types,'extra':extra}
+    ints=writer.int_rows()
+    if ints:
+        header['ints']=ints
+    sections=[json.dumps(header,ensure_ascii=False,separators=(',',':')).encode()]
+    for name in RecordColumns.FIELDS:
+        if name in _ARRAYS:
+            sections.append(_packed(_ARRAYS[name],writer.columns[name]))
+        else:
+            sections.append(json.dumps(writer.columns[name],ensure_ascii=False,separators=(',',':')).encode())
+    codec,body=_compress(b''.join(_LENGTH.pack(len(s))+s for s in sections))
+    return MAGIC+bytes([FORMAT_VERSION])+codec+body
+
+def load_compact(data:bytes,columnar:bool=False)->Tuple[Database,Dict]:
+    """(database, top-level fields) from a compact snapshot"""
+    if not is_compact(data):
+        raise ValueError('not a compact snapshot')
+    version=data[len(MAGIC)]
+    if version>FORMAT_VERSION:
+        raise ValueError(f'snapshot format {version} is newer than this version of warehouse reads')
+    body=_decompress(data[len(MAGIC)+1:len(MAGIC)+2],data[len(MAGIC)+2:])
+    sections,offset=[],0
+    while offset<len(body):
+        (length,),offset=_LENGTH.unpack_from(body,offset),offset+_LENGTH.size
+        sections.append(body[offset:offset+length])
+        offset+=length
+    header=json.loads(sections[0])
+    columns={}
+    for name,section in zip(RecordColumns.FIELDS,sections[1:]):
+        columns[name]=_unpacked(_ARRAYS[name],section) if name in _ARRAYS else json.loads(section)
+    if not columnar:
+        _restore_ints(columns,header.get('ints',{}))
+    columns=_decode_columns(columns,header['doc_types'],columnar)
+    start=0
+    products=[]
+    for p in header['products']:
+        sheets=[]
+        for s in p['sheets']:
+            pages=[]
+            for pg in s['pages']:
+                end=start+pg['records']
+                pages.append(Page(unit_price=pg['unit_price'],initial_stock=pg['initial_stock'],
+                                  records=_build_records(columns,start,end,columnar),id=pg['id'],
+                                  carried=pg.get('carried',False)))
+                start=end
+            sheets.append(Sheet(year=s['year'],month=s['month'],pages=pages,id=s['id'],archive=s.get('archive')))
+        products.append(Product(name=p['name'],measure_unit=p['measure_unit'],sheets=sheets,id=p['id']))
+    return Database(products=products,columnar=columnar),header['extra']
@@ -0,0 +1,852 @@
+"""Storage engines: where a WarehouseManager keeps its Database"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from dataclasses import asdict
+from functools import partial
+from pathlib import Path
+from typing import List,Optional,Dict
+
+from .model import (Record,RecordColumns,Page,LazyPage,Sheet,Product,Database,_new_id,_record_dicts,
+                    record_count,page_records,_find_product,_find_sheet,_find_page)
+from .metrics import METRICS
+from .archive import Archive
+from .ops import OPS
+from .snapshot import SNAPSHOT_FORMATS,dump_compact,is_compact,load_compact
+
+def _encode_arg(value):
+    if isinstance(value,list):
+        return [_encode_arg(v) for v in value]
+    return asdict(value) if isinstance(value,Record) else value
+
+def _db_to_dict(db:Database,archived:bool=True)->Dict:
+    """The tree as JSON data; without `archived`, archived sheets are stubs
+    naming their archive part instead of holding their pages"""
+    return {'products':[
+        {'id':p.id,'name':p.name,'measure_unit':p.measure_unit,'sheets':[
+            _sheet_dict(s,archived) for s in p.sheets
+        ]} for p in db.products
+    ]}
+
+def _sheet_dict(s:Sheet,archived:bool)->Dict:
+    data={'id':s.id,'year':s.year,'month':s.month}
+    if s.archive is not None:
+        data['archive']=s.archive
+        if not archived:
+            return data
+    data['pages']=[_page_dict(pg,records=_record_dicts(pg.records)) for pg in s.pages]
+    return data
+
+def _page_dict(pg:Page,**fields)->Dict:
+    """A page's header; `carried` only when set, so older files read the same"""
+    data={'id':pg.id,'unit_price':pg.unit_price,'initial_stock':pg.initial_stock,**fields}
+    if pg.carried:
+        data['carried']=True
+    return data
+
+def _dict_to_db(data:Dict,columnar:bool=False)->Database:
+    products=[]
+    for p in data.get('products',[]):
+        sheets=[]
+        for s in p.get('sheets',[]):
+            pages=[]
+            for pg in s.get('pages',[]):
+                if columnar:
+                    records=RecordColumns.from_dicts(pg.get('records',[]))
+                else:
+                    records=[]
+                    for r in pg.get('records',[]):
+                        records.append(Record(**r))
+                pages.append(Page(
+                    unit_price=pg['unit_price'],
+                    initial_stock=pg['initial_stock'],
+                    records=records,
+                    id=pg.get('id') or _new_id(),
+                    carried=pg.get('carried',False)
+                ))
+            sheets.append(Sheet(
+                year=s['year'],
+                month=s['month'],
+                pages=pages,
+                id=s.get('id') or _new_id(),
+                archive=s.get('archive')
+            ))
+        products.append(Product(
+            name=p['name'],
+            measure_unit=p['measure_unit'],
+            sheets=sheets,
+            id=p.get('id') or _new_id()
+        ))
+    return Database(products=products,columnar=columnar)
+
+def _missing_ids(data:Dict)->bool:
+    """Whether a stored tree predates ids (they are then made up on load)"""
+    return any('id' not in p or any('id' not in s or any('id' not in pg for pg in s.get('pages',[]))
+                                    for s in p.get('sheets',[]))
+               for p in data.get('products',[]))
+
+def _fsync_dir(path:Path):
+    # Makes a rename durable; directories cannot be opened on every platform
+    try:
+        fd=os.open(path,os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _write_atomic(path:Path,write,binary:bool=False):
+    """Call `write(f)` on a temp file next to `path`, fsync it and rename it
+    over `path`, so a crash leaves either the old file or the new one"""
+    tmp=path.with_name(f'.{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        with open(tmp,'wb') if binary else open(tmp,'w',encoding='utf-8') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp,path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+def _rotate_backups(path:Path,keep:int,interval:float):
+    """Before `path` is replaced, keep its current version as <name>.1.bak,
+    shifting older ones up to <name>.<keep>.bak; at most one new backup
+    every `interval` seconds"""
+    if keep<=0 or not path.exists():
+        return
+    newest=path.with_name(f'{path.name}.1.bak')
+    if newest.exists() and time.time()-newest.stat().st_mtime<interval:
+        return
+    for n in range(keep-1,0,-1):
+        older=path.with_name(f'{path.name}.{n}.bak')
+        if older.exists():
+            os.replace(older,path.with_name(f'{path.name}.{n+1}.bak'))
+    try:
+        # The file is about to be replaced by a new one, so a hard link is
+        # as good as a copy
+        os.link(path,newest)
+        os.utime(newest)
+    except OSError:
+        shutil.copyfile(path,newest)
+
+class StorageBackend:
+    """Where a WarehouseManager keeps its Database.
+    
+    `commit` is called after every mutation with the operation that was just
+    applied to `db`; backends that can persist a single change cheaply
+    override it, the rest rewrite everything. Inside a batch, `stage` is
+    called instead and `flush` persists everything staged at the end. With
+    `columnar` set, loaded pages keep their records in RecordColumns."""
+    def __init__(self,db_path:Path,columnar:bool=False):
+        self.db_path=db_path
+        self.columnar=columnar
+        self._staged=[]
+    
+    def load(self)->Optional[Database]:
+        raise NotImplementedError
+    
+    def save(self,db:Database):
+        raise NotImplementedError
+    
+    def commit(self,db:Database,op:str,args:tuple):
+        self.save(db)
+    
+    def commit_many(self,db:Database,ops:List[tuple]):
+        """Persist several (op, args) already applied to `db`"""
+        self.save(db)
+    
+    def stage(self,db:Database,op:str,args:tuple):
+        self._staged.append((op,args))
+    
+    def flush(self,db:Database):
+        ops,self._staged=self._staged,[]
+        if ops:
+            self.commit_many(db,ops)
+    
+    def discard(self):
+        """Forget what was staged since the last flush"""
+        self._staged=[]
+    
+    def close(self):
+        pass
+
+class JsonBackend(StorageBackend):
+    """The whole database as one db.json file, replaced atomically on save.
+    
+    The file is JSON or a compact snapshot (see `warehouse.snapshot`),
+    told apart on load. It is saved in the format it was found in, or as
+    `snapshot` when that is given. Sheets of closed periods live in
+    db.archive/ instead (see `warehouse.archive`). The previous versions
+    are kept as db.json.1.bak .. db.json.<backups>.bak, one taken at most
+    every `backup_interval` seconds."""
+    def __init__(self,db_path:Path,columnar:bool=False,backups:int=3,backup_interval:float=600,
+                 snapshot:Optional[str]=None):
+        super().__init__(db_path,columnar)
+        if snapshot is not None and snapshot not in SNAPSHOT_FORMATS:
+            raise ValueError(f'unknown snapshot format {snapshot!r}')
+        self.backups=backups
+        self.backup_interval=backup_interval
+        self.snapshot=snapshot
+        self.archive=Archive(db_path.with_suffix('.archive'),columnar)
+        self._found=None
+    
+    @property
+    def snapshot_format(self)->str:
+        """The format the next save writes"""
+        return self.snapshot or self._found or 'json'
+    
+    def load(self)->Optional[Database]:
+        if not self.db_path.exists():
+            return None
+        db,_,legacy=self._read(self.columnar)
+        if legacy:
+            self.save(db)
+        return db
+    
+    def save(self,db:Database):
+        self._write(db,{})
+    
+    def _read(self,columnar:bool)->tuple:
+        """(database, its other top-level fields, whether ids were missing)
+        from db.json in either format"""
+        with open(self.db_path,'rb') as f:
+            data=f.read()
+        if is_compact(data):
+            self._found='compact'
+            with METRICS.timer('snapshot.parse'):
+                db,extra=load_compact(data,columnar)
+            self.archive.attach(db)
+            return db,extra,False
+        self._found='json'
+        with METRICS.timer('json.parse'):
+            data=json.loads(data)
+        with METRICS.timer('dict_to_db'):
+            db=_dict_to_db(data,columnar)
+        self.archive.attach(db)
+        return db,{k:v for k,v in data.items() if k!='products'},_missing_ids(data)
+    
+    def _write(self,db:Database,extra:Dict):
+        """Save `db` with `extra` top-level fields in `snapshot_format`"""
+        _rotate_backups(self.db_path,self.backups,self.backup_interval)
+        if self.snapshot_format=='compact':
+            with METRICS.timer('snapshot.write'):
+                data=dump_compact(db,extra)
+                _write_atomic(self.db_path,lambda f:f.write(data),binary=True)
+            self._found='compact'
+            return
+        with METRICS.timer('db_to_dict'):
+            data=_db_to_dict(db,archived=False)
+        data.update(extra)
+        with METRICS.timer('json.write'):
+            _write_atomic(self.db_path,lambda f:json.dump(data,f,ensure_ascii=False,indent=2))
+        self._found='json'
+
+class JournalBackend(JsonBackend):
+    """db.json snapshot plus an append-only db.journal of operations.
+    
+    Every `compact_every` operations the journal is sealed and a background
+    thread folds it into a new snapshot, working from the files on disk
+    rather than the live tree so the foreground never waits on it."""
+    def __init__(self,db_path:Path,compact_every:int=1000,columnar:bool=False,**backup_options):
+        super().__init__(db_path,columnar,**backup_options)
+        self.compact_every=compact_every
+        self.journal_path=db_path.with_suffix('.journal')
+        self.sealed_journal_path=db_path.with_suffix('.journal.sealed')
+        self._journal_file=None
+        self._journal_ops=0
+        self._seq=0
+        self._snapshot_seq=0
+        self._journal_lock=threading.Lock()
+        self._snapshot_lock=threading.Lock()
+        self._compactor=None
+    
+    def load(self)->Optional[Database]:
+        if not self.db_path.exists():
+            return None
+        db,extra,legacy=self._read(self.columnar)
+        with self._journal_lock:
+            # Another process may have sealed the file this handle points to
+            self._close_journal()
+        self._snapshot_seq=self._seq=extra.get('journal_seq',0)
+        self._journal_ops=0
+        for path in (self.sealed_journal_path,self.journal_path):
+            for entry in self._read_journal(path):
+                if entry['seq']>self._seq:
+                    op=OPS[entry['op']]
+                    op(db,*entry['args'])
+                    # Entries written before ids leave out the trailing id argument
+                    legacy=legacy or len(entry['args'])<op.__code__.co_argcount-1
+                    self._seq=entry['seq']
+                    self._journal_ops+=1
+        self._drop_torn_tail()
+        if legacy:
+            # Journal entries from now on refer to ids; pin them in a snapshot
+            self.save(db)
+        elif self.sealed_journal_path.exists():
+            # A compaction was interrupted; finish it
+            with self._journal_lock:
+                self._start_compaction()
+        return db
+    
+    def save(self,db:Database):
+        with self._snapshot_lock:
+            self._write_snapshot(db,self._seq)
+        with self._journal_lock:
+            self._close_journal()
+            self.journal_path.unlink(missing_ok=True)
+            self._journal_ops=0
+    
+    def commit(self,db:Database,op:str,args:tuple):
+        self.commit_many(db,[(op,args)])
+    
+    def commit_many(self,db:Database,ops:List[tuple]):
+        # One write and one fsync for the whole batch
+        with self._journal_lock:
+            if self._journal_file is None:
+                self._journal_file=open(self.journal_path,'a',encoding='utf-8')
+            lines=[]
+            for op,args in ops:
+                self._seq+=1
+                entry={'seq':self._seq,'op':op,'args':[_encode_arg(a) for a in args]}
+                lines.append(json.dumps(entry,ensure_ascii=False)+'\n')
+            self._journal_file.write(''.join(lines))
+            self._journal_file.flush()
+            os.fsync(self._journal_file.fileno())
+            self._journal_ops+=len(ops)
+            if self._journal_ops>=self.compact_every:
+                self._start_compaction()
+    
+    def close(self):
+        with self._journal_lock:
+            self._close_journal()
+        if self._compactor is not None:
+            self._compactor.join()
+    
+    def _write_snapshot(self,db:Database,seq:int):
+        self._write(db,{'journal_seq':seq})
+        self._snapshot_seq=seq
+    
+    def _read_journal(self,path:Path):
+        if not path.exists():
+            return
+        with open(path,'r',encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write from a crash; everything after it is lost anyway
+                    return
+    
+    def _drop_torn_tail(self):
+        # Replay stops at a line cut off by a crash, so entries appended
+        # after it would be lost as well
+        try:
+            with open(self.journal_path,'rb+') as f:
+                data=f.read()
+                if data and not data.endswith(b'\n'):
+                    f.truncate(data.rfind(b'\n')+1)
+        except FileNotFoundError:
+            pass
+    
+    def _close_journal(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file=None
+    
+    def _start_compaction(self):
+        # Called with _journal_lock held
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        if not self.sealed_journal_path.exists():
+            self._close_journal()
+            os.replace(self.journal_path,self.sealed_journal_path)
+            self._journal_ops=0
+        self._compactor=threading.Thread(target=self.compact,daemon=True)
+        self._compactor.start()
+    
+    def compact(self):
+        """Fold the sealed journal into a new snapshot. The files are read
+        without the database's file lock (db.lock); it is held to replace
+        the snapshot and remove the sealed journal together, so a process
+        loading never finds the journal gone but the old snapshot read.
+        If either file changed meanwhile, the fold starts over."""
+        from .manager import FileLock
+        while True:
+            files=self._compaction_files()
+            if files is None:
+                return
+            with self._snapshot_lock:
+                db,extra,_=self._read(False)
+                seq=extra.get('journal_seq',0)
+                for entry in self._read_journal(self.sealed_journal_path):
+                    if entry['seq']>seq:
+                        OPS[entry['op']](db,*entry['args'])
+                        seq=entry['seq']
+            with FileLock(self.db_path.with_suffix('.lock')),self._snapshot_lock:
+                if self._compaction_files()!=files:
+                    continue
+                if seq>self._snapshot_seq:
+                    self._write_snapshot(db,seq)
+                self.sealed_journal_path.unlink(missing_ok=True)
+                return
+    
+    def _compaction_files(self)->Optional[tuple]:
+        """Identity of the snapshot and sealed journal, or None without one"""
+        try:
+            return tuple((s.st_ino,s.st_size,s.st_mtime_ns) for s in (self.db_path.stat(),self.sealed_journal_path.stat()))
+        except FileNotFoundError:
+            return None
+
+SQLITE_SCHEMA='''
+CREATE TABLE IF NOT EXISTS products(
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    measure_unit TEXT NOT NULL,
+    uid TEXT
+);
+CREATE INDEX IF NOT EXISTS products_position ON products(position);
+CREATE TABLE IF NOT EXISTS sheets(
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    uid TEXT,
+    archive TEXT
+);
+CREATE INDEX IF NOT EXISTS sheets_position ON sheets(product_id,position);
+CREATE TABLE IF NOT EXISTS pages(
+    id INTEGER PRIMARY KEY,
+    sheet_id INTEGER NOT NULL REFERENCES sheets(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    unit_price REAL NOT NULL,
+    initial_stock REAL NOT NULL,
+    uid TEXT,
+    carried INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS pages_position ON pages(sheet_id,position);
+CREATE TABLE IF NOT EXISTS records(
+    id INTEGER PRIMARY KEY,
+    page_id INTEGER NOT NULL REFERENCES pages(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    doc_id TEXT NOT NULL,
+    doc_type TEXT NOT NULL,
+    input REAL NOT NULL,
+    output REAL NOT NULL,
+    comment TEXT NOT NULL,
+    initial_stock REAL NOT NULL,
+    final_stock REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_position ON records(page_id,position);
+'''
+
+# Created after _migrate, since older files lack the uid columns
+SQLITE_UID_INDEXES='''
+CREATE INDEX IF NOT EXISTS products_uid ON products(uid);
+CREATE INDEX IF NOT EXISTS sheets_uid ON sheets(uid);
+CREATE INDEX IF NOT EXISTS pages_uid ON pages(uid);
+'''
+
+class SqliteBackend(StorageBackend):
+    """One row per product/sheet/page/record in db.sqlite (WAL mode).
+    
+    Each mutation is written in its own transaction touching only the rows
+    it changes. On first use an existing db.json next to it is imported;
+    archived sheets are copied whole and keep their archive name, so they
+    stay read-only."""
+    def __init__(self,db_path:Path,lazy:bool=True,columnar:bool=False):
+        super().__init__(db_path,columnar)
+        self.lazy=lazy
+        self.sqlite_path=db_path.with_suffix('.sqlite')
+        self.json_path=db_path.with_suffix('.json')
+        self.conn=sqlite3.connect(self.sqlite_path,check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._migrate()
+        self.conn.executescript(SQLITE_UID_INDEXES)
+    
+    def _migrate(self):
+        with self.conn as conn:
+            for table in ('products','sheets','pages'):
+                columns={row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if 'uid' not in columns:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN uid TEXT')
+                if table=='sheets' and 'archive' not in columns:
+                    conn.execute('ALTER TABLE sheets ADD COLUMN archive TEXT')
+                if table=='pages' and 'carried' not in columns:
+                    conn.execute('ALTER TABLE pages ADD COLUMN carried INTEGER NOT NULL DEFAULT 0')
+    
+    def _uid(self,conn,table:str,rowid:int,uid:Optional[str])->str:
+        # Rows written before ids existed get one the first time they are read
+        if uid is None:
+            uid=_new_id()
+            conn.execute(f'UPDATE {table} SET uid=? WHERE id=?',(uid,rowid))
+        return uid
+    
+    def load(self)->Optional[Database]:
+        if self._is_empty():
+            if not self.json_path.exists():
+                return None
+            db=JsonBackend(self.json_path,self.columnar).load()
+            self.save(db)
+            return db
+        with self.conn as conn:
+            products={}
+            for pid,name,unit,uid in conn.execute('SELECT id,name,measure_unit,uid FROM products ORDER BY position').fetchall():
+                products[pid]=Product(name,unit,id=self._uid(conn,'products',pid,uid))
+            sheets={}
+            for sid,pid,year,month,uid,archive in conn.execute(
+                    'SELECT id,product_id,year,month,uid,archive FROM sheets ORDER BY product_id,position').fetchall():
+                sheets[sid]=Sheet(year,month,id=self._uid(conn,'sheets',sid,uid),archive=archive)
+                products[pid].sheets.append(sheets[sid])
+            pages={}
+            counts=dict(conn.execute('SELECT page_id,COUNT(*) FROM records GROUP BY page_id')) if self.lazy else {}
+            for pgid,sid,price,stock,uid,carried in conn.execute(
+                    'SELECT id,sheet_id,unit_price,initial_stock,uid,carried FROM pages ORDER BY sheet_id,position').fetchall():
+                uid=self._uid(conn,'pages',pgid,uid)
+                if self.lazy:
+                    pages[pgid]=LazyPage(price,stock,partial(self._load_records,pgid),counts.get(pgid,0),uid,bool(carried))
+                else:
+                    pages[pgid]=Page(price,stock,RecordColumns() if self.columnar else [],uid,bool(carried))
+                sheets[sid].pages.append(pages[pgid])
+        if not self.lazy:
+            for row in self.conn.execute('SELECT page_id,'+self.RECORD_COLUMNS+' FROM records ORDER BY page_id,position'):
+                pages[row[0]].records.append(Record(*row[1:]))
+        return Database(products=list(products.values()),columnar=self.columnar)
+    
+    RECORD_COLUMNS='day,doc_id,doc_type,input,output,comment,initial_stock,final_stock'
+    
+    def _load_records(self,page_id:int)->List[Record]:
+        rows=self.conn.execute('SELECT '+self.RECORD_COLUMNS+' FROM records WHERE page_id=? ORDER BY position',(page_id,))
+        if self.columnar:
+            return RecordColumns.from_rows(rows)
+        return [Record(*row) for row in rows]
+    
+    def save(self,db:Database):
+        with self.conn as conn:
+            self._save(conn,db)
+    
+    def _save(self,conn,db:Database):
+        # Lazy pages read their rows from this connection, so before the
+        # rows are deleted
+        records=[[[page_records(pg) for pg in s.pages] for s in p.sheets] for p in db.products]
+        conn.execute('DELETE FROM products')
+        for i,p in enumerate(db.products):
+            pid=self._insert_product(conn,i,p)
+            for j,s in enumerate(p.sheets):
+                sid=self._insert_sheet(conn,pid,j,s)
+                for k,pg in enumerate(s.pages):
+                    pgid=self._insert_page(conn,sid,k,pg)
+                    self._insert_records(conn,pgid,0,records[i][j][k])
+                    if isinstance(pg,LazyPage) and not pg.loaded:
+                        pg._loader=partial(self._load_records,pgid)
+    
+    def commit(self,db:Database,op:str,args:tuple):
+        handler=getattr(self,'_commit_'+op,None)
+        if handler is None:
+            self.save(db)
+            return
+        with self.conn as conn:
+            handler(conn,db,*args)
+    
+    def commit_many(self,db:Database,ops:List[tuple]):
+        handlers=[(getattr(self,'_commit_'+op,None),args) for op,args in ops]
+        if any(handler is None for handler,_ in handlers):
+            self.save(db)
+            return
+        with self.conn as conn:
+            for handler,args in handlers:
+                handler(conn,db,*args)
+    
+    def stage(self,db:Database,op:str,args:tuple):
+        # Handlers need `db` as it is right after their operation, so they
+        # run now, inside one transaction that flush() commits; so does the
+        # full rewrite of operations without one
+        handler=getattr(self,'_commit_'+op,None)
+        try:
+            if handler is None:
+                self._save(self.conn,db)
+            else:
+                handler(self.conn,db,*args)
+        except BaseException:
+            self.conn.rollback()
+            raise
+    
+    def flush(self,db:Database):
+        self.conn.commit()
+    
+    def discard(self):
+        self.conn.rollback()
+    
+    def close(self):
+        self.conn.close()
+    
+    def _is_empty(self)->bool:
+        return self.conn.execute('SELECT 1 FROM products LIMIT 1').fetchone() is None
+    
+    def _insert_product(self,conn,position:int,p:Product)->int:
+        return conn.execute('INSERT INTO products(position,name,measure_unit,uid) VALUES(?,?,?,?)',
+                            (position,p.name,p.measure_unit,p.id)).lastrowid
+    
+    def _insert_sheet(self,conn,product_id:int,position:int,s:Sheet)->int:
+        return conn.execute('INSERT INTO sheets(product_id,position,year,month,uid,archive) VALUES(?,?,?,?,?,?)',
+                            (product_id,position,s.year,s.month,s.id,s.archive)).lastrowid
+    
+    def _insert_page(self,conn,sheet_id:int,position:int,pg:Page)->int:
+        return conn.execute('INSERT INTO pages(sheet_id,position,unit_price,initial_stock,uid,carried) VALUES(?,?,?,?,?,?)',
+                            (sheet_id,position,pg.unit_price,pg.initial_stock,pg.id,int(pg.carried))).lastrowid
+    
+    def _insert_records(self,conn,page_id:int,start:int,records:List[Record]):
+        conn.executemany(
+            'INSERT INTO records(page_id,position,day,doc_id,doc_type,input,output,comment,initial_stock,final_stock) '
+            'VALUES(?,?,?,?,?,?,?,?,?,?)',
+            ((page_id,start+i,r.day,r.doc_id,r.doc_type,r.input,r.output,r.comment,r.initial_stock,r.final_stock)
+             for i,r in enumerate(records))
+        )
+    
+    def _row(self,conn,table:str,uid:str)->tuple:
+        """(rowid, parent rowid, position) of the row with this uid"""
+        parent={'products':'NULL','sheets':'product_id','pages':'sheet_id'}[table]
+        return conn.execute(f'SELECT id,{parent},position FROM {table} WHERE uid=?',(uid,)).fetchone()
+    
+    # Operations reach the backend with ids (see WarehouseManager._mutate)
+    def _commit_add_product(self,conn,db,name,measure_unit,product_id=None):
+        self._insert_product(conn,len(db.products)-1,db.products[-1])
+    
+    def _commit_delete_product(self,conn,db,product_id):
+        _,_,position=self._row(conn,'products',product_id)
+        conn.execute('DELETE FROM products WHERE uid=?',(product_id,))
+        conn.execute('UPDATE products SET position=position-1 WHERE position>?',(position,))
+    
+    def _commit_add_sheet(self,conn,db,product_id,year,month,sheet_id=None):
+        sheets=_find_product(db,product_id).sheets
+        self._insert_sheet(conn,self._row(conn,'products',product_id)[0],len(sheets)-1,sheets[-1])
+    
+    def _commit_delete_sheet(self,conn,db,product_id,sheet_id):
+        _,parent,position=self._row(conn,'sheets',sheet_id)
+        conn.execute('DELETE FROM sheets WHERE uid=?',(sheet_id,))
+        conn.execute('UPDATE sheets SET position=position-1 WHERE product_id=? AND position>?',(parent,position))
+    
+    def _commit_add_page(self,conn,db,product_id,sheet_id,unit_price,initial_stock,page_id=None,carried=False):
+        pages=_find_sheet(db,product_id,sheet_id)[1].pages
+        self._insert_page(conn,self._row(conn,'sheets',sheet_id)[0],len(pages)-1,pages[-1])
+    
+    def _commit_delete_page(self,conn,db,product_id,sheet_id,page_id):
+        _,parent,position=self._row(conn,'pages',page_id)
+        conn.execute('DELETE FROM pages WHERE uid=?',(page_id,))
+        conn.execute('UPDATE pages SET position=position-1 WHERE sheet_id=? AND position>?',(parent,position))
+    
+    def _commit_add_record(self,conn,db,product_id,sheet_id,page_id,record):
+        records=_find_page(db,product_id,sheet_id,page_id)[2].records
+        self._insert_records(conn,self._row(conn,'pages',page_id)[0],len(records)-1,records[-1:])
+    
+    def _commit_add_records(self,conn,db,product_id,sheet_id,page_id,records):
+        page_records=_find_page(db,product_id,sheet_id,page_id)[2].records
+        start=len(page_records)-len(records)
+        self._insert_records(conn,self._row(conn,'pages',page_id)[0],start,page_records[start:])
+    
+    def _rewrite_records(self,conn,page:Page,start:int):
+        # Records from `start` on moved or had their stocks recomputed
+        pgid=self._row(conn,'pages',page.id)[0]
+        conn.execute('DELETE FROM records WHERE page_id=? AND position>=?',(pgid,start))
+        self._insert_records(conn,pgid,start,page.records[start:])
+    
+    def _commit_insert_record(self,conn,db,product_id,sheet_id,page_id,record_idx,record):
+        self._rewrite_records(conn,_find_page(db,product_id,sheet_id,page_id)[2],record_idx)
+    
+    def _commit_update_record(self,conn,db,product_id,sheet_id,page_id,record_idx,changes):
+        self._rewrite_records(conn,_find_page(db,product_id,sheet_id,page_id)[2],record_idx)
+    
+    def _commit_delete_record(self,conn,db,product_id,sheet_id,page_id,record_idx):
+        self._rewrite_records(conn,_find_page(db,product_id,sheet_id,page_id)[2],record_idx)
+    
+    def _commit_recalculate_stocks(self,conn,db,product_id,sheet_id,page_id,start=0):
+        self._rewrite_records(conn,_find_page(db,product_id,sheet_id,page_id)[2],start)
+    
+    def _commit_carry_forward(self,conn,db,product_id,sheet_id):
+        product,start=_find_sheet(db,product_id,sheet_id)
+        for sheet in product.sheets:
+            if (sheet.year,sheet.month)<(start.year,start.month) or sheet.archive is not None:
+                continue
+            for page in sheet.pages:
+                if isinstance(page,LazyPage) and not page.loaded:
+                    continue
+                conn.execute('UPDATE pages SET initial_stock=? WHERE uid=?',(page.initial_stock,page.id))
+                self._rewrite_records(conn,page,0)
+    
+    def _commit_carry_openings(self,conn,db,product_id,year,month):
+        for sheet in _find_product(db,product_id).sheets:
+            if (sheet.year,sheet.month)<=(year,month):
+                continue
+            for page in sheet.pages:
+                # A carried page whose opening changed was loaded to recalculate it
+                if page.carried and not (isinstance(page,LazyPage) and not page.loaded):
+                    conn.execute('UPDATE pages SET initial_stock=? WHERE uid=?',(page.initial_stock,page.id))
+                    self._rewrite_records(conn,page,0)
+
+class ShardedBackend(StorageBackend):
+    """db/index.json with products, sheets and page headers, plus one
+    db/sheets/<shard>.json per sheet holding its pages' records.
+    
+    Pages come back as LazyPage, so records are only parsed for the sheets
+    that are actually opened, and a change rewrites the index and the one
+    sheet it touched. On first use an existing db.json next to it is imported."""
+    # Operations whose first two arguments are (product id, sheet id) and
+    # which only change records of that sheet
+    SHEET_OPS={'add_page','add_record','add_records','insert_record','update_record','delete_record',
+               'recalculate_stocks'}
+    # Operations that only change headers; new sheets get a shard regardless
+    INDEX_OPS={'add_product','delete_product','add_sheet','delete_sheet','delete_page'}
+    
+    def __init__(self,db_path:Path,columnar:bool=False):
+        super().__init__(db_path,columnar)
+        self.root=db_path.with_suffix('')
+        self.index_path=self.root/'index.json'
+        self.shards_path=self.root/'sheets'
+        self.json_path=db_path.with_suffix('.json')
+        self._sheet_shards={}
+        self._page_slots={}
+        self._shard_cache=(None,None)
+    
+    def load(self)->Optional[Database]:
+        if not self.index_path.exists():
+            if not self.json_path.exists():
+                return None
+            db=JsonBackend(self.json_path,self.columnar).load()
+            self.save(db)
+            return db
+        with open(self.index_path,'r',encoding='utf-8') as f:
+            data=json.load(f)
+        # Another process may have rewritten the shard parsed last
+        self._shard_cache=(None,None)
+        products=[]
+        for p in data.get('products',[]):
+            sheets=[]
+            for s in p.get('sheets',[]):
+                sheet=Sheet(year=s['year'],month=s['month'],id=s.get('id') or _new_id(),archive=s.get('archive'))
+                for pg in s.get('pages',[]):
+                    page=LazyPage(pg['unit_price'],pg['initial_stock'],
+                                  partial(self._load_records,s['shard'],pg['slot']),pg.get('count'),pg.get('id'),
+                                  pg.get('carried',False))
+                    self._register_page(page,s['shard'],pg['slot'])
+                    sheet.pages.append(page)
+                self._sheet_shards[id(sheet)]=(weakref.ref(sheet),s['shard'])
+                sheets.append(sheet)
+            products.append(Product(name=p['name'],measure_unit=p['measure_unit'],sheets=sheets,id=p.get('id') or _new_id()))
+        db=Database(products=products,columnar=self.columnar)
+        if _missing_ids(data):
+            self._write(db,lambda sheet:False)
+        return db
+    
+    def save(self,db:Database):
+        self._remove_orphans(self._write(db,lambda sheet:not self._is_clean(sheet)))
+    
+    def commit(self,db:Database,op:str,args:tuple):
+        if op in self.SHEET_OPS:
+            target=_find_sheet(db,args[0],args[1])[1]
+            self._write(db,lambda sheet:sheet is target)
+        elif op in self.INDEX_OPS:
+            live=self._write(db,lambda sheet:False)
+            if op in ('delete_product','delete_sheet'):
+                self._remove_orphans(live)
+        else:
+            self.save(db)
+    
+    def _write(self,db:Database,dirty)->set:
+        self.shards_path.mkdir(parents=True,exist_ok=True)
+        live=set()
+        products=[]
+        for p in db.products:
+            sheets=[]
+            for sheet in p.sheets:
+                shard=self._shard_of(sheet)
+                if shard is None or dirty(sheet):
+                    shard=self._write_shard(sheet,shard)
+                live.add(shard)
+                pages=[]
+                for page in sheet.pages:
+                    pages.append(_page_dict(page,slot=self._slot_of(page)[1],count=record_count(page)))
+                sheets.append({'id':sheet.id,'year':sheet.year,'month':sheet.month,'shard':shard,'pages':pages,
+                               **({'archive':sheet.archive} if sheet.archive is not None else {})})
+            products.append({'id':p.id,'name':p.name,'measure_unit':p.measure_unit,'sheets':sheets})
+        _write_atomic(self.index_path,lambda f:json.dump({'products':products},f,ensure_ascii=False))
+        return live
+    
+    def _write_shard(self,sheet:Sheet,shard:Optional[str])->str:
+        shard=shard or uuid.uuid4().hex
+        payload=[_record_dicts(page.records) for page in sheet.pages]
+        _write_atomic(self.shards_path/f'{shard}.json',lambda f:json.dump(payload,f,ensure_ascii=False))
+        self._sheet_shards[id(sheet)]=(weakref.ref(sheet),shard)
+        for slot,page in enumerate(sheet.pages):
+            self._register_page(page,shard,slot)
+        self._shard_cache=(None,None)
+        return shard
+    
+    def _load_records(self,shard:str,slot:int)->List[Record]:
+        # Sibling pages are usually opened together, so keep the last shard parsed
+        name,payload=self._shard_cache
+        if name!=shard:
+            with open(self.shards_path/f'{shard}.json','r',encoding='utf-8') as f:
+                payload=json.load(f)
+            self._shard_cache=(shard,payload)
+        if self.columnar:
+            return RecordColumns.from_dicts(payload[slot])
+        return [Record(**r) for r in payload[slot]]
+    
+    def _register_page(self,page:Page,shard:str,slot:int):
+        self._page_slots[id(page)]=(weakref.ref(page),shard,slot)
+    
+    def _shard_of(self,sheet:Sheet)->Optional[str]:
+        entry=self._sheet_shards.get(id(sheet))
+        return entry[1] if entry and entry[0]() is sheet else None
+    
+    def _slot_of(self,page:Page)->tuple:
+        entry=self._page_slots.get(id(page))
+        return entry[1:] if entry and entry[0]() is page else (None,None)
+    
+    def _is_clean(self,sheet:Sheet)->bool:
+        shard=self._shard_of(sheet)
+        return shard is not None and all(
+            isinstance(page,LazyPage) and not page.loaded and self._slot_of(page)[0]==shard
+            for page in sheet.pages
+        )
+    
+    def _remove_orphans(self,live:set):
+        for path in self.shards_path.glob('*.json'):
+            if path.stem not in live:
+                path.unlink(missing_ok=True)
+        for registry in (self._sheet_shards,self._page_slots):
+            for key in [k for k,entry in registry.items() if entry[0]() is None]:
+                del registry[key]
+
+# Storage engines selectable through WarehouseManager(storage=...)
+BACKENDS={
+    'json':JsonBackend,
+    'journal':JournalBackend,
+    'sqlite':SqliteBackend,
+    'sharded':ShardedBackend,
+}
+
+def migrate_json_to_sqlite(json_path:str):
+    """One-shot copy of an existing db.json into db.sqlite next to it"""
+    json_path=Path(json_path)
+    db=JsonBackend(json_path).load()
+    backend=SqliteBackend(json_path)
+    try:
+        backend.save(db or Database())
+    finally:
+        backend.close()
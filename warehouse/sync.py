@@ -0,0 +1,302 @@
+"""Delta sync for clients that work offline (the PWA, scanners).
+
+Every mutation is logged in db.changes under the db.version that published
+it, which grows monotonically across processes. A client remembers the
+last version it has seen and numbers its own operations with a sequence
+of its own; a sync sends only the operations made since the last one and
+gets back only the changes after that version, so its cost follows the
+number of changes rather than the size of the database."""
+import json
+import threading
+from bisect import bisect_right
+from pathlib import Path
+from typing import TYPE_CHECKING,Dict,List,Optional
+
+from .model import _db_index,_record_dicts
+from .ops import REF_ARGS,_json_number,_json_text,_record_changes,_record_from_json
+from .storage import _encode_arg,_db_to_dict,_write_atomic
+
+if TYPE_CHECKING:
+    from .manager import WarehouseManager
+
+CHANGES_KEEP=20000
+
+class ChangeLog:
+    """db.changes, one JSON line per operation: {"v", "op", "args", "origin",
+    "seq"}, origin and seq naming the client operation it came from.
+    Lines without "v" carry the floor or the last operation handled per
+    client.
+    
+    "floor" lines mark the log as complete only for versions above them:
+    the log starts at the version it was created at, and trimming it to
+    `keep` entries or finding a torn line raises the floor. Writers hold
+    the database's file lock; readers just follow the appends."""
+    def __init__(self,path:Path,keep:int=CHANGES_KEEP):
+        self.path=path
+        self.keep=keep
+        self._lock=threading.Lock()
+        self._reset()
+    
+    def _reset(self):
+        self.floor=0
+        self.client_seqs={}
+        self._versions=[]
+        self._entries=[]
+        self._offset=0
+        self._inode=None
+    
+    def start(self,version:int):
+        """Begin the log at `version` unless there is one"""
+        if not self.path.exists():
+            _write_atomic(self.path,lambda f:f.write(json.dumps({'floor':version})+'\n'))
+    
+    def append(self,version:int,changes:List[tuple]):
+        """Log (op, args, origin) tuples under `version`"""
+        lines=[]
+        for op,args,origin in changes:
+            entry={'v':version,'op':op,'args':[_encode_arg(a) for a in args]}
+            if origin is not None:
+                entry['origin'],entry['seq']=origin
+            lines.append(json.dumps(entry,ensure_ascii=False)+'\n')
+        with open(self.path,'ab+') as f:
+            f.seek(0,2)
+            if f.tell():
+                f.seek(-1,2)
+                if f.read(1)!=b'\n':
+                    # An append cut off by a crash, of changes published under
+                    # `version` at the latest; clients behind it start over
+                    lines.insert(0,'\n'+json.dumps({'floor':version})+'\n')
+            f.write(''.join(lines).encode())
+        with self._lock:
+            self._read()
+            if len(self._entries)>self.keep:
+                self._trim()
+    
+    def ack(self,client:str,seq:int):
+        """Record that `client` operations up to `seq` were handled, also
+        those that were rejected and so left no entry"""
+        with open(self.path,'a',encoding='utf-8') as f:
+            f.write(json.dumps({'clients':{client:seq}},ensure_ascii=False)+'\n')
+    
+    def since(self,version:int)->Optional[List[Dict]]:
+        """Entries published after `version`, or None if the log no longer
+        reaches back that far"""
+        with self._lock:
+            self._read()
+            if version<self.floor:
+                return None
+            return self._entries[bisect_right(self._versions,version):]
+    
+    def last_seq(self,client:str)->int:
+        """The highest operation sequence number logged for `client`"""
+        with self._lock:
+            self._read()
+            return self.client_seqs.get(client,0)
+    
+    def _read(self):
+        try:
+            stat=self.path.stat()
+        except FileNotFoundError:
+            self._reset()
+            return
+        if stat.st_ino!=self._inode or stat.st_size<self._offset:
+            # Trimmed (replaced) by some process since the last read
+            self._reset()
+            self._inode=stat.st_ino
+        if stat.st_size==self._offset:
+            return
+        with open(self.path,'rb') as f:
+            f.seek(self._offset)
+            data=f.read()
+        end=data.rfind(b'\n')+1  # a partial last line is still being written
+        for line in data[:end].splitlines():
+            try:
+                entry=json.loads(line)
+            except json.JSONDecodeError:
+                continue  # the torn line before a floor
+            if 'v' not in entry:
+                self.floor=max(self.floor,entry.get('floor',0))
+                for client,seq in entry.get('clients',{}).items():
+                    self.client_seqs[client]=max(self.client_seqs.get(client,0),seq)
+                continue
+            self._versions.append(entry['v'])
+            self._entries.append(entry)
+            if 'origin' in entry:
+                self.client_seqs[entry['origin']]=max(self.client_seqs.get(entry['origin'],0),entry['seq'])
+        self._offset+=end
+    
+    def _trim(self):
+        # Called with _lock and the file lock held; cut at a version boundary
+        cut=bisect_right(self._versions,self._versions[len(self._entries)-self.keep//2])
+        header={'floor':self._versions[cut-1],'clients':self.client_seqs}
+        def write(f):
+            f.write(json.dumps(header,ensure_ascii=False)+'\n')
+            for entry in self._entries[cut:]:
+                f.write(json.dumps(entry,ensure_ascii=False)+'\n')
+        _write_atomic(self.path,write)
+        self._reset()
+        self._read()
+
+# The operations a client may send, with the names of their arguments; every
+# product, sheet or page is given by id and new ones bring their own
+SYNC_ARGS={
+    'add_product':('name','measure_unit','id'),
+    'delete_product':('product',),
+    'add_sheet':('product','year','month','id'),
+    'delete_sheet':('product','sheet'),
+    'add_page':('product','sheet','unit_price','initial_stock','id'),
+    'delete_page':('product','sheet','page'),
+    'add_record':('product','sheet','page','record'),
+    'add_records':('product','sheet','page','records'),
+    'insert_record':('product','sheet','page','index','record'),
+    'update_record':('product','sheet','page','index','changes'),
+    'delete_record':('product','sheet','page','index'),
+}
+# Operations that address a record by position, which a change made
+# elsewhere on the same page may have shifted
+POSITIONAL_OPS={'insert_record','update_record','delete_record'}
+
+def _check_ref(name:str,value):
+    if value is not None and (not isinstance(value,str) or not value):
+        raise ValueError(f'{name} must be an id')
+    return value
+
+def _check_id(name:str,value):
+    if not isinstance(value,str) or not value:
+        raise ValueError(f'{name} must be an id')
+    return value
+
+def _check_month(name:str,value):
+    month=_json_number({name:value},name,int)
+    if not 1<=month<=12:
+        raise ValueError(f'month out of range: {month}')
+    return month
+
+def _check_index(name:str,value):
+    index=_json_number({name:value},name,int)
+    if index<0:
+        raise ValueError(f'{name} is negative')
+    return index
+
+def _check_records(name:str,value):
+    if not isinstance(value,list) or not value:
+        raise ValueError(f'{name} must be a non-empty list')
+    return [_record_from_json(r) for r in value]
+
+_SYNC_CHECKS={
+    'product':_check_ref,
+    'sheet':_check_ref,
+    'page':_check_ref,
+    'id':_check_id,
+    'name':lambda name,value:_json_text({name:value},name),
+    'measure_unit':lambda name,value:_json_text({name:value},name),
+    'year':lambda name,value:_json_number({name:value},name,int),
+    'month':_check_month,
+    'unit_price':lambda name,value:_json_number({name:value},name),
+    'initial_stock':lambda name,value:_json_number({name:value},name),
+    'index':_check_index,
+    'record':lambda name,value:_record_from_json(value),
+    'records':_check_records,
+    'changes':lambda name,value:_record_changes(value),
+}
+
+def _sync_args(op:str,args)->tuple:
+    """A client operation's arguments, checked and converted; raises ValueError"""
+    names=SYNC_ARGS.get(op)
+    if names is None:
+        raise ValueError(f'unknown operation {op!r}')
+    if not isinstance(args,list) or len(args)!=len(names):
+        raise ValueError(f"{op} takes {len(names)} arguments: {', '.join(names)}")
+    checked=tuple(_SYNC_CHECKS[name](name,value) for name,value in zip(names,args))
+    refs=REF_ARGS.get(op,0)
+    if refs and checked[refs-1] is None:
+        raise ValueError(f'{names[refs-1]} must be an id')
+    return checked
+
+def _changed_page(op:str,args)->Optional[str]:
+    return args[2] if REF_ARGS.get(op)==3 else None
+
+def _page_json(manager:'WarehouseManager',page_id:str)->Optional[Dict]:
+    found=_db_index(manager.db).pages.get(page_id)
+    if found is None:
+        return None
+    page=found[2]
+    return {'id':page.id,'unit_price':page.unit_price,'initial_stock':page.initial_stock,
+            'records':_record_dicts(page.records)}
+
+def sync(manager:'WarehouseManager',client:str,since:int,changes:List[Dict])->Dict:
+    """Apply a client's offline operations and return what it has not seen.
+
+    `changes` are {"seq", "op", "args"} with seq increasing per client;
+    those already applied (a retried sync) are skipped. Appending records
+    always succeeds: the server computes their stocks down the page's
+    chain. Positional record edits on a page that changed since `since`
+    are rejected instead, and every page changed on both sides comes back
+    whole in "pages" to replace the client's copy. When the log no longer
+    reaches back to `since`, any page may have changed, so every positional
+    edit is rejected and the client starts over from the snapshot.
+
+    Returns {"version", "acked", "applied", "rejected", "changes", "pages"};
+    when `since` is older than the log, "changes" is replaced by a full
+    "snapshot" and "reset" is true."""
+    if not isinstance(client,str) or not client:
+        raise ValueError('client must be a non-empty string')
+    if isinstance(since,bool) or not isinstance(since,int) or since<0:
+        raise ValueError('since must be a version number')
+    if not isinstance(changes,list):
+        raise ValueError('changes must be a list')
+    applied,rejected,touched=0,[],set()
+    # Both locks stay held until the reply is built, so the log, the tree
+    # and the version it reports all agree
+    with manager.lock.write(),manager.file_lock:
+        with manager.batch():
+            # A client ahead of the server has seen another database
+            seen=manager.changes.since(since) if since<=int(manager._disk_version or 0) else None
+            server_pages={_changed_page(e['op'],e['args']) for e in seen or ()}
+            acked=manager.changes.last_seq(client)
+            for change in changes:
+                seq=change.get('seq') if isinstance(change,dict) else None
+                if isinstance(seq,bool) or not isinstance(seq,int) or seq<=0:
+                    raise ValueError('every change needs a positive integer seq')
+                if seq<=acked:
+                    continue
+                acked=seq
+                op=change.get('op')
+                try:
+                    args=_sync_args(op,change.get('args'))
+                except ValueError as e:
+                    rejected.append({'seq':seq,'error':str(e)})
+                    continue
+                page_id=_changed_page(op,args)
+                if seen is None and op in POSITIONAL_OPS:
+                    rejected.append({'seq':seq,'error':'the server no longer has the changes since this version; resync'})
+                    continue
+                if page_id in server_pages:
+                    touched.add(page_id)
+                    if op in POSITIONAL_OPS:
+                        rejected.append({'seq':seq,'error':'the page changed on the server'})
+                        continue
+                manager.origin=(client,seq)
+                try:
+                    done=manager._mutate(op,*args)
+                except ValueError as e:
+                    rejected.append({'seq':seq,'error':str(e)})  # a closed period
+                    continue
+                finally:
+                    manager.origin=None
+                if done:
+                    applied+=1
+                else:
+                    rejected.append({'seq':seq,'error':'nothing to apply it to'})
+        if acked>manager.changes.last_seq(client):
+            manager.changes.ack(client,acked)
+        reply={'acked':acked,'applied':applied,'rejected':rejected}
+        version=int(manager._disk_version or 0)
+        entries=manager.changes.since(since) if since<=version else None
+        if entries is None:
+            reply.update(reset=True,version=version,snapshot=_db_to_dict(manager.db))
+            return reply
+        reply['version']=version
+        reply['changes']=[{'v':e['v'],'op':e['op'],'args':e['args']} for e in entries if e.get('origin')!=client]
+        reply['pages']={page_id:_page_json(manager,page_id) for page_id in touched}
+    return reply